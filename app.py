@@ -4,6 +4,10 @@ Streamlit program for interacting with the RAG system based on internal document
 This application allows you to:
 - Run a document processing pipeline (chunking, embedding, indexing).
 - Enter a query and get an answer based on information extracted from the documentation.
+- Restrict the search to selected documents.
+
+With RAG_SERVICE_URL set (see server.py) the app is a thin client of the query service:
+queries, document lists and processing requests are sent to the service over HTTP.
 
 Author: zinaliashenko
 Project: RAG Handbook Assistant
@@ -11,18 +15,49 @@ Project: RAG Handbook Assistant
 
 import os
 
+import requests
 import streamlit as st
 
-from utils.config import DATA_PATH
+from utils.config import DATA_PATH, DOCUMENTS_CACHE_TTL, QUERY_SERVICE_TIMEOUT, QUERY_SERVICE_URL
+from utils.llm_interface import print_response_markdown
+from utils.loaders import SUPPORTED_EXTENSIONS
 from utils.pipeline import run_data_pipeline, run_query_answer_pipeline
+from utils.query_engine import QueryEngine
+
+
+@st.cache_resource
+def load_query_engine() -> QueryEngine:
+    """
+    Keeps one QueryEngine (FAISS index and chunk texts) for all Streamlit sessions and reruns.
+    """
+    return QueryEngine()
+
+
+def service_request(method: str, path: str, **kwargs):
+    """
+    Sends a request to the query service and returns the JSON response.
+    """
+    url = QUERY_SERVICE_URL.rstrip("/") + path
+    response = requests.request(method, url, timeout=QUERY_SERVICE_TIMEOUT, **kwargs)
+    response.raise_for_status()
+    return response.json()
+
+
+@st.cache_data(ttl=DOCUMENTS_CACHE_TTL)
+def fetch_documents() -> list[str]:
+    """
+    Returns paths of the documents indexed by the query service (cached for a few seconds).
+    """
+    return service_request("GET", "/documents")
+
 
 # Application title
 st.title("🧠 RAG Handbook Assistant")
 
 # Upload files section
 uploaded_files = st.file_uploader(
-    "📂 Load files (.pdf, .docx, .txt)",
-    type=["pdf", "docx", "txt"],
+    f"📂 Load files ({', '.join(SUPPORTED_EXTENSIONS)})",
+    type=[extension.lstrip(".") for extension in SUPPORTED_EXTENSIONS],
     accept_multiple_files=True,
 )
 
@@ -38,15 +73,49 @@ if uploaded_files:
 # Button to process documents
 if st.button("📄 Data uploaded - process"):
     with st.spinner("Processing documents..."):
-        run_data_pipeline()
+        if QUERY_SERVICE_URL:
+            service_request("POST", "/ingest")
+            fetch_documents.clear()
+        else:
+            run_data_pipeline()
     st.success("Documents processed! You can ask questions.")
 
+# Optional restriction of the search to selected documents (full paths, file names are shown)
+if QUERY_SERVICE_URL:
+    query_engine = None
+    try:
+        documents = fetch_documents()
+    except (requests.RequestException, ValueError) as e:
+        st.error(f"Document list of the query service is not available: {e}")
+        documents = []
+else:
+    query_engine = load_query_engine()
+    try:
+        documents = query_engine.list_documents()
+    except FileNotFoundError:
+        # No index yet, documents are not processed
+        documents = []
+selected_documents = st.multiselect(
+    "📑 Search only in documents (all if empty):",
+    options=sorted(documents, key=lambda path: (os.path.basename(path), path)),
+    format_func=os.path.basename,
+)
+
 # Input for a query
 query = st.text_input("🔍 Enter a question:")
 
 # Query processing and getting answer
 if query:
+    files = selected_documents or None
     with st.spinner("Looking for an answer..."):
-        run_query_answer_pipeline(
-            query=query, run_mode="streamlit", llm_provider="groq"
-        )
+        if QUERY_SERVICE_URL:
+            result = service_request("POST", "/query", json={"query": query, "files": files})
+            print_response_markdown(result["response"])
+        else:
+            run_query_answer_pipeline(
+                query=query,
+                run_mode="streamlit",
+                llm_provider="groq",
+                engine=query_engine,
+                files=files,
+            )
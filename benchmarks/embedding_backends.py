@@ -0,0 +1,137 @@
+"""
+Parity and throughput report of embedding backends against the fp32 PyTorch model.
+
+Encodes the same texts with every requested backend (see EMBEDDING_BACKEND in config.py)
+and measures load time, throughput, cosine agreement of every embedding with the
+fp32 "torch" embedding, and recall@k of nearest neighbours computed with the backend
+embeddings against the fp32 ones. Texts are taken from the chunk store or, if it is
+empty, from a text file (one text per line).
+
+Usage:
+$ python -m benchmarks.embedding_backends --backends torch torch_int8 onnx onnx_int8 --texts 2000
+"""
+
+import argparse
+import json
+from itertools import islice
+from time import perf_counter as timer
+
+import numpy as np
+
+from utils.chunk_store import ChunkStore
+from utils.config import EMBEDDING_MODEL
+from utils.embedder import EMBEDDING_BACKENDS, encode_texts, load_embedding_model
+from utils.retriever import recall_at_k
+from utils.snapshots import current_snapshot
+
+
+def load_texts(store_dir: str, num_texts: int, texts_path: str = None) -> list[str]:
+    """
+    Returns up to num_texts texts from a file or the chunk store.
+    """
+    if texts_path:
+        with open(texts_path, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        return texts[:num_texts]
+
+    store = ChunkStore(store_dir)
+    if not store.exists() or len(store) == 0:
+        raise ValueError("The chunk store is empty. Run the data pipeline first or pass --texts-file.")
+    return list(islice(store.iter_texts(), num_texts))
+
+
+def nearest_neighbours(embeddings: np.ndarray, num_queries: int, k: int) -> np.ndarray:
+    """
+    Returns the k nearest texts (excluding itself) of the first num_queries texts by cosine similarity.
+    """
+    similarities = embeddings[:num_queries] @ embeddings.T
+    np.fill_diagonal(similarities[:, :num_queries], -np.inf)
+    return np.argsort(-similarities, axis=1)[:, :k]
+
+
+def run_report(args) -> list[dict]:
+    """
+    Encodes the texts with every backend and returns one result row per backend.
+    """
+    texts = load_texts(args.store_dir, args.texts, args.texts_file)
+    num_queries = min(args.queries, len(texts))
+    k = min(args.k, len(texts) - 1)
+    print(f"[INFO] {len(texts)} texts, model '{args.model}', batch size {args.batch_size}")
+
+    backends = ["torch"] + [backend for backend in args.backends if backend != "torch"]
+    reference = None
+    results = []
+    for backend in backends:
+        start_time = timer()
+        model = load_embedding_model(backend, args.model)
+        load_time = timer() - start_time
+
+        # Warm-up (graph optimization, memory allocation)
+        encode_texts(texts[: args.batch_size], model, batch_size=args.batch_size)
+
+        start_time = timer()
+        embeddings = encode_texts(texts, model, batch_size=args.batch_size)
+        encode_time = timer() - start_time
+
+        if reference is None:
+            reference = embeddings
+            reference_neighbours = nearest_neighbours(reference, num_queries, k)
+            reference_time = encode_time
+
+        cosine = np.sum(embeddings * reference, axis=1)
+        results.append(
+            {
+                "backend": backend,
+                "load_s": load_time,
+                "texts_per_s": len(texts) / encode_time,
+                "speedup": reference_time / encode_time,
+                "cosine_mean": float(cosine.mean()),
+                "cosine_min": float(cosine.min()),
+                "recall": recall_at_k(nearest_neighbours(embeddings, num_queries, k), reference_neighbours),
+            }
+        )
+        del model
+
+    return results
+
+
+def print_report(results: list[dict], k: int) -> None:
+    """
+    Prints results as a table.
+    """
+    print(
+        f"\n{'backend':<12}{'load s':>8}{'texts/s':>10}{'speedup':>9}"
+        f"{'cos mean':>10}{'cos min':>9}{f'recall@{k}':>10}"
+    )
+    for row in results:
+        print(
+            f"{row['backend']:<12}{row['load_s']:>8.2f}{row['texts_per_s']:>10.1f}{row['speedup']:>9.2f}"
+            f"{row['cosine_mean']:>10.4f}{row['cosine_min']:>9.4f}{row['recall']:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--store-dir", default=None, help="chunk store (default: current snapshot)")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--backends", nargs="+", choices=EMBEDDING_BACKENDS, default=list(EMBEDDING_BACKENDS))
+    parser.add_argument("--texts", type=int, default=2000, help="number of texts to encode")
+    parser.add_argument("--texts-file", help="text file with one text per line")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=200, help="texts used as neighbour queries")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--output", help="save results as JSON")
+    args = parser.parse_args()
+    if args.store_dir is None and args.texts_file is None:
+        snapshot = current_snapshot()
+        if snapshot is None:
+            parser.error("no published snapshot: run the data pipeline first or pass --store-dir or --texts-file")
+        args.store_dir = snapshot.store_dir
+
+    results = run_report(args)
+    print_report(results, args.k)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"[INFO] Report saved to '{args.output}'.")
@@ -0,0 +1,390 @@
+"""
+End-to-end benchmark of ingestion and querying on synthetic PDF corpora, fully offline.
+
+For every corpus size (in pages) the suite:
+1. generates a synthetic handbook corpus of PDFs (seeded, cached in the work directory);
+2. runs run_data_pipeline() from scratch in a separate process (RAG_DATA_PATH / RAG_CHUNKS_DIR
+   point to the corpus) and reads the per-stage ingestion times from the tracing spans;
+3. measures latency percentiles (p50/p95/p99) and QPS of the retrieval path
+   (query embedding + search, as in run_query_answer_pipeline);
+4. measures end-to-end latency of run_query_answer_pipeline() with the local fake LLM
+   server (benchmarks/fake_llm_server.py) in place of the Groq endpoint.
+
+Results are saved as JSON (with the git commit), so runs of different commits can be compared
+with --baseline. The embedding model must be available locally (e.g. in the Hugging Face cache).
+
+Usage:
+$ python -m benchmarks.end_to_end --pages 10 1000 10000 --output bench.json
+$ python -m benchmarks.end_to_end --pages 10 1000 10000 --baseline bench.json --output bench_new.json
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import random
+import resource
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter as timer
+
+import numpy as np
+
+from benchmarks.fake_llm_server import make_server
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+DEPARTMENTS = ["engineering", "sales", "finance", "marketing", "support", "legal", "operations", "research"]
+TOPICS = [
+    "paid vacation", "sick leave", "parental leave", "remote work", "travel expenses", "overtime",
+    "health insurance", "training budget", "equipment", "security incidents", "performance reviews",
+]
+SENTENCES = [
+    "Employees in the {dept} department are entitled to {n} days of {topic} per year.",
+    "Requests for {topic} must be submitted with form {code} at least {n} days in advance.",
+    "The {dept} manager approves {topic} requests within {n} business days.",
+    "Questions about {topic} should be sent to the {dept} team or HR using form {code}.",
+    "Policy {code} describes how {topic} is handled for new employees in {dept}.",
+    "Unused {topic} can be carried over for up to {n} months with manager approval.",
+]
+QUESTIONS = [
+    "How many days of {topic} do employees in {dept} get?",
+    "Which form is used to request {topic}?",
+    "Who approves {topic} in the {dept} department?",
+    "Can unused {topic} be carried over?",
+    "What does policy {code} say about {topic}?",
+]
+
+# Percentiles reported for latency distributions
+PERCENTILES = (50, 95, 99)
+
+
+def _fill(template: str, rng: random.Random) -> str:
+    return template.format(
+        dept=rng.choice(DEPARTMENTS),
+        topic=rng.choice(TOPICS),
+        n=rng.randint(1, 30),
+        code=f"HR-{rng.randint(100, 999)}",
+    )
+
+
+def generate_corpus(corpus_dir: str, pages: int, pages_per_file: int = 500, seed: int = 0) -> list[str]:
+    """
+    Writes a synthetic handbook corpus of `pages` pages split into PDFs of pages_per_file pages.
+    An existing complete corpus with the same parameters is reused.
+    """
+    import fitz  # PyMuPDF
+
+    marker_path = os.path.join(corpus_dir, ".corpus.json")
+    marker = {"pages": pages, "pages_per_file": pages_per_file, "seed": seed}
+    if os.path.exists(marker_path):
+        with open(marker_path, "r", encoding="utf-8") as f:
+            if json.load(f) == marker:
+                return sorted(os.path.join(corpus_dir, name) for name in os.listdir(corpus_dir) if name.endswith(".pdf"))
+
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+    os.makedirs(corpus_dir)
+    start_time = timer()
+    rng = random.Random(seed)
+    paths = []
+    for file_idx, first_page in enumerate(range(0, pages, pages_per_file)):
+        path = os.path.join(corpus_dir, f"handbook_{file_idx:05d}.pdf")
+        with fitz.open() as doc:
+            for page_number in range(first_page, min(first_page + pages_per_file, pages)):
+                paragraphs = [
+                    " ".join(_fill(rng.choice(SENTENCES), rng) for _ in range(rng.randint(3, 6)))
+                    for _ in range(4)
+                ]
+                page = doc.new_page()
+                page.insert_textbox(
+                    fitz.Rect(50, 50, 550, 800), f"Section {page_number + 1}\n\n" + "\n\n".join(paragraphs), fontsize=9
+                )
+            doc.save(path)
+        paths.append(path)
+
+    with open(marker_path, "w", encoding="utf-8") as f:
+        json.dump(marker, f)
+    print(f"[INFO] Generated {pages} pages in {len(paths)} PDFs in {timer() - start_time:.1f} seconds.")
+    return paths
+
+
+def all_queries() -> list[str]:
+    """
+    Returns every distinct question the QUESTIONS templates can produce.
+    """
+    values = {
+        "dept": DEPARTMENTS,
+        "topic": TOPICS,
+        "n": [str(n) for n in range(1, 31)],
+        "code": [f"HR-{code}" for code in range(100, 1000)],
+    }
+    queries = []
+    for template in QUESTIONS:
+        fields = [field for _, field, _, _ in string.Formatter().parse(template) if field]
+        for combination in itertools.product(*(values[field] for field in fields)):
+            queries.append(template.format(**dict(zip(fields, combination))))
+    return queries
+
+
+def make_queries(num_queries: int, seed: int = 1, exclude: set[str] = frozenset()) -> list[str]:
+    """
+    Returns num_queries distinct synthetic questions about the corpus topics (none of exclude).
+    Raises ValueError if the templates cannot produce that many.
+    """
+    candidates = [query for query in all_queries() if query not in exclude]
+    if num_queries > len(candidates):
+        raise ValueError(
+            f"{num_queries} distinct queries requested, the question templates produce only {len(candidates)}."
+        )
+    return random.Random(seed).sample(candidates, num_queries)
+
+
+def latency_stats(latencies: list[float], total_time: float) -> dict:
+    """
+    Returns latency percentiles and mean in milliseconds and queries per second.
+    """
+    values = np.asarray(latencies) * 1000
+    stats = {f"p{p}_ms": round(float(np.percentile(values, p)), 3) for p in PERCENTILES}
+    stats["mean_ms"] = round(float(values.mean()), 3)
+    stats["qps"] = round(len(latencies) / total_time, 2)
+    stats["queries"] = len(latencies)
+    return stats
+
+
+def read_spans(path: str) -> list[dict]:
+    """
+    Reads spans written by utils.tracing (JSON lines).
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_corpus_benchmark(args) -> dict:
+    """
+    Child process: ingests the corpus and measures queries. Paths and the LLM endpoint
+    are set through the environment before utils is imported.
+    """
+    from utils.answer_cache import AnswerCache
+    from utils.config import CHUNKS_DIR, HYBRID_SEARCH, METRICS_JSONL_PATH, TOP_K
+    from utils.embedder import embed_query, get_embedding_model
+    from utils.pipeline import run_data_pipeline, run_query_answer_pipeline
+    from utils.query_engine import QueryEngine
+
+    get_embedding_model()
+    queries = make_queries(args.queries + args.e2e_queries, seed=args.seed + 1)
+    retrieval_queries, e2e_queries = queries[: args.queries], queries[args.queries :]
+
+    # Ingestion
+    start_time = timer()
+    run_data_pipeline(full_rebuild=True)
+    ingest_time = timer() - start_time
+    spans = read_spans(METRICS_JSONL_PATH)
+    stages = {span["span"]: span for span in spans if span["span"].startswith("ingest")}
+    chunks = stages.get("ingest_chunks", {}).get("chunks", 0)
+
+    engine = QueryEngine()
+    engine.refresh()
+
+    # Retrieval path: query embedding (not cached, queries are distinct) + search
+    def retrieve(query: str) -> float:
+        query_start = timer()
+        query_embedding = embed_query(query)
+        if HYBRID_SEARCH:
+            engine.retrieve_hybrid(query=query, query_embedding=query_embedding, k=TOP_K)
+        else:
+            engine.retrieve(query_embedding=query_embedding, k=TOP_K)
+        return timer() - query_start
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # Warmup texts differ from the measured ones, whose embeddings must not be in the query cache
+        warmup_queries = make_queries(args.warmup, seed=args.seed + 2, exclude=set(queries))
+        for query in warmup_queries:
+            retrieve(query)
+
+        start_time = timer()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            retrieval_latencies = list(executor.map(retrieve, retrieval_queries))
+        retrieval_time = timer() - start_time
+
+        # End to end with the fake LLM; the cache threshold above 1 makes every lookup a miss
+        cache = AnswerCache(path=os.path.join(CHUNKS_DIR, "bench_answer_cache.jsonl"), threshold=2.0)
+        e2e_latencies = []
+        start_time = timer()
+        for query in e2e_queries:
+            query_start = timer()
+            run_query_answer_pipeline(query, engine=engine, cache=cache, stream=args.stream, relevance_threshold=0.0)
+            e2e_latencies.append(timer() - query_start)
+        e2e_time = timer() - start_time
+
+    query_spans = [span for span in read_spans(METRICS_JSONL_PATH)[len(spans) :] if span["trace"] is not None]
+    e2e_stages = {}
+    for name in ("embed", "search", "answer_cache_lookup", "prompt", "llm", "time_to_first_token"):
+        seconds = [span["seconds"] for span in query_spans if span["span"] == name]
+        if seconds:
+            e2e_stages[name] = {f"p{p}_ms": round(float(np.percentile(seconds, p)) * 1000, 3) for p in PERCENTILES}
+
+    return {
+        "pages": args.child_pages,
+        "files": len([name for name in os.listdir(os.environ["RAG_DATA_PATH"]) if name.endswith(".pdf")]),
+        "chunks": chunks,
+        "ingest": {
+            "total_s": round(ingest_time, 3),
+            "pages_per_s": round(args.child_pages / ingest_time, 1),
+            "chunks_per_s": round(chunks / ingest_time, 1),
+            "stages_s": {name: round(span["seconds"], 3) for name, span in stages.items()},
+        },
+        "retrieval": {**latency_stats(retrieval_latencies, retrieval_time), "concurrency": args.concurrency},
+        "end_to_end": {**latency_stats(e2e_latencies, e2e_time), "stream": args.stream, "stages": e2e_stages},
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def git_commit() -> str | None:
+    """
+    Returns the current git commit of the repository, None outside a git checkout.
+    """
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        )
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args) -> dict:
+    """
+    Runs the benchmark for every corpus size, each in a fresh process with its own chunk directory.
+    """
+    server = make_server(port=0, token_delay=args.llm_delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+
+    results = []
+    try:
+        for pages in args.pages:
+            corpus_dir = os.path.join(args.work_dir, f"corpus_{pages}")
+            generate_corpus(corpus_dir, pages, args.pages_per_file, seed=args.seed)
+
+            chunks_dir = os.path.join(args.work_dir, f"chunks_{pages}")
+            shutil.rmtree(chunks_dir, ignore_errors=True)
+            os.makedirs(chunks_dir)
+            result_path = os.path.join(chunks_dir, "result.json")
+            env = {
+                **os.environ,
+                "RAG_DATA_PATH": corpus_dir,
+                "RAG_CHUNKS_DIR": chunks_dir,
+                "METRICS_JSONL_PATH": os.path.join(chunks_dir, "spans.jsonl"),
+                "GROQ_BASE_URL": base_url,
+                "GROQ_API_KEY": "fake",
+            }
+            command = [
+                sys.executable, "-m", "benchmarks.end_to_end",
+                "--child-pages", str(pages), "--child-output", result_path,
+                "--queries", str(args.queries), "--e2e-queries", str(args.e2e_queries),
+                "--warmup", str(args.warmup), "--concurrency", str(args.concurrency), "--seed", str(args.seed),
+            ] + (["--stream"] if args.stream else [])
+
+            print(f"[INFO] Benchmarking {pages} pages...")
+            log_path = os.path.join(chunks_dir, "pipeline.log")
+            with open(log_path, "w", encoding="utf-8") as log:
+                completed = subprocess.run(command, cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+            if completed.returncode != 0:
+                raise RuntimeError(f"Benchmark of {pages} pages failed, see '{log_path}'.")
+            with open(result_path, "r", encoding="utf-8") as f:
+                results.append(json.load(f))
+    finally:
+        server.shutdown()
+
+    return {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "queries": args.queries,
+            "e2e_queries": args.e2e_queries,
+            "concurrency": args.concurrency,
+            "stream": args.stream,
+            "llm_delay": args.llm_delay,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+# (section, metric, higher is better) pairs compared with a baseline
+COMPARED_METRICS = [
+    ("ingest", "chunks_per_s", True),
+    ("retrieval", "p50_ms", False),
+    ("retrieval", "p95_ms", False),
+    ("retrieval", "p99_ms", False),
+    ("retrieval", "qps", True),
+    ("end_to_end", "p50_ms", False),
+    ("end_to_end", "p95_ms", False),
+]
+
+
+def print_report(report: dict, baseline: dict | None = None) -> None:
+    """
+    Prints results as a table; with a baseline, the change of every metric in percent
+    (positive is better).
+    """
+    baseline_results = {result["pages"]: result for result in (baseline or {}).get("results", [])}
+    print(f"\nCommit {report['commit']}" + (f" vs baseline {baseline.get('commit')}" if baseline else ""))
+    print(f"{'pages':>8}{'chunks':>9}  {'metric':<24}{'value':>12}{'baseline':>12}{'change':>9}")
+    for result in report["results"]:
+        previous = baseline_results.get(result["pages"])
+        for section, metric, higher_is_better in COMPARED_METRICS:
+            value = result[section][metric]
+            line = f"{result['pages']:>8}{result['chunks']:>9}  {section + '.' + metric:<24}{value:>12.3f}"
+            if previous is not None:
+                old = previous[section][metric]
+                change = (value - old) / old * 100 if old else 0.0
+                line += f"{old:>12.3f}{(change if higher_is_better else -change):>+8.1f}%"
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 1000, 10000], help="corpus sizes in pages")
+    parser.add_argument("--pages-per-file", type=int, default=500)
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "rag_benchmarks"))
+    parser.add_argument("--queries", type=int, default=500, help="queries for retrieval latency")
+    parser.add_argument("--e2e-queries", type=int, default=50, help="queries answered end to end")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=1, help="parallel retrieval queries")
+    parser.add_argument("--stream", action="store_true", help="stream end-to-end answers")
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="fake LLM delay per token in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="JSON report of a previous run to compare with")
+    parser.add_argument("--output", default="end_to_end.json", help="JSON report")
+    parser.add_argument("--child-pages", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--child-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_output:
+        result = run_corpus_benchmark(args)
+        with open(args.child_output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        sys.exit(0)
+
+    report = run_suite(args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[INFO] Report saved to '{args.output}'.")
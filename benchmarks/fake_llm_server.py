@@ -0,0 +1,141 @@
+"""
+A local fake OpenAI-compatible LLM server for testing the LLM client without network access.
+
+Serves POST /chat/completions (and /v1/chat/completions) with a fixed JSON answer,
+either as one response or as a server-sent event stream (`"stream": true`).
+Rate limiting can be simulated: every N-th request fails with 429.
+
+Usage:
+$ python -m benchmarks.fake_llm_server --port 8001 --token-delay 0.02 --fail-every 3
+$ GROQ_BASE_URL=http://127.0.0.1:8001/v1 GROQ_API_KEY=fake python run_pipeline.py
+
+Functions:
+- make_server(host, port, answer, token_delay, fail_every): returns a ThreadingHTTPServer (not started).
+"""
+
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = json.dumps(
+    {
+        "thoughts": "Answer from the fake LLM server.",
+        "answer": "This is a **fake** answer: \"quoted\", unicode é \U0001F600.",
+    }
+)
+
+
+def _split_tokens(text: str) -> list[str]:
+    """
+    Splits text into small pieces similar to LLM tokens.
+    """
+    return [text[i : i + 4] for i in range(0, len(text), 4)]
+
+
+def make_server(
+    host: str = "127.0.0.1",
+    port: int = 8001,
+    answer: str = DEFAULT_ANSWER,
+    token_delay: float = 0.0,
+    fail_every: int = 0,
+) -> ThreadingHTTPServer:
+    """
+    Creates the fake server. Call serve_forever() (e.g. in a thread) to start it.
+    `server.requests_count` holds the number of received requests.
+    """
+    counter = itertools.count(1)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict, headers: dict = None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path.rstrip("/") not in ("/chat/completions", "/v1/chat/completions"):
+                self._send_json(404, {"error": {"message": "Not found"}})
+                return
+
+            with lock:
+                request_number = next(counter)
+                server.requests_count = request_number
+
+            if fail_every and request_number % fail_every == 0:
+                self._send_json(
+                    429,
+                    {"error": {"message": "Rate limit exceeded", "type": "rate_limit"}},
+                    headers={"retry-after-ms": "10"},
+                )
+                return
+
+            model = body.get("model", "fake-model")
+            if not body.get("stream"):
+                self._send_json(
+                    200,
+                    {
+                        "id": f"chatcmpl-{request_number}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": answer},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                    },
+                )
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for token in _split_tokens(answer):
+                time.sleep(token_delay)
+                chunk = {
+                    "id": f"chatcmpl-{request_number}",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.requests_count = 0
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed tokens")
+    parser.add_argument("--fail-every", type=int, default=0, help="Every N-th request returns 429 (0 - never)")
+    args = parser.parse_args()
+
+    fake_server = make_server(args.host, args.port, token_delay=args.token_delay, fail_every=args.fail_every)
+    print(f"[INFO] Fake LLM server on http://{args.host}:{args.port}/v1")
+    fake_server.serve_forever()
@@ -0,0 +1,196 @@
+"""
+Recall@k report of approximate and compressed FAISS indexes against the exact (flat) index.
+
+Builds every requested index type over the embeddings in the chunk store and measures,
+for each nprobe / efSearch value, recall@k against flat search, query latency,
+build time, index size and bytes per vector, and checks that a search filtered to
+id ranges (as for selected documents) returns only ids of these ranges. Compressed indexes (int8, fp16, PQ codes)
+are measured with every re-scoring factor: 0 ranks by the compressed codes, n > 0 re-scores
+n * k candidates with the memory-mapped float32 embeddings (as in serving).
+Queries are a random sample of stored embeddings or embedded questions from a text file (one per line).
+
+Usage:
+$ python -m benchmarks.index_recall --types hnsw ivf_flat ivf_pq --k 5 --output recall.json
+$ python -m benchmarks.index_recall --types sq8 fp16 pq ivf_sq8 ivf_pq --rescore 0 2 4 8
+"""
+
+import argparse
+import json
+from time import perf_counter as timer
+
+import faiss
+import numpy as np
+
+from utils.chunk_store import ChunkStore
+from utils.retriever import (
+    COMPRESSED_INDEX_TYPES,
+    IVF_INDEX_TYPES,
+    build_index,
+    get_index_type,
+    recall_at_k,
+    search_index,
+    search_subset,
+)
+from utils.snapshots import current_snapshot
+
+
+def load_queries(embeddings: np.ndarray, num_queries: int, questions_path: str = None) -> np.ndarray:
+    """
+    Returns query embeddings: embedded questions or a random sample of stored embeddings.
+    """
+    if questions_path:
+        from utils.embedder import encode_texts
+
+        with open(questions_path, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        return encode_texts(questions, batch_size=64)
+
+    rng = np.random.default_rng(0)
+    rows = rng.choice(embeddings.shape[0], size=min(num_queries, embeddings.shape[0]), replace=False)
+    return np.ascontiguousarray(embeddings[np.sort(rows)])
+
+
+def timed_search(
+    index: faiss.Index, queries: np.ndarray, k: int, setting: dict, embeddings: np.ndarray = None
+) -> tuple[np.ndarray, float]:
+    """
+    Searches queries one by one (as in serving) and returns indices and mean latency in ms.
+    """
+    indices = np.empty((queries.shape[0], k), dtype="int64")
+    start_time = timer()
+    for i in range(queries.shape[0]):
+        indices[i : i + 1], _ = search_index(index, queries[i : i + 1], k, embeddings=embeddings, **setting)
+    latency_ms = (timer() - start_time) * 1000 / queries.shape[0]
+    return indices, latency_ms
+
+
+def filter_ranges(num_vectors: int) -> list[tuple[int, int]]:
+    """
+    Id ranges of the first and the third quarter of the chunks (two "selected documents").
+    """
+    quarter = max(num_vectors // 4, 1)
+    return [(0, quarter), (2 * quarter, min(3 * quarter, num_vectors))]
+
+
+def check_filtered_search(
+    index: faiss.Index, embeddings: np.ndarray, queries: np.ndarray, k: int, setting: dict
+) -> float:
+    """
+    Searches queries restricted to filter_ranges() in the index (id selector, not the exact
+    subset search) and returns recall@k against the exact subset search.
+    Raises RuntimeError if an id outside the ranges is returned.
+    """
+    id_ranges = filter_ranges(embeddings.shape[0])
+    indices, _ = search_index(
+        index, queries, k, id_ranges=id_ranges, embeddings=embeddings, brute_force_max=0, **setting
+    )
+    found = indices[indices >= 0]
+    inside = np.zeros(found.shape, dtype=bool)
+    for start, end in id_ranges:
+        inside |= (found >= start) & (found < end)
+    if not inside.all():
+        raise RuntimeError(f"Filtered search in '{get_index_type(index)}' returned ids outside {id_ranges}.")
+    exact_indices, _ = search_subset(embeddings, queries, id_ranges, k)
+    return recall_at_k(indices, exact_indices)
+
+
+def run_report(args) -> list[dict]:
+    """
+    Builds the indexes and returns one result row per index type and search setting.
+    """
+    embeddings = ChunkStore(args.store_dir).load_embeddings()
+    if embeddings.shape[0] == 0:
+        raise ValueError("The chunk store has no embeddings. Run the data pipeline first.")
+    ids = np.arange(embeddings.shape[0], dtype="int64")
+    queries = load_queries(embeddings, args.queries, args.questions)
+    print(f"[INFO] {embeddings.shape[0]} vectors, {queries.shape[0]} queries, k={args.k}")
+
+    flat = build_index(embeddings, ids, index_type="flat")
+    exact_indices, flat_latency = timed_search(flat, queries, args.k, {})
+    flat_bytes = faiss.serialize_index(flat).nbytes
+    results = [
+        {
+            "index_type": "flat",
+            "recall": 1.0,
+            "filtered_recall": check_filtered_search(flat, embeddings, queries, args.k, {}),
+            "latency_ms": flat_latency,
+            "size_mb": flat_bytes / 2**20,
+            "bytes_per_vector": flat_bytes / flat.ntotal,
+        }
+    ]
+
+    for index_type in args.types:
+        start_time = timer()
+        index = build_index(embeddings, ids, index_type=index_type)
+        build_time = timer() - start_time
+        index_bytes = faiss.serialize_index(index).nbytes
+
+        if index_type == "hnsw":
+            settings = [{"ef_search": ef} for ef in args.ef_search]
+        elif index_type in IVF_INDEX_TYPES:
+            settings = [{"nprobe": nprobe} for nprobe in args.nprobe]
+        else:
+            settings = [{}]
+        if index_type in COMPRESSED_INDEX_TYPES:
+            settings = [{**setting, "rescore_factor": factor} for setting in settings for factor in args.rescore]
+
+        for setting in settings:
+            approx_indices, latency = timed_search(index, queries, args.k, setting, embeddings)
+            results.append(
+                {
+                    "index_type": index_type,
+                    **setting,
+                    "recall": recall_at_k(approx_indices, exact_indices),
+                    "filtered_recall": check_filtered_search(index, embeddings, queries, args.k, setting),
+                    "latency_ms": latency,
+                    "build_s": build_time,
+                    "size_mb": index_bytes / 2**20,
+                    "bytes_per_vector": index_bytes / index.ntotal,
+                }
+            )
+
+    return results
+
+
+def print_report(results: list[dict], k: int) -> None:
+    """
+    Prints results as a table.
+    """
+    print(
+        f"\n{'index':<10}{'setting':<28}{f'recall@{k}':>10}{'filtered':>10}"
+        f"{'latency ms':>12}{'size MB':>10}{'B/vector':>10}"
+    )
+    for row in results:
+        setting = ", ".join(
+            f"{key}={row[key]}" for key in ("nprobe", "ef_search", "rescore_factor") if key in row
+        )
+        print(
+            f"{row['index_type']:<10}{setting:<28}{row['recall']:>10.3f}{row['filtered_recall']:>10.3f}"
+            f"{row['latency_ms']:>12.3f}{row['size_mb']:>10.1f}{row['bytes_per_vector']:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--store-dir", default=None, help="chunk store (default: current snapshot)")
+    parser.add_argument("--types", nargs="+", default=["hnsw", "ivf_flat", "ivf_pq"])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--questions", help="text file with one question per line")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument(
+        "--rescore", type=int, nargs="+", default=[0, 4], help="re-scoring factors of compressed indexes"
+    )
+    parser.add_argument("--output", help="save results as JSON")
+    args = parser.parse_args()
+    if args.store_dir is None:
+        args.store_dir = current_snapshot().store_dir
+
+    results = run_report(args)
+    print_report(results, args.k)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"[INFO] Report saved to '{args.output}'.")
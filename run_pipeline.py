@@ -3,21 +3,69 @@ CLI interface for running RAG pipeline from console.
 
 This script allows you to:
 - Process all documents (chunking, embedding, indexing).
-- Enter a query manually via console.
+- Enter queries manually via console (an empty query exits).
 - Get a response based on the processed documentation.
+- Answer a JSONL file of queries in batch mode.
 
 Usage:
 $ python run_pipeline.py
+$ python run_pipeline.py --rerank
+$ python run_pipeline.py --metrics-jsonl spans.jsonl --metrics-port 9100 --log-level DEBUG
+$ python run_pipeline.py --batch queries.jsonl --output answers.jsonl --concurrency 8
+$ python run_pipeline.py --batch queries.jsonl --no-hybrid --no-answer-cache
 """
 
-from utils.pipeline import run_data_pipeline, run_query_answer_pipeline
+import argparse
+
+from utils.config import BATCH_LLM_CONCURRENCY, HYBRID_SEARCH, LOG_LEVEL, METRICS_JSONL_PATH, METRICS_PORT
+from utils.pipeline import (
+    run_batch_query_pipeline,
+    run_data_pipeline,
+    run_query_answer_pipeline,
+)
+from utils.query_engine import get_query_engine
+from utils.reranker import get_reranker
+from utils.tracing import configure, start_metrics_server
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="RAG Handbook Assistant CLI")
+    parser.add_argument("--batch", help="JSONL file with queries ({\"query\": ...} per line)")
+    parser.add_argument("--output", default="answers.jsonl", help="JSONL file for batch answers")
+    parser.add_argument("--concurrency", type=int, default=BATCH_LLM_CONCURRENCY)
+    parser.add_argument("--no-hybrid", dest="hybrid", action="store_false", default=HYBRID_SEARCH,
+                        help="batch mode: vector search only, without BM25 keyword search")
+    parser.add_argument("--no-answer-cache", action="store_true",
+                        help="batch mode: always call LLM, do not read or write the answer cache")
+    parser.add_argument("--rerank", action="store_true", help="re-rank retrieved chunks with a cross-encoder")
+    parser.add_argument("--metrics-jsonl", default=METRICS_JSONL_PATH, help="append stage spans to a JSONL file")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="serve Prometheus metrics (0 - off)")
+    parser.add_argument("--log-level", default=LOG_LEVEL, choices=["DEBUG", "INFO"], type=str.upper)
+    args = parser.parse_args()
+
+    configure(jsonl_path=args.metrics_jsonl, log_level=args.log_level)
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
     print("[CLI MODE] Start pipeline...")
     run_data_pipeline()
 
-    user_query = input("Input your query: ")
-    run_query_answer_pipeline(query=user_query,
-                              run_mode="console",
-                              llm_provider="groq")
+    # Index and chunks are loaded once and reused for all queries
+    engine = get_query_engine()
+
+    if args.batch:
+        run_batch_query_pipeline(queries=args.batch,
+                                 output_path=args.output,
+                                 engine=engine,
+                                 concurrency=args.concurrency,
+                                 hybrid=args.hybrid,
+                                 use_cache=not args.no_answer_cache)
+    else:
+        user_query = input("Input your query: ")
+        while user_query.strip():
+            run_query_answer_pipeline(query=user_query,
+                                      run_mode="console",
+                                      llm_provider="groq",
+                                      engine=engine,
+                                      reranker=get_reranker() if args.rerank else None)
+            user_query = input("Input your query: ")
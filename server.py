@@ -0,0 +1,115 @@
+"""
+HTTP query service of the RAG system for many simultaneous users.
+
+One process keeps the FAISS index, chunk store and models in memory; concurrent queries
+are embedded and searched in micro-batches and their LLM calls run concurrently
+(see utils/query_service.py).
+
+Endpoints:
+- POST /query {"query": ..., "files": [...] (optional, paths as in GET /documents)}: answer with the used chunk ids;
+- GET /documents: paths of the indexed documents;
+- POST /ingest: processes new and changed documents of the data folder;
+- GET /health: number of indexed chunks;
+- GET /metrics: stage latencies and counters in the Prometheus text format.
+
+Usage:
+$ python server.py
+$ python server.py --host 0.0.0.0 --port 8000 --rerank --metrics-jsonl spans.jsonl
+"""
+
+import argparse
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from utils.config import LOG_LEVEL, METRICS_JSONL_PATH, QUERY_SERVICE_HOST, QUERY_SERVICE_PORT, RELEVANCE_THRESHOLD
+from utils.pipeline import run_data_pipeline
+from utils.query_service import QueryService
+from utils.reranker import get_reranker
+from utils.tracing import configure, render_prometheus
+
+# Documents are processed by one request at a time
+_ingest_lock = threading.Lock()
+
+
+class QueryRequest(BaseModel):
+    query: str
+    files: list[str] | None = None
+    relevance_threshold: float = RELEVANCE_THRESHOLD
+
+
+def create_app(rerank: bool = False) -> FastAPI:
+    """
+    Creates the FastAPI application; the query service (index and models) is loaded at startup.
+    """
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        app.state.service = QueryService(reranker=get_reranker() if rerank else None)
+        yield
+        app.state.service.close()
+
+    app = FastAPI(title="RAG Handbook Assistant", lifespan=lifespan)
+
+    @app.post("/query")
+    async def query(request: QueryRequest) -> dict:
+        if not request.query.strip():
+            raise HTTPException(status_code=400, detail="Empty query.")
+        try:
+            return await app.state.service.answer(
+                request.query, files=request.files, relevance_threshold=request.relevance_threshold
+            )
+        except FileNotFoundError:
+            raise HTTPException(status_code=409, detail="Documents are not processed yet.")
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"{type(e).__name__}: {e}")
+
+    @app.get("/documents")
+    async def documents() -> list[str]:
+        try:
+            return await asyncio.to_thread(app.state.service.list_documents)
+        except FileNotFoundError:
+            return []
+
+    @app.post("/ingest")
+    async def ingest() -> dict:
+        def run() -> None:
+            with _ingest_lock:
+                run_data_pipeline()
+
+        await asyncio.to_thread(run)
+        return {"documents": len(await documents())}
+
+    @app.get("/health")
+    async def health() -> dict:
+        engine = app.state.service.engine
+        try:
+            await asyncio.to_thread(engine.refresh)
+        except FileNotFoundError:
+            return {"status": "ok", "chunks": 0}
+        return {"status": "ok", "chunks": engine.index.ntotal}
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics() -> str:
+        return render_prometheus()
+
+    return app
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="RAG Handbook Assistant query service")
+    parser.add_argument("--host", default=QUERY_SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=QUERY_SERVICE_PORT)
+    parser.add_argument("--rerank", action="store_true", help="re-rank retrieved chunks with a cross-encoder")
+    parser.add_argument("--metrics-jsonl", default=METRICS_JSONL_PATH, help="append stage spans to a JSONL file")
+    parser.add_argument("--log-level", default=LOG_LEVEL, choices=["DEBUG", "INFO"], type=str.upper)
+    args = parser.parse_args()
+
+    configure(jsonl_path=args.metrics_jsonl, log_level=args.log_level)
+    uvicorn.run(create_app(rerank=args.rerank), host=args.host, port=args.port, log_level="warning")
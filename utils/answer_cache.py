@@ -0,0 +1,250 @@
+"""
+A semantic cache of LLM answers keyed on query embeddings.
+
+A cached answer is reused for a new query when:
+- the cosine similarity of the query embeddings is at least the threshold;
+- the same chunk ids were retrieved for both queries (chunk ids are never reused for
+  other texts until the index is rebuilt, so the context of the prompt is the same);
+- the entry is not older than the TTL and belongs to the index generation of the query.
+
+Entries of other index generations are skipped, not removed, so processes serving
+different snapshots (e.g. while a new snapshot is being picked up) share one cache.
+
+The cache is an append-only JSONL file, one entry (with its base64 float32 query embedding)
+per line: put() appends one line, lookup() only reads lines appended by other processes.
+Entries are evicted by least recent use in memory; the file is rewritten with the kept
+entries when it holds twice as many lines as the cache size.
+
+Classes:
+- AnswerCache: lookup(query_embedding, indices, generation) and put(...) of LLM answers.
+
+Functions:
+- get_answer_cache(): returns a process-wide AnswerCache instance.
+"""
+
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from .config import (
+    ANSWER_CACHE_PATH,
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_TTL,
+)
+
+# The file is compacted when it has this many lines per cache entry
+COMPACT_RATIO = 2
+
+
+class AnswerCache:
+    """
+    Keeps answers with their query embeddings in memory and in an append-only file.
+    Every entry holds query, chunk ids, response text, index generation, creation and last use time.
+    """
+
+    def __init__(
+        self,
+        path: str = ANSWER_CACHE_PATH,
+        max_entries: int = ANSWER_CACHE_SIZE,
+        ttl: float = ANSWER_CACHE_TTL,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+
+        self.embeddings = np.empty((0, 0), dtype="float32")
+        self.entries = []
+
+        # Read position and inode of the file; lines of the file (written by any process)
+        self._offset = 0
+        self._inode = None
+        self._file_lines = 0
+        # Ids of entries appended by this process and not read back from the file yet
+        self._own = set()
+        self._lock = threading.Lock()
+
+    def _reset(self) -> None:
+        self.embeddings, self.entries = np.empty((0, 0), dtype="float32"), []
+        self._offset, self._inode, self._file_lines = 0, None, 0
+        self._own = set()
+
+    def _read_new_lines(self) -> None:
+        """
+        Reads entries appended since the last read; reloads the file if it was
+        compacted (replaced) by another process.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self._inode is not None:
+                self._reset()
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            self._reset()
+            self._inode = stat.st_ino
+        if stat.st_size == self._offset:
+            return
+
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(stat.st_size - self._offset)
+        # A line being written by another process is read next time
+        complete = data.rfind(b"\n") + 1
+        self._offset += complete
+
+        embeddings, entries = [], []
+        for line in data[:complete].splitlines():
+            try:
+                entry = json.loads(line)
+                embedding = np.frombuffer(base64.b64decode(entry.pop("embedding")), dtype="float32")
+            except (ValueError, KeyError):
+                continue
+            self._file_lines += 1
+            if entry.get("id") in self._own:
+                # Already in memory since put()
+                self._own.discard(entry["id"])
+                continue
+            entry["last_used"] = entry["created"]
+            embeddings.append(embedding)
+            entries.append(entry)
+        if entries:
+            self._add(np.vstack(embeddings), entries)
+
+    def _add(self, embeddings: np.ndarray, entries: list[dict]) -> None:
+        """
+        Adds entries to memory, evicting expired and least recently used ones.
+        """
+        self.embeddings = np.vstack([self.embeddings, embeddings]) if self.entries else embeddings
+        self.entries.extend(entries)
+
+        now = time.time()
+        self._drop(np.array([now - e["created"] <= self.ttl for e in self.entries]))
+        if len(self.entries) > self.max_entries:
+            last_used = np.array([e["last_used"] for e in self.entries])
+            keep = np.zeros(len(self.entries), dtype=bool)
+            keep[np.argsort(-last_used, kind="stable")[: self.max_entries]] = True
+            self._drop(keep)
+
+    def _drop(self, keep: np.ndarray) -> None:
+        self.embeddings = self.embeddings[keep]
+        self.entries = [entry for entry, kept in zip(self.entries, keep) if kept]
+
+    @staticmethod
+    def _line(entry: dict, embedding: np.ndarray) -> bytes:
+        record = {key: value for key, value in entry.items() if key != "last_used"}
+        record["embedding"] = base64.b64encode(np.asarray(embedding, dtype="float32").tobytes()).decode("ascii")
+        return (json.dumps(record) + "\n").encode("utf-8")
+
+    def _append(self, entry: dict, embedding: np.ndarray) -> None:
+        """
+        Appends one entry in a single write (O_APPEND keeps lines of concurrent processes whole).
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(self._line(entry, embedding))
+        self._own.add(entry["id"])
+
+    def _compact(self) -> None:
+        """
+        Rewrites the file with the entries kept in memory (temporary file + rename).
+        An entry appended by another process during the rewrite can be lost.
+        """
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            for entry, embedding in zip(self.entries, self.embeddings):
+                f.write(self._line(entry, embedding))
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self._offset, self._inode, self._file_lines = stat.st_size, stat.st_ino, len(self.entries)
+        self._own = set()
+
+    def lookup(self, query_embedding: np.ndarray, indices: list[int], generation=None) -> dict | None:
+        """
+        Returns the most similar valid entry of the given index generation for the query, or None.
+        The returned entry has a "similarity" field.
+        """
+        with self._lock:
+            self._read_new_lines()
+            if not self.entries:
+                return None
+
+            similarities = self.embeddings @ np.asarray(query_embedding, dtype="float32")
+            now = time.time()
+            for row in np.argsort(-similarities):
+                if similarities[row] < self.threshold:
+                    break
+                entry = self.entries[row]
+                if (
+                    entry.get("generation") != generation
+                    or now - entry["created"] > self.ttl
+                    or entry["indices"] != list(indices)
+                ):
+                    continue
+                # Last use is kept in memory only (order of eviction of this process)
+                entry["last_used"] = now
+                return {**entry, "similarity": float(similarities[row])}
+        return None
+
+    def put(
+        self,
+        query: str,
+        query_embedding: np.ndarray,
+        indices: list[int],
+        response_text: str,
+        generation=None,
+    ) -> None:
+        """
+        Adds an answer: one line is appended to the file.
+        """
+        now = time.time()
+        query_embedding = np.asarray(query_embedding, dtype="float32").reshape(1, -1)
+        entry = {
+            "id": uuid.uuid4().hex,
+            "query": query,
+            "indices": [int(idx) for idx in indices],
+            "response_text": response_text,
+            "generation": generation,
+            "created": now,
+            "last_used": now,
+        }
+        with self._lock:
+            self._read_new_lines()
+            self._append(entry, query_embedding[0])
+            self._add(query_embedding, [entry])
+            if self._file_lines + len(self._own) > COMPACT_RATIO * self.max_entries:
+                self._compact()
+
+    def clear(self) -> None:
+        """
+        Removes all entries from memory and disk.
+        """
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._reset()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    """
+    Returns the process-wide AnswerCache, creating it on first use.
+    """
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+    return _answer_cache
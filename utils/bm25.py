@@ -0,0 +1,302 @@
+"""
+A BM25 keyword index of chunk texts for exact-term matches (policy codes, form names, abbreviations).
+
+The inverted index is kept in compact NumPy arrays (CSR layout) instead of Python dicts:
+- term_bytes / term_offsets: sorted vocabulary as one UTF-8 blob, term t is
+  term_bytes[term_offsets[t]:term_offsets[t + 1]] and its id is its position (binary search);
+- indptr: postings of term t are indptr[t]:indptr[t + 1];
+- rows / tfs: document row and term frequency of every posting;
+- chunk_ids / doc_lens: chunk id and length in tokens of every document row.
+
+Functions:
+- tokenize(text): lowercased word tokens.
+- in_ranges(ids, id_ranges): mask of chunk ids inside id ranges (document filters).
+- encode_terms(terms): packs sorted terms into the term_bytes / term_offsets arrays.
+- build_bm25_index(store, ids, path): builds the index over the given chunks and saves it as .npz.
+- update_bm25_index(store, ids, path): updates a saved index to the given chunks (new chunks only are tokenized).
+
+Classes:
+- TermList: sequence view of the packed terms for binary search.
+- BM25Index: loads the saved arrays and returns the top-k chunk ids with BM25 scores.
+"""
+
+import os
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from time import perf_counter as timer
+
+import numpy as np
+
+from .chunk_store import ChunkStore
+from .config import BM25_B, BM25_K1
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Chunk texts read from the store at once when building the index
+BUILD_BLOCK_SIZE = 10_000
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Splits text into lowercased word tokens.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def in_ranges(ids: np.ndarray, id_ranges: list[tuple[int, int]]) -> np.ndarray:
+    """
+    Boolean mask of ids inside sorted, non-overlapping [start, end) ranges.
+    """
+    if not id_ranges:
+        return np.zeros(len(ids), dtype=bool)
+    starts = np.array([start for start, _ in id_ranges], dtype=np.int64)
+    ends = np.array([end for _, end in id_ranges], dtype=np.int64)
+    positions = np.searchsorted(starts, ids, side="right") - 1
+    return (positions >= 0) & (ids < ends[np.maximum(positions, 0)])
+
+
+def encode_terms(terms: list[str]) -> dict[str, np.ndarray]:
+    """
+    Packs sorted terms into a UTF-8 blob and int64 offsets (UTF-8 byte order is the str order).
+    """
+    encoded = [term.encode("utf-8") for term in terms]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(term) for term in encoded], out=offsets[1:])
+    return {
+        "term_bytes": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "term_offsets": offsets,
+    }
+
+
+class TermList:
+    """
+    Read-only sequence of the terms packed by encode_terms() (UTF-8 bytes, for bisect).
+    """
+
+    def __init__(self, term_bytes: np.ndarray, term_offsets: np.ndarray):
+        self.blob = term_bytes.tobytes()
+        self.offsets = term_offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position: int) -> bytes:
+        return self.blob[self.offsets[position] : self.offsets[position + 1]]
+
+
+def _tokenize_chunks(
+    store: ChunkStore, ids: np.ndarray, vocabulary: dict[str, int], first_row: int = 0
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Tokenizes chunks with the given ids as document rows from first_row; new terms are added to vocabulary.
+    Returns term ids, rows and term frequencies of the postings and the document lengths.
+    """
+    offsets = store.load_offsets()
+    posting_terms, posting_rows, posting_tfs = array("i"), array("i"), array("H")
+    doc_lens = array("i")
+
+    for block_start in range(0, len(ids), BUILD_BLOCK_SIZE):
+        block_ids = ids[block_start : block_start + BUILD_BLOCK_SIZE]
+        for row, text in enumerate(store.get_texts(block_ids, offsets=offsets), start=first_row + block_start):
+            tokens = tokenize(text)
+            doc_lens.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                posting_terms.append(vocabulary.setdefault(term, len(vocabulary)))
+                posting_rows.append(row)
+                posting_tfs.append(min(tf, 65535))
+
+    return (
+        np.frombuffer(posting_terms, dtype=np.int32),
+        np.frombuffer(posting_rows, dtype=np.int32),
+        np.frombuffer(posting_tfs, dtype=np.uint16),
+        np.frombuffer(doc_lens, dtype=np.int32),
+    )
+
+
+def _save_index(
+    path: str,
+    terms: list[str],
+    posting_terms: np.ndarray,
+    posting_rows: np.ndarray,
+    posting_tfs: np.ndarray,
+    chunk_ids: np.ndarray,
+    doc_lens: np.ndarray,
+) -> tuple[int, int]:
+    """
+    Renumbers terms in sorted order (terms without postings are dropped), groups postings by term
+    and saves the arrays atomically. Returns the numbers of terms and postings.
+    """
+    counts = np.bincount(posting_terms, minlength=len(terms))
+    used = sorted(np.flatnonzero(counts).tolist(), key=terms.__getitem__)
+    rank = np.zeros(len(terms), dtype=np.int64)
+    rank[used] = np.arange(len(used))
+    order = np.argsort(rank[posting_terms], kind="stable")
+    indptr = np.zeros(len(used) + 1, dtype=np.int64)
+    np.cumsum(counts[used], out=indptr[1:])
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            **encode_terms([terms[term_id] for term_id in used]),
+            indptr=indptr,
+            rows=posting_rows[order].astype(np.int32),
+            tfs=posting_tfs[order].astype(np.uint16),
+            chunk_ids=np.asarray(chunk_ids, dtype=np.int64),
+            doc_lens=np.asarray(doc_lens, dtype=np.int32),
+        )
+    # A new file: the old one may be a hard link to the index of a published snapshot
+    os.replace(tmp_path, path)
+    return len(used), len(order)
+
+
+def build_bm25_index(store: ChunkStore, ids: np.ndarray, path: str) -> None:
+    """
+    Builds the inverted index over chunks with the given ids and saves it atomically.
+    """
+    start_time = timer()
+    vocabulary = {}
+    posting_terms, posting_rows, posting_tfs, doc_lens = _tokenize_chunks(store, ids, vocabulary)
+    num_terms, num_postings = _save_index(
+        path, list(vocabulary), posting_terms, posting_rows, posting_tfs, ids, doc_lens
+    )
+
+    end_time = timer()
+    print(
+        f"[INFO] BM25 index: {len(ids)} chunks, {num_terms} terms, {num_postings} postings "
+        f"in {end_time - start_time:.2f} seconds."
+    )
+
+
+def update_bm25_index(store: ChunkStore, ids: np.ndarray, path: str) -> None:
+    """
+    Updates the saved index to the chunks with the given ids: rows of other chunks are dropped
+    and only chunks missing from the index are tokenized. Builds the index if there is none.
+    Chunk ids must not have been reused for other texts (e.g. by compaction).
+    """
+    if not os.path.exists(path):
+        build_bm25_index(store, ids, path)
+        return
+
+    start_time = timer()
+    ids = np.asarray(ids, dtype=np.int64)
+    with np.load(path) as data:
+        if "terms" in data:
+            terms = data["terms"].tolist()
+        else:
+            terms = [term.decode("utf-8") for term in TermList(data["term_bytes"], data["term_offsets"])]
+        indptr, rows, tfs = data["indptr"], data["rows"], data["tfs"]
+        chunk_ids, doc_lens = data["chunk_ids"], data["doc_lens"]
+
+    # Postings of kept documents, their rows renumbered
+    keep = np.isin(chunk_ids, ids)
+    new_rows = np.cumsum(keep) - 1
+    posting_terms = np.repeat(np.arange(len(terms)), np.diff(indptr))
+    kept = keep[rows]
+
+    # Postings of new documents, appended after the kept ones
+    new_ids = ids[~np.isin(ids, chunk_ids)]
+    vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+    added_terms, added_rows, added_tfs, added_lens = _tokenize_chunks(
+        store, new_ids, vocabulary, first_row=int(keep.sum())
+    )
+
+    num_terms, num_postings = _save_index(
+        path,
+        list(vocabulary),
+        np.concatenate([posting_terms[kept], added_terms]),
+        np.concatenate([new_rows[rows[kept]], added_rows]),
+        np.concatenate([tfs[kept], added_tfs]),
+        np.concatenate([chunk_ids[keep], new_ids]),
+        np.concatenate([doc_lens[keep], added_lens]),
+    )
+
+    end_time = timer()
+    print(
+        f"[INFO] BM25 index updated: {len(chunk_ids) - int(keep.sum())} chunks removed, {len(new_ids)} added; "
+        f"{len(ids)} chunks, {num_terms} terms, {num_postings} postings in {end_time - start_time:.2f} seconds."
+    )
+
+
+class BM25Index:
+    """
+    Okapi BM25 search over the arrays saved by build_bm25_index().
+    """
+
+    def __init__(self, path: str, k1: float = BM25_K1, b: float = BM25_B):
+        with np.load(path) as data:
+            if "terms" in data:
+                # Indexes saved as a fixed-width str array
+                self.terms = TermList(**encode_terms(data["terms"].tolist()))
+            else:
+                self.terms = TermList(data["term_bytes"], data["term_offsets"])
+            self.indptr = data["indptr"]
+            self.rows = data["rows"]
+            self.tfs = data["tfs"]
+            self.chunk_ids = data["chunk_ids"]
+            doc_lens = data["doc_lens"]
+
+        self.k1 = k1
+        num_docs = len(self.chunk_ids)
+        avg_len = doc_lens.mean() if num_docs else 1.0
+        # Length normalization of the term frequency, precomputed per document
+        self.doc_norms = (k1 * (1 - b + b * doc_lens / max(avg_len, 1e-9))).astype(np.float32)
+        doc_freqs = np.diff(self.indptr)
+        self.idf = np.log1p((num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def term_ids(self, query: str) -> np.ndarray:
+        """
+        Returns vocabulary ids of the distinct query terms found in the index.
+        """
+        term_ids = []
+        for term in sorted({term.encode("utf-8") for term in tokenize(query)}):
+            position = bisect_left(self.terms, term)
+            if position < len(self.terms) and self.terms[position] == term:
+                term_ids.append(position)
+        return np.array(term_ids, dtype=np.int64)
+
+    def postings(self, query: str):
+        """
+        Yields document rows and their BM25 score for every query term found in the index.
+        """
+        for term_id in self.term_ids(query):
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            rows = self.rows[start:end]
+            tfs = self.tfs[start:end].astype(np.float32)
+            yield rows, self.idf[term_id] * tfs * (self.k1 + 1) / (tfs + self.doc_norms[rows])
+
+    def search(
+        self, query: str, k: int, id_ranges: list[tuple[int, int]] | None = None
+    ) -> tuple[list[int], list[float]]:
+        """
+        Returns up to k chunk ids containing query terms and their BM25 scores (highest first).
+        With id_ranges (sorted, non-overlapping [start, end) ranges) only these chunks are returned.
+        """
+        if id_ranges is None:
+            scores = np.zeros(len(self.chunk_ids), dtype=np.float32)
+            for rows, term_scores in self.postings(query):
+                scores[rows] += term_scores
+            matched = np.flatnonzero(scores)
+            scores = scores[matched]
+        else:
+            # Only postings of the selected documents are scored (no array of the size of the corpus)
+            matched_rows, matched_scores = [], []
+            for rows, term_scores in self.postings(query):
+                inside = in_ranges(self.chunk_ids[rows], id_ranges)
+                matched_rows.append(rows[inside])
+                matched_scores.append(term_scores[inside])
+            if not matched_rows:
+                return [], []
+            matched, inverse = np.unique(np.concatenate(matched_rows), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(matched_scores)).astype(np.float32)
+
+        if matched.size > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            matched, scores = matched[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return self.chunk_ids[matched[order]].tolist(), scores[order].tolist()
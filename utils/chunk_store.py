@@ -0,0 +1,375 @@
+"""
+A binary on-disk store for chunks and their embeddings.
+
+Layout of the store directory:
+- chunks.jsonl: one JSON line per chunk (text and metadata, no embedding);
+- chunks_offsets.bin: int64 byte offsets of every line in chunks.jsonl;
+- embeddings.f32: contiguous float32 matrix (one row per chunk), read with np.memmap;
+- store_meta.json: embedding dimension, whether embeddings are L2-normalized, index generation,
+  format version and, once sealed, the sizes of the other files.
+
+All files are append-only, so a chunk id is simply its row number. Rows of
+deleted documents stay in the files until the store is compacted.
+
+A sealed store (of a published snapshot, see snapshots.py) is read only up to the recorded
+sizes: a newer snapshot may share its files (hard links) and append rows to them.
+
+Classes:
+- ChunkStore: appends chunks/embeddings and reads them by id without loading the whole corpus.
+
+Functions:
+- migrate_json_store(json_path, store_dir): one-time conversion of the old chunks_and_statistics.json.
+"""
+
+import json
+import os
+import shutil
+from collections.abc import Iterable, Iterator
+from time import perf_counter as timer
+
+import numpy as np
+
+from .config import CHUNKS_DIR, LEGACY_CHUNKS_PATH
+
+STORE_FORMAT_VERSION = 1
+
+CHUNKS_FILE = "chunks.jsonl"
+OFFSETS_FILE = "chunks_offsets.bin"
+EMBEDDINGS_FILE = "embeddings.f32"
+META_FILE = "store_meta.json"
+
+OFFSET_DTYPE = np.int64
+EMBEDDING_DTYPE = np.float32
+
+
+class ChunkStore:
+    """
+    Chunks and embeddings stored in separate binary/line files of one directory.
+    """
+
+    def __init__(self, store_dir: str = CHUNKS_DIR):
+        self.store_dir = store_dir
+        self.chunks_path = os.path.join(store_dir, CHUNKS_FILE)
+        self.offsets_path = os.path.join(store_dir, OFFSETS_FILE)
+        self.embeddings_path = os.path.join(store_dir, EMBEDDINGS_FILE)
+        self.meta_path = os.path.join(store_dir, META_FILE)
+        self.data_paths = (self.chunks_path, self.offsets_path, self.embeddings_path)
+
+    # === Meta ===
+
+    def exists(self) -> bool:
+        """
+        Checks whether the store was created.
+        """
+        return os.path.exists(self.meta_path)
+
+    def read_meta(self) -> dict:
+        """
+        Returns the store meta information.
+        """
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def write_meta(self, **fields) -> None:
+        """
+        Updates fields of the store meta information.
+        """
+        meta = self.read_meta() if self.exists() else {}
+        meta.update(fields)
+        meta["format_version"] = STORE_FORMAT_VERSION
+
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    def seal(self) -> None:
+        """
+        Records the sizes of the data files; rows appended to them later are not read.
+        """
+        if self.exists():
+            self.write_meta(
+                sizes={os.path.basename(path): os.path.getsize(path) for path in self.data_paths}
+            )
+
+    def _file_size(self, path: str) -> int:
+        """
+        Size of a data file: recorded by seal() or on disk.
+        """
+        sizes = self.read_meta().get("sizes") if self.exists() else None
+        if sizes:
+            return sizes[os.path.basename(path)]
+        return os.path.getsize(path)
+
+    @property
+    def dim(self) -> int | None:
+        """
+        Embedding dimension or None if there are no embeddings yet.
+        """
+        return self.read_meta().get("dim") if self.exists() else None
+
+    # === Writing ===
+
+    def reset(self) -> None:
+        """
+        Creates an empty store, removing previous chunks and embeddings.
+        """
+        os.makedirs(self.store_dir, exist_ok=True)
+        for path in self.data_paths:
+            # New files: the old ones may be hard links to files of a published snapshot
+            if os.path.exists(path):
+                os.remove(path)
+            open(path, "wb").close()
+        # Embeddings written by embedder are L2-normalized
+        self.write_meta(dim=None, normalized=True, sizes=None)
+
+    def normalize_embeddings(self, block_size: int = 65536) -> None:
+        """
+        L2-normalizes stored embeddings in place (embeddings of older versions were not normalized).
+        """
+        rows = self.num_embeddings
+        if rows:
+            # Rewritten in place: a hard link to a file of a published snapshot is replaced by a copy
+            if os.stat(self.embeddings_path).st_nlink > 1:
+                tmp_path = self.embeddings_path + ".tmp"
+                shutil.copyfile(self.embeddings_path, tmp_path)
+                os.replace(tmp_path, self.embeddings_path)
+            embeddings = np.memmap(
+                self.embeddings_path, dtype=EMBEDDING_DTYPE, mode="r+", shape=(rows, self.dim)
+            )
+            for start in range(0, rows, block_size):
+                block = embeddings[start : start + block_size]
+                norms = np.linalg.norm(block, axis=1, keepdims=True)
+                block /= np.maximum(norms, 1e-12)
+            embeddings.flush()
+            del embeddings
+        self.write_meta(normalized=True)
+        print(f"[INFO] Normalized {rows} stored embeddings.")
+
+    @property
+    def normalized(self) -> bool:
+        """
+        Whether stored embeddings are L2-normalized.
+        """
+        return self.exists() and self.read_meta().get("normalized", False)
+
+    @property
+    def index_generation(self) -> int:
+        """
+        Number of the index build; incremented whenever the index is rebuilt and chunk ids may change.
+        """
+        return self.read_meta().get("index_generation", 0) if self.exists() else 0
+
+    def next_index_generation(self) -> int:
+        """
+        Marks a rebuild of the index (invalidates answers cached for the previous one).
+        """
+        generation = self.index_generation + 1
+        self.write_meta(index_generation=generation)
+        return generation
+
+    def compact(self, ranges: list[tuple[int, int]]) -> list[int]:
+        """
+        Rewrites the store keeping only the given [start, end) id ranges, in the given order.
+        Returns the new start id of every range.
+        """
+        offsets = self.load_offsets()
+        embeddings = self.load_embeddings()
+        total = len(self)
+
+        tmp_paths = {path: path + ".tmp" for path in self.data_paths}
+        new_starts = []
+        new_id = 0
+        position = 0
+
+        with (
+            open(self.chunks_path, "rb") as src,
+            open(tmp_paths[self.chunks_path], "wb") as chunks_out,
+            open(tmp_paths[self.offsets_path], "wb") as offsets_out,
+            open(tmp_paths[self.embeddings_path], "wb") as embeddings_out,
+        ):
+            for start, end in ranges:
+                new_starts.append(new_id)
+                if start == end:
+                    continue
+
+                # Copy the lines of the range as one block and shift their offsets
+                block_start = int(offsets[start])
+                block_end = int(offsets[end]) if end < total else self._file_size(self.chunks_path)
+                src.seek(block_start)
+                chunks_out.write(src.read(block_end - block_start))
+
+                range_offsets = np.asarray(offsets[start:end], dtype=OFFSET_DTYPE)
+                offsets_out.write((range_offsets - block_start + position).tobytes())
+                embeddings_out.write(np.ascontiguousarray(embeddings[start:end]).tobytes())
+
+                position += block_end - block_start
+                new_id += end - start
+
+        del offsets, embeddings
+        for path, tmp_path in tmp_paths.items():
+            os.replace(tmp_path, path)
+        self.write_meta()
+
+        return new_starts
+
+    def append_chunks(self, chunks: Iterable[dict]) -> list[int]:
+        """
+        Appends chunks (without "embedding" field) and returns their ids.
+        """
+        if not self.exists():
+            self.reset()
+
+        first_id = len(self)
+        offsets = []
+        with open(self.chunks_path, "ab") as f:
+            position = f.tell()
+            for chunk in chunks:
+                chunk = {key: value for key, value in chunk.items() if key != "embedding"}
+                line = (json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8")
+                offsets.append(position)
+                f.write(line)
+                position += len(line)
+
+        # Offsets are written last: a chunk is visible only when its line is complete
+        with open(self.offsets_path, "ab") as f:
+            f.write(np.asarray(offsets, dtype=OFFSET_DTYPE).tobytes())
+
+        return list(range(first_id, first_id + len(offsets)))
+
+    def append_embeddings(self, embeddings: np.ndarray) -> None:
+        """
+        Appends embedding rows; rows must follow the order of chunks.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=EMBEDDING_DTYPE)
+        if embeddings.ndim != 2:
+            raise ValueError("Embeddings must be a 2D array.")
+
+        dim = self.dim
+        if dim is None:
+            self.write_meta(dim=int(embeddings.shape[1]))
+        elif dim != embeddings.shape[1]:
+            raise ValueError(
+                f"Embedding dimension {embeddings.shape[1]} does not match store dimension {dim}."
+            )
+
+        with open(self.embeddings_path, "ab") as f:
+            f.write(embeddings.tobytes())
+
+    # === Reading ===
+
+    def __len__(self) -> int:
+        """
+        Number of chunks in the store.
+        """
+        try:
+            return self._file_size(self.offsets_path) // np.dtype(OFFSET_DTYPE).itemsize
+        except FileNotFoundError:
+            return 0
+
+    @property
+    def num_embeddings(self) -> int:
+        """
+        Number of embedding rows in the store.
+        """
+        dim = self.dim
+        if not dim:
+            return 0
+        row_size = dim * np.dtype(EMBEDDING_DTYPE).itemsize
+        return self._file_size(self.embeddings_path) // row_size
+
+    def load_offsets(self) -> np.ndarray:
+        """
+        Returns memory-mapped line offsets of the chunks.
+        """
+        if len(self) == 0:
+            return np.empty(0, dtype=OFFSET_DTYPE)
+        return np.memmap(self.offsets_path, dtype=OFFSET_DTYPE, mode="r", shape=(len(self),))
+
+    def load_embeddings(self) -> np.ndarray:
+        """
+        Returns the memory-mapped (num_embeddings, dim) float32 matrix.
+        """
+        rows = self.num_embeddings
+        if rows == 0:
+            return np.empty((0, self.dim or 0), dtype=EMBEDDING_DTYPE)
+        return np.memmap(
+            self.embeddings_path, dtype=EMBEDDING_DTYPE, mode="r", shape=(rows, self.dim)
+        )
+
+    def get_chunks(self, ids: Iterable[int], offsets: np.ndarray = None) -> list[dict]:
+        """
+        Reads chunks by ids, seeking directly to their lines.
+        Negative ids (FAISS "no result") are skipped.
+        """
+        ids = [int(idx) for idx in ids if idx >= 0]
+        if offsets is None:
+            offsets = self.load_offsets()
+
+        chunks = {}
+        with open(self.chunks_path, "rb") as f:
+            # Read in file order to keep seeks short
+            for idx in sorted(set(ids)):
+                f.seek(int(offsets[idx]))
+                chunks[idx] = json.loads(f.readline())
+
+        return [chunks[idx] for idx in ids]
+
+    def get_texts(self, ids: Iterable[int], offsets: np.ndarray = None) -> list[str]:
+        """
+        Reads chunk texts by ids.
+        """
+        return [chunk["text"] for chunk in self.get_chunks(ids, offsets=offsets)]
+
+    def iter_chunks(self, start: int = 0) -> Iterator[dict]:
+        """
+        Streams chunks line by line starting from the given id.
+        """
+        total = len(self)
+        if start >= total:
+            return
+
+        offsets = self.load_offsets()
+        with open(self.chunks_path, "rb") as f:
+            f.seek(int(offsets[start]))
+            for _ in range(start, total):
+                yield json.loads(f.readline())
+
+    def iter_texts(self, start: int = 0) -> Iterator[str]:
+        """
+        Streams chunk texts starting from the given id.
+        """
+        for chunk in self.iter_chunks(start=start):
+            yield chunk["text"]
+
+
+def migrate_json_store(
+    json_path: str = LEGACY_CHUNKS_PATH, store_dir: str = CHUNKS_DIR
+) -> bool:
+    """
+    Converts the old chunks_and_statistics.json (chunks with embedding lists) into a ChunkStore.
+    Runs only once: does nothing if the store already exists or there is no JSON file.
+    Returns True if migration was performed.
+    """
+    store = ChunkStore(store_dir)
+    if store.exists() or not os.path.exists(json_path):
+        return False
+
+    start_time = timer()
+    with open(json_path, "r", encoding="utf-8") as f:
+        chunks_and_statistics = json.load(f)
+
+    store.reset()
+    store.append_chunks(chunks_and_statistics)
+
+    embeddings = [chunk["embedding"] for chunk in chunks_and_statistics if "embedding" in chunk]
+    if embeddings and len(embeddings) == len(chunks_and_statistics):
+        store.append_embeddings(np.asarray(embeddings, dtype=EMBEDDING_DTYPE))
+        store.normalize_embeddings()
+
+    end_time = timer()
+    print(
+        f"[INFO] Migrated {len(chunks_and_statistics)} chunks from '{json_path}' "
+        f"in {end_time - start_time:.2f} seconds."
+    )
+    return True
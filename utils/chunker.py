@@ -1,35 +1,74 @@
 """
-A module for splitting PDF documents into text chunks and saving statistics using PyMuPDF.
+A module for splitting documents (PDF, DOCX, TXT) into text chunks and saving statistics.
+Documents are read page by page (PDF) or section by section (DOCX, TXT) by loaders.py.
 
 Functions:
-- split_into_chunks(files_paths): splits PDF pages into text chunks.
-- save_chunks_and_stats(all_chunks): saves chunks with metadata in JSON.
+- get_tokenizer(): loads the Hugging Face tokenizer on first use.
+- pack_sentences(sentences, token_counts, max_tokens, overlap_tokens): packs sentences into token-limited chunks.
+- parse_pages(file_path, first_page, last_page): splits a range of document pages/sections into text chunks.
+- iter_chunks(files_paths, workers): generator of text chunks, optionally parsed in a process pool.
+- split_into_chunks(files_paths, workers): splits documents into text chunks, returns them per file.
+- save_chunks_and_stats(all_chunks): saves chunks with metadata to the chunk store.
 
-Uses PyMuPDF, NLTK, and Hugging Face tokenizer.
+Uses NLTK and Hugging Face tokenizer.
 """
 
 import json
 import re
+import threading
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import islice
 from time import perf_counter as timer
 
-import fitz  # PyMuPDF
-import nltk
-from transformers import AutoTokenizer
+from .chunk_store import ChunkStore
+from .config import (
+    CHUNKER_COMPUTE_STATS,
+    CHUNKER_PAGES_PER_TASK,
+    CHUNKER_WORKERS,
+    CHUNK_MAX_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+    CHUNKS_DIR,
+    TOKEN_COUNT_BATCH_SIZE,
+    TOKENIZER_MODEL,
+)
+from .loaders import count_units, get_loader, iter_units
 
-from .config import CHUNKS_PATH, TOKENIZER_MODEL
+WORD_PATTERN = re.compile(r"\w+")
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
 
-tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_MODEL)
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    """
+    Loads the Hugging Face tokenizer on first use (transformers is imported only when chunking).
+    """
+    global _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None:
+            from transformers import AutoTokenizer
+
+            _tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_MODEL)
+    return _tokenizer
 
 
 def download_punkt_if_needed():
     """
-    Downloades NLTR 'punkt'.
+    Downloades NLTR 'punkt' (and 'punkt_tab' used by sent_tokenize in recent NLTK).
     """
-    try:
-        nltk.data.find("tokenizers/punkt")
-    except LookupError:
-        print("[INFO] Downloading NLTK 'punkt' tokenizer...")
-        nltk.download("punkt")
+    import nltk
+
+    for resource in ("punkt", "punkt_tab"):
+        try:
+            nltk.data.find(f"tokenizers/{resource}")
+        except LookupError:
+            print(f"[INFO] Downloading NLTK '{resource}' tokenizer...")
+            nltk.download(resource)
 
 
 def text_formatter(text: str) -> str:
@@ -47,47 +86,319 @@ def is_valid_title(text: str) -> str:
     return title if len(title) >= 5 else "Untitled"
 
 
-def split_into_chunks(files_paths: list[str]) -> list[list[dict]]:
+def split_into_sentences(text: str) -> list[str]:
     """
-    Splits PDFs into chunks per page (or optionally using headers).
-    Returns a list of list of dicts per file.
+    Splits text into sentences with NLTK punkt (regex fallback if punkt is unavailable).
     """
-    download_punkt_if_needed()
+    import nltk
 
-    all_chunks = []
+    try:
+        return nltk.sent_tokenize(text)
+    except LookupError:
+        return [sentence for sentence in SENTENCE_PATTERN.split(text) if sentence]
 
-    for file_path in files_paths:
-        start_time = timer()
-        doc_chunks = []
 
-        doc = fitz.open(file_path)
-        for i, page in enumerate(doc):
-            text = page.get_text()
-            if not text.strip():
-                continue
+def count_words(text: str) -> int:
+    """
+    Counts words without building the list of matches.
+    """
+    return sum(1 for _ in WORD_PATTERN.finditer(text))
+
+
+def count_tokens(
+    texts: list[str],
+    batch_size: int = TOKEN_COUNT_BATCH_SIZE,
+    add_special_tokens: bool = True,
+) -> list[int]:
+    """
+    Counts tokens of texts with batched calls of the fast tokenizer (lengths only, no tensors).
+    """
+    tokenizer = get_tokenizer()
+    counts = []
+    for i in range(0, len(texts), batch_size):
+        encoded = tokenizer(
+            texts[i : i + batch_size],
+            add_special_tokens=add_special_tokens,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )
+        counts.extend(len(input_ids) for input_ids in encoded["input_ids"])
+    return counts
+
+
+def split_long_sentence(sentence: str, max_tokens: int) -> list[tuple[str, int]]:
+    """
+    Splits a sentence longer than max_tokens into pieces of max_tokens tokens
+    by token character offsets. Returns (text, token count) pairs.
+    """
+    offsets = get_tokenizer()(
+        sentence, add_special_tokens=False, return_offsets_mapping=True
+    )["offset_mapping"]
+
+    pieces = []
+    for i in range(0, len(offsets), max_tokens):
+        window = offsets[i : i + max_tokens]
+        piece = sentence[window[0][0] : window[-1][1]].strip()
+        if piece:
+            pieces.append((piece, len(window)))
+    return pieces
+
+
+def pack_sentences(
+    sentences: list[str],
+    token_counts: list[int],
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+) -> list[tuple[str, int]]:
+    """
+    Packs consecutive sentences into chunks of at most max_tokens tokens.
+    Every chunk starts with the last sentences of the previous one (up to overlap_tokens).
+    Returns (text, token count) pairs.
+    """
+    pieces = []
+    for sentence, token_count in zip(sentences, token_counts):
+        if token_count > max_tokens:
+            pieces.extend(split_long_sentence(sentence, max_tokens))
+        else:
+            pieces.append((sentence, token_count))
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece, token_count in pieces:
+        if current and current_tokens + token_count > max_tokens:
+            chunks.append((" ".join(text for text, _ in current), current_tokens))
+
+            # Keep the tail of the chunk as overlap if the next piece still fits
+            overlap = []
+            overlap_count = 0
+            for text, count in reversed(current):
+                if overlap_count + count > overlap_tokens:
+                    break
+                overlap.insert(0, (text, count))
+                overlap_count += count
+            if overlap_count + token_count > max_tokens:
+                overlap, overlap_count = [], 0
+            current, current_tokens = overlap, overlap_count
+
+        current.append((piece, token_count))
+        current_tokens += token_count
+
+    if current:
+        chunks.append((" ".join(text for text, _ in current), current_tokens))
+    return chunks
+
+
+def parse_pages(
+    file_path: str,
+    first_page: int = 0,
+    last_page: int = None,
+    compute_stats: bool = CHUNKER_COMPUTE_STATS,
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    units: list[tuple[int, str]] | None = None,
+) -> list[dict]:
+    """
+    Splits pages [first_page, last_page) of a document (sections for .docx and .txt, see loaders.py)
+    into sentence-aware chunks of at most max_tokens tokens with overlap_tokens overlap
+    (one chunk per page if max_tokens is None).
+    Word, sentence and page token statistics are skipped if compute_stats=False.
+    Pages already read from the document can be passed as (page_number, text) units.
+    Returns a list of dicts.
+    """
+    loader = get_loader(file_path)
+    if units is None:
+        units = loader.iter_units(file_path, first_page, last_page)
+    pages = []
+
+    for i, text in units:
+        if not text.strip():
+            continue
 
-            cleaned_text = text_formatter(text)
-            #title = is_valid_title(cleaned_text)
+        cleaned_text = text_formatter(text)
+        #title = is_valid_title(cleaned_text)
+        pages.append((i, text, cleaned_text))
 
+    # Sentences of all pages are tokenized in batches
+    if max_tokens is not None:
+        page_sentences = [split_into_sentences(cleaned_text) for _, _, cleaned_text in pages]
+        flat_counts = iter(
+            count_tokens(
+                [sentence for sentences in page_sentences for sentence in sentences],
+                add_special_tokens=False,
+            )
+        )
+        page_sentence_counts = [
+            [next(flat_counts) for _ in sentences] for sentences in page_sentences
+        ]
+    elif compute_stats:
+        page_token_counts = count_tokens([cleaned_text for _, _, cleaned_text in pages])
+
+    doc_chunks = []
+    for page_idx, (i, text, cleaned_text) in enumerate(pages):
+        page_stats = {
+            "file_directory": str(file_path).rsplit("/", 1)[0],
+            "file_type": loader.file_type,
+            "page_number": i + 1,
+            "page_char_count": len(text),
+        }
+        if compute_stats:
+            page_stats["page_word_count"] = count_words(cleaned_text)
+            page_stats["page_sentence_count_raw"] = text.count(". ") + 1
+            if max_tokens is not None:
+                # [CLS] and [SEP] tokens
+                page_stats["page_token_count"] = sum(page_sentence_counts[page_idx]) + 2
+            else:
+                page_stats["page_token_count"] = page_token_counts[page_idx]
+
+        if max_tokens is None:
+            doc_chunks.append({**page_stats, "contains_text": True, "text": cleaned_text})
+            continue
+
+        page_chunks = pack_sentences(
+            page_sentences[page_idx],
+            page_sentence_counts[page_idx],
+            max_tokens=max_tokens,
+            overlap_tokens=overlap_tokens,
+        )
+        for chunk_idx, (chunk_text, chunk_token_count) in enumerate(page_chunks):
             doc_chunks.append(
                 {
-                    "file_directory": str(file_path).rsplit("/", 1)[0],
-                    "file_type": "pdf",
-                    "page_number": i + 1,
-                    "page_char_count": len(text),
-                    "page_word_count": len(re.findall(r"\w+", cleaned_text)),
-                    "page_sentence_count_raw": len(text.split(". ")),
-                    "page_token_count": len(tokenizer(cleaned_text)["input_ids"]),
+                    **page_stats,
+                    "chunk_number": chunk_idx + 1,
+                    "chunk_token_count": chunk_token_count,
                     "contains_text": True,
-                    "text": cleaned_text,
+                    "text": chunk_text,
                 }
             )
 
-        all_chunks.append(doc_chunks)
-        end_time = timer()
-        print(f"[INFO] Parsed '{file_path}' in {end_time - start_time:.3f} seconds")
+    return doc_chunks
+
+
+def _parse_pages_task(task: tuple) -> tuple[list[dict], float]:
+    """
+    Process pool task: parses a page range and returns its chunks with the parsing time.
+    """
+    start_time = timer()
+    doc_chunks = parse_pages(*task)
+    return doc_chunks, timer() - start_time
+
+
+def _page_range_tasks(
+    files_paths: list[str], pages_per_task: int, *parse_args
+) -> Iterator[tuple]:
+    """
+    Yields parse_pages arguments for page ranges of all files, in files order.
+    Every file gets at least one (possibly empty) range. Documents whose number of pages
+    is not known in advance (.docx, .txt) are streamed here and their pages are passed in the task.
+    """
+    for file_path in files_paths:
+        page_count = count_units(file_path)
+        if page_count is None:
+            units = iter_units(file_path)
+            while True:
+                batch = list(islice(units, pages_per_task))
+                first_page = batch[0][0] if batch else 0
+                last_page = batch[-1][0] + 1 if batch else 0
+                yield (file_path, first_page, last_page, *parse_args, batch)
+                if len(batch) < pages_per_task:
+                    break
+            continue
+        for first_page in range(0, max(page_count, 1), pages_per_task):
+            last_page = min(first_page + pages_per_task, page_count)
+            yield (file_path, first_page, last_page, *parse_args)
+
+
+def _bounded_map(
+    executor: ProcessPoolExecutor, fn, items: Iterator, max_pending: int
+) -> Iterator[tuple]:
+    """
+    Like executor.map, but keeps at most max_pending tasks in flight,
+    so results do not pile up when the consumer is slower than the workers.
+    Yields (item, result) pairs in the order of items.
+    """
+    pending = deque()
+    for item in items:
+        pending.append((item, executor.submit(fn, item)))
+        if len(pending) >= max_pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
 
-    return all_chunks
+def iter_chunks(
+    files_paths: list[str],
+    workers: int = CHUNKER_WORKERS,
+    pages_per_task: int = CHUNKER_PAGES_PER_TASK,
+    compute_stats: bool = CHUNKER_COMPUTE_STATS,
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+) -> Iterator[tuple[str, dict]]:
+    """
+    Yields (file_path, chunk) pairs as soon as page ranges are parsed, in files and pages order.
+    Only a few page ranges are held in memory at a time, regardless of the corpus size.
+
+    With workers > 1 files are split into page ranges of pages_per_task pages
+    and parsed in a process pool. Per-file time is the sum of its page ranges parsing time.
+    """
+    download_punkt_if_needed()
+
+    tasks = _page_range_tasks(
+        files_paths, pages_per_task, compute_stats, max_tokens, overlap_tokens
+    )
+
+    with ExitStack() as stack:
+        if workers <= 1:
+            results = ((task, _parse_pages_task(task)) for task in tasks)
+        else:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            results = _bounded_map(executor, _parse_pages_task, tasks, 2 * workers)
+
+        current_file = None
+        parse_time = 0.0
+        for task, (range_chunks, range_time) in results:
+            file_path = task[0]
+            if file_path != current_file:
+                if current_file is not None:
+                    print(f"[INFO] Parsed '{current_file}' in {parse_time:.3f} seconds")
+                current_file, parse_time = file_path, 0.0
+            parse_time += range_time
+
+            for chunk in range_chunks:
+                yield file_path, chunk
+
+        if current_file is not None:
+            print(f"[INFO] Parsed '{current_file}' in {parse_time:.3f} seconds")
+
+
+def split_into_chunks(
+    files_paths: list[str],
+    workers: int = CHUNKER_WORKERS,
+    pages_per_task: int = CHUNKER_PAGES_PER_TASK,
+    compute_stats: bool = CHUNKER_COMPUTE_STATS,
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+) -> list[list[dict]]:
+    """
+    Splits documents into sentence-aware token chunks.
+    Returns a list of list of dicts per file.
+
+    compute_stats=False skips word, sentence and token statistics when only text is needed.
+    """
+    all_chunks = {file_path: [] for file_path in files_paths}
+    for file_path, chunk in iter_chunks(
+        files_paths,
+        workers=workers,
+        pages_per_task=pages_per_task,
+        compute_stats=compute_stats,
+        max_tokens=max_tokens,
+        overlap_tokens=overlap_tokens,
+    ):
+        all_chunks[file_path].append(chunk)
+
+    return [all_chunks[file_path] for file_path in files_paths]
 
 
 def save_to_json(data, path):
@@ -98,16 +409,28 @@ def save_to_json(data, path):
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 
-def save_chunks_and_stats(all_chunks: list[list], path_to_save: str = CHUNKS_PATH):
+def save_chunks_and_stats(
+    all_chunks: list[list], store_dir: str = CHUNKS_DIR, append: bool = False
+) -> list[tuple[int, int]]:
     """
-    Saves chunks and their statistics to JSON file.
+    Saves chunks and their statistics to the chunk store.
+    Replaces the store content unless append=True.
+    Returns the [start, end) range of chunk ids of every document.
     """
-    flat_chunks = [chunk for doc_chunks in all_chunks for chunk in doc_chunks]
-
     start_time = timer()
-    save_to_json(flat_chunks, path_to_save)
+    store = ChunkStore(store_dir)
+    if not append:
+        store.reset()
+
+    ids_ranges = []
+    for doc_chunks in all_chunks:
+        ids = store.append_chunks(doc_chunks)
+        start = ids[0] if ids else len(store)
+        ids_ranges.append((start, start + len(ids)))
     end_time = timer()
 
+    num_chunks = sum(end - start for start, end in ids_ranges)
     print(
-        f"[INFO] Saved {len(flat_chunks)} chunks in {end_time - start_time:.2f} seconds."
+        f"[INFO] Saved {num_chunks} chunks in {end_time - start_time:.2f} seconds."
     )
+    return ids_ranges
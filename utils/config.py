@@ -1,42 +1,213 @@
 import os
+import sys
 
 # === LLM ===
 
 
 def get_groq_api_key():
     """
-    Returnes GROQ API key from Streamlit secrets or .env.
+    Returnes GROQ API key from Streamlit secrets (when running in Streamlit) or .env.
     """
-    try:
-        import streamlit as st
+    # Streamlit is imported only by app.py, the console path does not pay for it
+    if "streamlit" in sys.modules:
+        try:
+            import streamlit as st
 
-        return st.secrets["GROQ_API_KEY"]
-    except Exception:
-        from dotenv import load_dotenv
-        
-        load_dotenv()
-        return os.getenv("GROQ_API_KEY")
+            return st.secrets["GROQ_API_KEY"]
+        except Exception:
+            pass
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return os.getenv("GROQ_API_KEY")
 
 
 LLM_GROQ = {
     "model": "meta-llama/llama-4-scout-17b-16e-instruct",
-    "base_url": "https://api.groq.com/openai/v1",
+    "base_url": os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1"),
     "api_key": get_groq_api_key(),
 }
+# Seconds to wait for an LLM response before the request is retried
+LLM_TIMEOUT = 60.0
+# Retries of rate-limited (429), failed (5xx) and timed out requests with exponential backoff
+LLM_MAX_RETRIES = 3
+# Answers are shown token by token as they are generated
+LLM_STREAMING = True
 
 # === PATHS ===
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 
-CHUNKS_PATH = os.path.join(BASE_DIR, "chunks", "chunks_and_statistics.json")
-INDEX_PATH = os.path.join(BASE_DIR, "chunks", "faiss.index")
-DATA_PATH = os.path.join(BASE_DIR, "data")
+# Data and chunk directories can be moved with RAG_DATA_PATH / RAG_CHUNKS_DIR (e.g. for benchmarks)
+CHUNKS_DIR = os.getenv("RAG_CHUNKS_DIR", os.path.join(BASE_DIR, "chunks"))
+# Paths of the layout before snapshots (see snapshots.py); these files are moved into the first snapshot
+LEGACY_CHUNKS_PATH = os.path.join(CHUNKS_DIR, "chunks_and_statistics.json")
+ANSWER_CACHE_PATH = os.path.join(CHUNKS_DIR, "answer_cache.jsonl")
+EMBEDDING_CACHE_DIR = os.path.join(CHUNKS_DIR, "embedding_cache")
+DATA_PATH = os.getenv("RAG_DATA_PATH", os.path.join(BASE_DIR, "data"))
 
 # === MODELS ===
 TOKENIZER_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# "torch" (fp32 PyTorch), "torch_int8" (dynamically quantized PyTorch), "onnx" (ONNX Runtime)
+# or "onnx_int8" (dynamically quantized ONNX); ONNX backends need `pip install optimum[onnxruntime]`
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# Instruction set of the int8 ONNX model: "arm64", "avx2", "avx512" or "avx512_vnni"
+ONNX_QUANTIZATION = "avx2"
+# Exported ONNX models are saved here, so they are exported only once
+EMBEDDING_EXPORT_DIR = os.path.join(BASE_DIR, "models")
+
+# === INGESTION ===
+# Number of processes for document parsing (1 - sequential parsing)
+CHUNKER_WORKERS = int(os.getenv("CHUNKER_WORKERS", "1"))
+# Large PDFs are split into page ranges of this size between processes
+CHUNKER_PAGES_PER_TASK = 64
+# .docx and .txt documents are split into sections of about this many characters (PDFs into pages)
+TEXT_SECTION_MAX_CHARS = 4000
+# Read buffer of .txt files in bytes
+TEXT_READ_BUFFER = 1 << 20
+# Chunk size in tokens of the embedding model (its window is 256 tokens with [CLS] and [SEP]),
+# None - one chunk per page
+CHUNK_MAX_TOKENS = 250
+# Tokens of the previous chunk repeated at the start of the next one
+CHUNK_OVERLAP_TOKENS = 32
+# Word/sentence/token statistics of chunks (False - only text is extracted)
+CHUNKER_COMPUTE_STATS = True
+# Number of texts per tokenizer call when counting tokens
+TOKEN_COUNT_BATCH_SIZE = 256
+# Number of chunks embedded and appended to the chunk store at once
+EMBED_BLOCK_SIZE = 1024
+# Embeddings of chunk texts are cached across rebuilds, only texts not seen before are encoded
+EMBEDDING_CACHE_ENABLED = True
+# Maximum number of cached embeddings per model (1.5 KB each for 384 dimensions); least recently used are evicted
+EMBEDDING_CACHE_MAX_VECTORS = 1_000_000
+# Parsing, embedding and indexing run concurrently
+STREAMING_INGESTION = True
+# Maximum number of blocks waiting between two streaming ingestion stages
+INGEST_QUEUE_SIZE = 4
+
+# Share of chunks of deleted/modified documents in the store that triggers compaction
+COMPACT_DEAD_RATIO = 0.5
+# Every ingestion publishes a new snapshot of chunks and indexes; this many newest ones are kept
+SNAPSHOTS_KEEP = 2
+
+# === INDEX ===
+# "flat", "hnsw", "ivf_flat", "ivf_pq" or "auto" (chosen by the number of vectors);
+# compressed vectors: "sq8" (int8), "fp16", "pq" (product quantization codes) or "ivf_sq8"
+INDEX_TYPE = "auto"
+# "auto": the first type whose vector limit is not reached, AUTO_INDEX_LARGEST above all limits
+AUTO_INDEX_THRESHOLDS = [(100_000, "flat"), (1_000_000, "hnsw"), (5_000_000, "ivf_flat")]
+AUTO_INDEX_LARGEST = "ivf_pq"
+# "ip" (inner product = cosine similarity of normalized embeddings) or "l2" (Euclidean distance)
+INDEX_METRIC = "ip"
+# Maximum number of vectors used to train IVF/PQ indexes
+INDEX_TRAIN_SAMPLE = 100_000
+# HNSW graph degree and candidate list sizes at build and search time
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+# IVF lists (None - ~4*sqrt(n)) and lists visited per query
+IVF_NLIST = None
+IVF_NPROBE = 16
+# PQ sub-quantizers (must divide the embedding dimension 384) and bits per code
+PQ_M = 48
+PQ_NBITS = 8
+# Compressed indexes return RESCORE_FACTOR * k candidates re-scored with the exact float32
+# embeddings (memory-mapped, only candidate rows are read); 0 - scores of the compressed codes
+RESCORE_FACTOR = 4
 
 # === RETRIEVAL ===
 TOP_K = 5
+# Chunks with lower cosine similarity to the query are not used; if none is left, LLM is not called
+RELEVANCE_THRESHOLD = 0.3
+NO_RELEVANT_CONTEXT_ANSWER = (
+    "I could not find information related to your question in the internal documentation."
+)
+
+# Filtered queries over at most this many chunks are searched exactly in the stored embeddings,
+# larger subsets in the FAISS index with an id selector
+FILTER_BRUTE_FORCE_MAX = 50_000
+
+# BM25 keyword search fused with vector search by reciprocal rank (False - vector search only)
+HYBRID_SEARCH = True
+# Candidates taken from each retriever before fusion
+HYBRID_CANDIDATES = 20
+# Reciprocal rank fusion constant: score = sum of 1 / (RRF_K + rank)
+RRF_K = 60
+# Threads of the BM25 searches of concurrent queries (run while FAISS searches in the calling thread)
+BM25_WORKERS = min(8, os.cpu_count() or 1)
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Keyword matches with at least this BM25 score are relevant even below RELEVANCE_THRESHOLD
+BM25_MIN_SCORE = 5.0
+
+# Candidates over-fetched by the bi-encoder are re-scored by a cross-encoder and the best TOP_K kept
+RERANKING = False
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+# Candidates passed to the cross-encoder
+RERANK_CANDIDATES = 20
+# Seconds per query the re-ranking may take, otherwise the bi-encoder order is used (None - no limit)
+RERANK_LATENCY_BUDGET = 0.3
+# Query-chunk pairs per forward pass of the cross-encoder and its maximum input length in tokens
+RERANK_BATCH_SIZE = 32
+RERANK_MAX_LENGTH = 512
+# Cross-encoder scores of this many recent (query, chunk) pairs are kept in memory
+RERANK_CACHE_SIZE = 10_000
+
+# Embeddings of this many recent distinct queries are kept in memory
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+
+# === BATCH QUERIES ===
+# Queries embedded and searched at once
+BATCH_QUERY_SIZE = 1024
+# Texts per forward pass of the embedding model for query batches
+EMBED_QUERY_BATCH_SIZE = 128
+# Maximum number of parallel LLM calls
+BATCH_LLM_CONCURRENCY = 8
+
+# === QUERY SERVICE ===
+# Address of the HTTP query service (server.py)
+QUERY_SERVICE_HOST = os.getenv("RAG_SERVICE_HOST", "127.0.0.1")
+QUERY_SERVICE_PORT = int(os.getenv("RAG_SERVICE_PORT", "8000"))
+# Streamlit app sends queries to this service (e.g. "http://127.0.0.1:8000"), None - answers in-process
+QUERY_SERVICE_URL = os.getenv("RAG_SERVICE_URL")
+# Seconds concurrent queries are collected into one embedding and search batch
+QUERY_BATCH_WINDOW = 0.005
+# Maximum number of queries per embedding and search batch
+QUERY_BATCH_MAX_SIZE = 64
+# Maximum number of LLM calls in flight in the query service
+SERVICE_LLM_CONCURRENCY = 16
+# Seconds the Streamlit client waits for an answer of the query service
+QUERY_SERVICE_TIMEOUT = 120.0
+# Seconds the Streamlit client keeps the document list of the query service
+DOCUMENTS_CACHE_TTL = 30
+
+# === CONTEXT ===
+# Maximum tokens of retrieved text in the prompt (None - all retrieved chunks are used whole)
+CONTEXT_TOKEN_BUDGET = 1500
+# Retrieved chunks with this cosine similarity to a better-ranked chunk are dropped
+CONTEXT_DEDUP_THRESHOLD = 0.95
+
+# === ANSWER CACHE ===
+# Answers of near-duplicate queries with the same retrieved chunks are reused without LLM call
+ANSWER_CACHE_ENABLED = True
+# Minimal cosine similarity of query embeddings for a cache hit
+ANSWER_CACHE_THRESHOLD = 0.95
+# Maximum number of cached answers (least recently used are evicted)
+ANSWER_CACHE_SIZE = 1000
+# Seconds a cached answer stays valid
+ANSWER_CACHE_TTL = 7 * 24 * 3600
+
+# === OBSERVABILITY ===
+# "DEBUG" also prints retrieved chunk texts and per-candidate scores
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Spans of pipeline stages are appended to this JSON lines file (None - not written)
+METRICS_JSONL_PATH = os.getenv("METRICS_JSONL_PATH")
+# Port of the Prometheus-style /metrics endpoint (0 - not started)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Upper bounds in seconds of the stage latency histogram buckets
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
 
 # === PROMPTS ===
 BASE_PROMPT = """You are an AI assistant that helps employees understand internal company policies and handbooks.
@@ -0,0 +1,114 @@
+"""
+Token-budgeted context for the LLM prompt.
+
+Retrieved chunks (highest relevance first) are:
+1. deduplicated: a chunk with cosine similarity >= CONTEXT_DEDUP_THRESHOLD to a better-ranked
+   chunk (by their stored embeddings) is dropped;
+2. packed whole while they fit into the token budget;
+3. chunks that do not fit are split into sentences, and their sentences most similar
+   to the query fill the rest of the budget (kept in the original order).
+
+Tokens are counted with the tokenizer of the embedding model (an approximation of the LLM tokenizer).
+
+Functions:
+- drop_near_duplicates(embeddings, threshold): positions of chunks that are not near-duplicates.
+- build_context(query_embedding, indices, store, token_budget): returns the context text and its statistics.
+"""
+
+import numpy as np
+
+from .chunk_store import ChunkStore
+from .chunker import count_tokens, split_into_sentences
+from .config import CONTEXT_DEDUP_THRESHOLD, CONTEXT_TOKEN_BUDGET
+from .embedder import encode_texts
+
+
+def drop_near_duplicates(embeddings: np.ndarray, threshold: float = CONTEXT_DEDUP_THRESHOLD) -> list[int]:
+    """
+    Returns positions of embeddings (best first) that have cosine similarity
+    below the threshold with all previously kept ones.
+    """
+    similarities = embeddings @ embeddings.T
+    kept = []
+    for i in range(embeddings.shape[0]):
+        if all(similarities[i, j] < threshold for j in kept):
+            kept.append(i)
+    return kept
+
+
+def _best_sentences(
+    texts: list[str], query_embedding: np.ndarray, token_budget: int
+) -> list[str]:
+    """
+    Keeps the sentences of texts most similar to the query within token_budget.
+    Returns the kept sentences of every text joined in their original order.
+    """
+    sentences = [(i, sentence) for i, text in enumerate(texts) for sentence in split_into_sentences(text)]
+    if not sentences or token_budget <= 0:
+        return ["" for _ in texts]
+
+    sentence_texts = [sentence for _, sentence in sentences]
+    sentence_tokens = count_tokens(sentence_texts, add_special_tokens=False)
+    similarities = encode_texts(sentence_texts) @ query_embedding.ravel()
+
+    selected = np.zeros(len(sentences), dtype=bool)
+    used = 0
+    for position in np.argsort(-similarities, kind="stable"):
+        if used + sentence_tokens[position] <= token_budget:
+            selected[position] = True
+            used += sentence_tokens[position]
+
+    trimmed = [[] for _ in texts]
+    for (i, sentence), keep in zip(sentences, selected):
+        if keep:
+            trimmed[i].append(sentence)
+    return [" ".join(kept_sentences) for kept_sentences in trimmed]
+
+
+def build_context(
+    query_embedding: np.ndarray,
+    indices: list[int],
+    store: ChunkStore,
+    offsets: np.ndarray = None,
+    embeddings: np.ndarray = None,
+    token_budget: int | None = CONTEXT_TOKEN_BUDGET,
+    dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD,
+) -> tuple[str, dict]:
+    """
+    Builds the context from retrieved chunks within token_budget (None - no limit).
+    Loaded offsets and memory-mapped embeddings (e.g. from QueryEngine) can be passed.
+
+    Returns the context and statistics: number of retrieved, duplicate and trimmed chunks,
+    tokens of the retrieved texts and of the context.
+    """
+    texts = store.get_texts(indices, offsets=offsets)
+    if embeddings is None:
+        embeddings = store.load_embeddings()
+
+    kept = drop_near_duplicates(np.asarray(embeddings[indices]), dedup_threshold) if indices else []
+    texts = [texts[i] for i in kept]
+    token_counts = count_tokens(texts, add_special_tokens=False) if texts else []
+
+    passages = list(texts)
+    trimmed = []
+    if token_budget is not None and sum(token_counts) > token_budget:
+        # Whole chunks in relevance order while they fit, the best sentences of the others
+        remaining = token_budget
+        for i, num_tokens in enumerate(token_counts):
+            if num_tokens <= remaining:
+                remaining -= num_tokens
+            else:
+                trimmed.append(i)
+        for i, text in zip(trimmed, _best_sentences([texts[i] for i in trimmed], query_embedding, remaining)):
+            passages[i] = text
+        passages = [passage for passage in passages if passage]
+
+    context = "- " + "\n- ".join(passages)
+    stats = {
+        "chunks": len(indices),
+        "duplicates": len(indices) - len(kept),
+        "trimmed": len(trimmed),
+        "retrieved_tokens": int(sum(token_counts)),
+        "context_tokens": int(sum(count_tokens(passages, add_special_tokens=False))) if passages else 0,
+    }
+    return context, stats
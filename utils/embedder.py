@@ -2,62 +2,258 @@
 A module for embedding chunks and query, and saving chunks embeddings.
 
 Functions:
-- embed_chunks(path_to_save, embedding_model): builds embeddings for loaded chunks and save them back to a file.
-- embed_query(query, embeddings_model): builds embeddings for a query.
+- load_embedding_model(backend, model_name): loads the model with a PyTorch or ONNX Runtime backend (fp32 or int8).
+- get_embedding_model(): loads the SentenceTransformer model of EMBEDDING_BACKEND on first use.
+- encode_texts(texts, embedding_model): builds normalized embeddings for texts.
+- encode_chunk_texts(texts, embedding_model, cache): encode_texts() for chunk texts, reusing cached embeddings.
+- embed_chunks(store_dir, embedding_model): builds embeddings for stored chunks without them and appends them to the chunk store.
+- embed_chunk_stream(keyed_chunks, store_dir, embedding_model): embeds chunks from a generator and appends them to the chunk store.
+- embed_query(query, embeddings_model): builds embeddings for a query (repeated queries are cached).
 
-Uses SentenceTransformer.
+Uses SentenceTransformer (PyTorch or ONNX Runtime backend, see EMBEDDING_BACKEND in config.py).
+The model (and torch) is loaded on first use, not at import.
 """
 
-import json
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+from itertools import islice
+from time import perf_counter as timer
+from typing import TYPE_CHECKING
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
-from .chunker import save_to_json
-from .config import CHUNKS_PATH, EMBEDDING_MODEL
+from .chunk_store import ChunkStore
+from .config import (
+    CHUNKS_DIR,
+    EMBED_BLOCK_SIZE,
+    EMBEDDING_BACKEND,
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_EXPORT_DIR,
+    EMBEDDING_MODEL,
+    ONNX_QUANTIZATION,
+    QUERY_EMBEDDING_CACHE_SIZE,
+)
+from .embedding_cache import EmbeddingCache, get_embedding_cache
 
-embedding_model = SentenceTransformer(EMBEDDING_MODEL)
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
+EMBEDDING_BACKENDS = ("torch", "torch_int8", "onnx", "onnx_int8")
 
-def embed_chunks(
-    path_to_save: str = CHUNKS_PATH,
-    embedding_model: SentenceTransformer = embedding_model,
-) -> None:
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
+
+# Exact query text -> embedding, least recently used are evicted
+_query_embeddings = OrderedDict()
+_query_embeddings_lock = threading.Lock()
+
+
+def _load_onnx_model(model_name: str, quantized: bool) -> "SentenceTransformer":
     """
-    Loads chunks from JSON, builds embeddings for each of them, and saves back to a file.
+    Loads the ONNX Runtime version of the model. The model is exported to ONNX
+    (and quantized to int8) on first use and saved in EMBEDDING_EXPORT_DIR.
     """
-    # Open file with chunks
-    with open(path_to_save, "r", encoding="utf-8") as f:
-        chunks_and_statistics = json.load(f)
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    export_dir = os.path.join(EMBEDDING_EXPORT_DIR, model_name.replace("/", "__") + "-onnx")
+    if not os.path.exists(os.path.join(export_dir, "onnx", "model.onnx")):
+        print(f"[INFO] Exporting '{model_name}' to ONNX...")
+        SentenceTransformer(model_name, backend="onnx").save_pretrained(export_dir)
+    if not quantized:
+        return SentenceTransformer(export_dir, backend="onnx")
+
+    file_suffix = f"int8_{ONNX_QUANTIZATION}"
+    file_name = os.path.join("onnx", f"model_{file_suffix}.onnx")
+    if not os.path.exists(os.path.join(export_dir, file_name)):
+        print(f"[INFO] Quantizing ONNX model to int8 ({ONNX_QUANTIZATION})...")
+        export_dynamic_quantized_onnx_model(
+            SentenceTransformer(export_dir, backend="onnx"),
+            ONNX_QUANTIZATION,
+            export_dir,
+            file_suffix=file_suffix,
+        )
+    return SentenceTransformer(export_dir, backend="onnx", model_kwargs={"file_name": file_name})
+
+
+def load_embedding_model(
+    backend: str = EMBEDDING_BACKEND, model_name: str = EMBEDDING_MODEL
+) -> "SentenceTransformer":
+    """
+    Loads the embedding model with one of EMBEDDING_BACKENDS:
+    - torch: fp32 PyTorch (reference);
+    - torch_int8: Linear layers dynamically quantized to int8 (CPU);
+    - onnx / onnx_int8: ONNX Runtime, fp32 or dynamically quantized to int8.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {EMBEDDING_BACKENDS}.")
+
+    start_time = timer()
+    if backend.startswith("onnx"):
+        model = _load_onnx_model(model_name, quantized=backend == "onnx_int8")
+    else:
+        from sentence_transformers import SentenceTransformer
 
-    print(f"[INFO] Chunks are loaded.")
+        if backend == "torch":
+            model = SentenceTransformer(model_name)
+        else:
+            import torch
 
-    # Extract text from each chunk
-    chunks_texts = [chunk["text"] for chunk in chunks_and_statistics]
+            model = torch.quantization.quantize_dynamic(
+                SentenceTransformer(model_name, device="cpu"), {torch.nn.Linear}, dtype=torch.qint8
+            )
 
-    # Create embeddings in batches with a progress bar
-    embeddings = embedding_model.encode(
-        chunks_texts, batch_size=32, show_progress_bar=True
+    print(f"[INFO] Embedding model '{model_name}' ({backend}) loaded in {timer() - start_time:.2f} seconds.")
+    return model
+
+
+def get_embedding_model() -> "SentenceTransformer":
+    """
+    Returns the embedding model of EMBEDDING_BACKEND, loading it on first use.
+    """
+    global _embedding_model
+    with _embedding_model_lock:
+        if _embedding_model is None:
+            _embedding_model = load_embedding_model()
+    return _embedding_model
+
+
+def encode_texts(
+    texts: list[str],
+    embedding_model: "SentenceTransformer" = None,
+    show_progress_bar: bool = False,
+    batch_size: int = 32,
+) -> np.ndarray:
+    """
+    Encodes texts into L2-normalized float32 embeddings (cosine similarity = inner product).
+    """
+    if embedding_model is None:
+        embedding_model = get_embedding_model()
+    return embedding_model.encode(
+        texts,
+        batch_size=batch_size,
+        show_progress_bar=show_progress_bar,
+        normalize_embeddings=True,
     ).astype("float32")
-    print(f"[INFO] Chunks are embedded.")
 
-    # Add embeddings to the chunk structure
-    for chunk, embedding in zip(chunks_and_statistics, embeddings):
-        chunk["embedding"] = embedding.tolist()
 
-    # Save updated chunks with embeddings
-    save_to_json(data=chunks_and_statistics, path=path_to_save)
+def encode_chunk_texts(
+    texts: list[str],
+    embedding_model: "SentenceTransformer" = None,
+    cache: EmbeddingCache | None = None,
+    show_progress_bar: bool = False,
+) -> np.ndarray:
+    """
+    Encodes chunk texts like encode_texts(); texts embedded before by the model are taken
+    from the embedding cache (the process-wide one if EMBEDDING_CACHE_ENABLED and cache is None).
+    """
+    if cache is None and EMBEDDING_CACHE_ENABLED:
+        cache = get_embedding_cache()
+    if cache is None:
+        return encode_texts(texts, embedding_model, show_progress_bar=show_progress_bar)
+    return cache.encode(
+        texts, lambda missing: encode_texts(missing, embedding_model, show_progress_bar=show_progress_bar)
+    )
+
+
+def embed_chunks(
+    store_dir: str = CHUNKS_DIR,
+    embedding_model: "SentenceTransformer" = None,
+    block_size: int = EMBED_BLOCK_SIZE,
+    cache: EmbeddingCache | None = None,
+) -> int:
+    """
+    Streams chunk texts that have no embeddings yet from the chunk store, builds embeddings
+    for each of them, and appends them to the store's float32 matrix.
+    Texts are encoded in blocks, so the whole corpus is never held in memory;
+    embeddings of texts in the embedding cache are reused.
 
-    print(f"[INFO] Embeddins were saved.")
+    Returns the id of the first embedded chunk.
+    """
+    store = ChunkStore(store_dir)
+    start = store.num_embeddings
+    print(f"[INFO] {len(store) - start} chunks to embed.")
+
+    texts = store.iter_texts(start=start)
+    while True:
+        # Extract text from the next block of chunks
+        chunks_texts = list(islice(texts, block_size))
+        if not chunks_texts:
+            break
+
+        # Create embeddings in batches with a progress bar
+        embeddings = encode_chunk_texts(chunks_texts, embedding_model, cache, show_progress_bar=True)
+        store.append_embeddings(embeddings)
+
+    print(f"[INFO] Embeddins were saved: {store.num_embeddings} vectors.")
+    return start
+
+
+def embed_chunk_stream(
+    keyed_chunks: Iterable[tuple[str, dict]],
+    store_dir: str = CHUNKS_DIR,
+    embedding_model: "SentenceTransformer" = None,
+    block_size: int = EMBED_BLOCK_SIZE,
+    cache: EmbeddingCache | None = None,
+) -> dict[str, tuple[int, int]]:
+    """
+    Consumes (key, chunk) pairs from a generator (e.g. chunker.iter_chunks), embeds them
+    in blocks and appends chunks and embeddings to the chunk store.
+    Only one block of chunks is held in memory.
+
+    Returns the [start, end) range of chunk ids of every key, in the order of appearance.
+    """
+    store = ChunkStore(store_dir)
+    if not store.exists():
+        store.reset()
+
+    ids_ranges = {}
+    keyed_chunks = iter(keyed_chunks)
+    while True:
+        block = list(islice(keyed_chunks, block_size))
+        if not block:
+            break
+
+        ids = store.append_chunks(chunk for _, chunk in block)
+        embeddings = encode_chunk_texts([chunk["text"] for _, chunk in block], embedding_model, cache)
+        store.append_embeddings(embeddings)
+
+        for (key, _), idx in zip(block, ids):
+            start, _ = ids_ranges.get(key, (idx, idx))
+            ids_ranges[key] = (start, idx + 1)
+
+    print(f"[INFO] Embeddins were saved: {store.num_embeddings} vectors.")
+    return ids_ranges
 
 
 def embed_query(
-    query: str, embedding_model: SentenceTransformer = embedding_model
+    query: str,
+    embedding_model: "SentenceTransformer" = None,
+    cache_size: int = QUERY_EMBEDDING_CACHE_SIZE,
 ) -> np.ndarray:
     """
-    Returns the embedding for a single query in NumPy array format.
+    Returns the normalized embedding for a single query in NumPy array format.
+    Embeddings of the last cache_size distinct queries are kept, so a repeated query skips the encoder.
     """
+    if embedding_model is None:
+        embedding_model = get_embedding_model()
+    key = (id(embedding_model), query)
+
+    with _query_embeddings_lock:
+        cached = _query_embeddings.get(key)
+        if cached is not None:
+            _query_embeddings.move_to_end(key)
+            print("[INFO] Query embedding is taken from cache.")
+            return cached.copy()
+
     # Query embedding and returnes numpy array.
-    query_embedding = embedding_model.encode([query]).astype("float32")
+    query_embedding = encode_texts([query], embedding_model).squeeze(0)
     print(f"[INFO] Query is embedded.")
-    return query_embedding.squeeze(0)
+
+    if cache_size > 0:
+        with _query_embeddings_lock:
+            _query_embeddings[key] = query_embedding.copy()
+            while len(_query_embeddings) > cache_size:
+                _query_embeddings.popitem(last=False)
+    return query_embedding
@@ -0,0 +1,252 @@
+"""
+A persistent cache of chunk embeddings keyed by (embedding model, normalized text hash).
+
+Re-ingestion (modified documents, full rebuilds, another chunking) mostly produces chunk
+texts that were embedded before; their vectors are read from the cache instead of encoding
+them again. The cache lives outside the snapshots, so it survives rebuilds.
+
+Layout of one model's cache directory (EMBEDDING_CACHE_DIR/<model>-<backend>):
+- vectors.f32: append-only float32 matrix, one row per cached text;
+- keys.u64: append-only 64-bit BLAKE2b hashes of the normalized texts, row-aligned with vectors;
+- used.u32: last use (a counter of encode calls) of every row, written by save();
+- meta.json: embedding dimension, number of committed rows and the use counter.
+
+Rows are committed by meta.json after they are appended, so rows of an interrupted write
+are dropped on the next load. Above max_vectors rows the least recently used rows are evicted
+and the files rewritten.
+
+Classes:
+- EmbeddingCache: encode(texts, encode_fn) returns embeddings, encoding only texts not cached.
+
+Functions:
+- text_key(text): the hash of a normalized chunk text.
+- get_embedding_cache(): returns the process-wide EmbeddingCache of the configured model.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from array import array
+from collections.abc import Callable
+from time import perf_counter as timer
+
+import numpy as np
+
+from .config import EMBEDDING_BACKEND, EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MAX_VECTORS, EMBEDDING_MODEL
+from .tracing import add_counter
+
+VECTORS_FILE = "vectors.f32"
+KEYS_FILE = "keys.u64"
+USED_FILE = "used.u32"
+META_FILE = "meta.json"
+
+VECTOR_DTYPE = np.float32
+# Share of max_vectors kept by eviction, so eviction does not run on every insert
+EVICT_TO = 0.9
+
+
+def text_key(text: str) -> int:
+    """
+    Returns a 64-bit hash of the text with whitespace runs collapsed.
+    """
+    normalized = " ".join(text.split()).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(normalized, digest_size=8).digest(), "little")
+
+
+class EmbeddingCache:
+    """
+    Embeddings of chunk texts of one embedding model, in memory-mapped append-only files.
+    The hash -> row index is kept in memory.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = EMBEDDING_CACHE_DIR,
+        model_name: str = EMBEDDING_MODEL,
+        backend: str = EMBEDDING_BACKEND,
+        max_vectors: int = EMBEDDING_CACHE_MAX_VECTORS,
+    ):
+        self.path = os.path.join(cache_dir, f"{model_name}-{backend}".replace("/", "__"))
+        self.vectors_path = os.path.join(self.path, VECTORS_FILE)
+        self.keys_path = os.path.join(self.path, KEYS_FILE)
+        self.used_path = os.path.join(self.path, USED_FILE)
+        self.meta_path = os.path.join(self.path, META_FILE)
+        self.max_vectors = max_vectors
+
+        # Statistics since creation: texts found in the cache / encoded, rows evicted
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        """
+        Reads the committed rows; bytes of uncommitted rows are truncated.
+        """
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            meta = {"dim": None, "rows": 0, "clock": 0}
+        self.dim = meta["dim"]
+        self.clock = meta["clock"]
+        rows = meta["rows"]
+
+        self.keys = array("Q")
+        self.used = array("I")
+        if rows:
+            row_size = self.dim * np.dtype(VECTOR_DTYPE).itemsize
+            for path, size in ((self.vectors_path, rows * row_size), (self.keys_path, rows * 8)):
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+            with open(self.keys_path, "rb") as f:
+                self.keys.fromfile(f, rows)
+            if os.path.exists(self.used_path):
+                with open(self.used_path, "rb") as f:
+                    self.used.frombytes(f.read(rows * self.used.itemsize))
+            # Rows added after the last save() count as unused
+            self.used.extend([0] * (rows - len(self.used)))
+        self._rows = {key: row for row, key in enumerate(self.keys)}
+
+    def _write_meta(self) -> None:
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "rows": len(self.keys), "clock": self.clock}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _vectors(self) -> np.ndarray:
+        """
+        Returns the memory-mapped (rows, dim) matrix of cached vectors.
+        """
+        return np.memmap(self.vectors_path, dtype=VECTOR_DTYPE, mode="r", shape=(len(self.keys), self.dim))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def encode(self, texts: list[str], encode_fn: Callable[[list[str]], np.ndarray]) -> np.ndarray:
+        """
+        Returns float32 embeddings of texts: cached ones are read from disk, the others are
+        encoded with encode_fn(texts) (every distinct text once) and added to the cache.
+        """
+        if not texts:
+            return np.empty((0, self.dim or 0), dtype=VECTOR_DTYPE)
+        keys = [text_key(text) for text in texts]
+        with self._lock:
+            self.clock += 1
+            rows = [self._rows.get(key) for key in keys]
+            hits = [position for position, row in enumerate(rows) if row is not None]
+
+            # Texts to encode, duplicates within the batch are encoded once
+            missing = {}
+            for position, row in enumerate(rows):
+                if row is None:
+                    missing.setdefault(keys[position], position)
+
+            encoded = encode_fn([texts[position] for position in missing.values()]) if missing else None
+            if self.dim is None:
+                self.dim = int(encoded.shape[1])
+
+            embeddings = np.empty((len(texts), self.dim), dtype=VECTOR_DTYPE)
+            if hits:
+                hit_rows = np.asarray([rows[position] for position in hits], dtype="int64")
+                embeddings[hits] = self._vectors()[hit_rows]
+                for row in hit_rows.tolist():
+                    self.used[row] = self.clock
+            if missing:
+                encoded = np.ascontiguousarray(encoded, dtype=VECTOR_DTYPE)
+                slots = {key: slot for slot, key in enumerate(missing)}
+                miss_positions = [position for position, row in enumerate(rows) if row is None]
+                embeddings[miss_positions] = encoded[[slots[keys[position]] for position in miss_positions]]
+
+                first_row = len(self.keys)
+                self._append(list(missing), encoded)
+                self._rows.update((key, first_row + slot) for key, slot in slots.items())
+
+            self.hits += len(hits)
+            self.misses += len(texts) - len(hits)
+            if len(self.keys) > self.max_vectors:
+                self._evict(int(self.max_vectors * EVICT_TO))
+
+        add_counter("embedding_cache_hits", len(hits))
+        add_counter("embedding_cache_misses", len(texts) - len(hits))
+        return embeddings
+
+    def _append(self, keys: list[int], vectors: np.ndarray) -> None:
+        """
+        Appends rows to the files and commits them in meta.json.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self.keys_path, "ab") as f:
+            f.write(np.asarray(keys, dtype="uint64").tobytes())
+        self.keys.extend(keys)
+        self.used.extend([self.clock] * len(keys))
+        self._write_meta()
+
+    def _evict(self, keep: int) -> None:
+        """
+        Rewrites the files keeping the `keep` most recently used rows (in their original order).
+        """
+        start_time = timer()
+        used = np.frombuffer(self.used, dtype="uint32")
+        kept = np.sort(np.argsort(-used.astype("int64"), kind="stable")[:keep])
+
+        vectors = self._vectors()
+        tmp_vectors = self.vectors_path + ".tmp"
+        with open(tmp_vectors, "wb") as f:
+            for start in range(0, len(kept), 65536):
+                f.write(np.ascontiguousarray(vectors[kept[start : start + 65536]]).tobytes())
+        del vectors
+
+        keys = np.frombuffer(self.keys, dtype="uint64")[kept]
+        used = used[kept]
+        tmp_keys = self.keys_path + ".tmp"
+        keys.tofile(tmp_keys)
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_keys, self.keys_path)
+
+        num_evicted = len(self.keys) - len(kept)
+        self.evicted += num_evicted
+        self.keys = array("Q", keys.tobytes())
+        self.used = array("I", used.tobytes())
+        self._rows = {key: row for row, key in enumerate(self.keys)}
+        self._write_meta()
+        self._save_used()
+        print(
+            f"[INFO] Embedding cache: evicted {num_evicted} least recently used vectors, "
+            f"{len(self.keys)} kept in {timer() - start_time:.2f} seconds."
+        )
+
+    def _save_used(self) -> None:
+        tmp_path = self.used_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            self.used.tofile(f)
+        os.replace(tmp_path, self.used_path)
+
+    def save(self) -> None:
+        """
+        Saves the last use of rows (the order of eviction).
+        """
+        with self._lock:
+            if len(self.keys):
+                self._save_used()
+                self._write_meta()
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    Returns the process-wide EmbeddingCache of EMBEDDING_MODEL and EMBEDDING_BACKEND, loading it on first use.
+    """
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache()
+    return _embedding_cache
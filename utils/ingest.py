@@ -0,0 +1,166 @@
+"""
+A streaming ingestion pipeline that overlaps document parsing, embedding and indexing.
+
+Stages run in separate threads and are connected with bounded queues:
+1. parser: reads chunks from a generator (chunker.iter_chunks, process pool) and groups them into blocks;
+2. embedder: encodes every block with the embedding model (texts in the embedding cache are not encoded);
+3. index writer: appends chunks and embeddings to the chunk store and adds vectors to the FAISS index
+   (if one is given; without index it is built from the stored embeddings afterwards).
+
+At most queue_size blocks wait between two stages, so memory does not depend
+on the number of documents.
+
+Functions:
+- stream_ingest(keyed_chunks, index, store, embedding_model, block_size, queue_size, cache): runs the stages and returns chunk id ranges per key.
+"""
+
+import queue
+import threading
+from collections.abc import Iterable
+from itertools import islice
+from time import perf_counter as timer
+from typing import TYPE_CHECKING
+
+import faiss
+import numpy as np
+
+from .chunk_store import ChunkStore
+from .config import EMBED_BLOCK_SIZE, INGEST_QUEUE_SIZE
+from .embedder import encode_chunk_texts
+from .embedding_cache import EmbeddingCache
+from .tracing import record_span
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+# End of stream marker
+_DONE = object()
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """
+    Puts an item into a bounded queue, giving up if the pipeline is stopped.
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    """
+    Gets an item from a queue, returns _DONE if the pipeline is stopped.
+    """
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def stream_ingest(
+    keyed_chunks: Iterable[tuple[str, dict]],
+    index: faiss.Index | None,
+    store: ChunkStore,
+    embedding_model: "SentenceTransformer",
+    block_size: int = EMBED_BLOCK_SIZE,
+    queue_size: int = INGEST_QUEUE_SIZE,
+    cache: EmbeddingCache | None = None,
+) -> dict[str, tuple[int, int]]:
+    """
+    Runs parsing, embedding and indexing of (key, chunk) pairs concurrently.
+    Vectors are added to the index (if not None) as they arrive; the caller saves the index.
+
+    Returns the [start, end) range of chunk ids of every key, in the order of appearance.
+    """
+    parsed_queue = queue.Queue(maxsize=queue_size)
+    embedded_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    stage_times = {"parse": 0.0, "embed": 0.0, "index": 0.0}
+
+    def parse_stage():
+        keyed_iter = iter(keyed_chunks)
+        try:
+            while True:
+                start_time = timer()
+                block = list(islice(keyed_iter, block_size))
+                stage_times["parse"] += timer() - start_time
+                if not block or not _put(parsed_queue, block, stop):
+                    break
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            # Shuts down the chunker process pool if the stream was not exhausted
+            if hasattr(keyed_iter, "close"):
+                keyed_iter.close()
+            _put(parsed_queue, _DONE, stop)
+
+    def embed_stage():
+        try:
+            while True:
+                block = _get(parsed_queue, stop)
+                if block is _DONE:
+                    break
+                start_time = timer()
+                embeddings = encode_chunk_texts([chunk["text"] for _, chunk in block], embedding_model, cache)
+                stage_times["embed"] += timer() - start_time
+                if not _put(embedded_queue, (block, embeddings), stop):
+                    break
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(embedded_queue, _DONE, stop)
+
+    threads = [
+        threading.Thread(target=parse_stage, name="ingest-parse", daemon=True),
+        threading.Thread(target=embed_stage, name="ingest-embed", daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    # Index writer runs in the calling thread
+    ids_ranges = {}
+    num_chunks = 0
+    try:
+        while True:
+            item = _get(embedded_queue, stop)
+            if item is _DONE:
+                break
+            block, embeddings = item
+
+            start_time = timer()
+            ids = store.append_chunks(chunk for _, chunk in block)
+            store.append_embeddings(embeddings)
+            if index is not None:
+                index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+            stage_times["index"] += timer() - start_time
+
+            for (key, _), idx in zip(block, ids):
+                start, _ = ids_ranges.get(key, (idx, idx))
+                ids_ranges[key] = (start, idx + 1)
+            num_chunks += len(ids)
+    except Exception:
+        stop.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+
+    for stage, seconds in stage_times.items():
+        record_span(f"ingest_{stage}", seconds, chunks=num_chunks)
+
+    print(
+        f"[INFO] Streamed {num_chunks} chunks: parsing {stage_times['parse']:.2f}s, "
+        f"embedding {stage_times['embed']:.2f}s, indexing {stage_times['index']:.2f}s."
+    )
+    return ids_ranges
@@ -3,21 +3,56 @@ Functions for forming a request to LLM, generating a response, and outputting it
 
 Functions:
 - chat_template_groq: creates a message in OpenAI chat format based on the request and relevant chunks.
+- get_client / get_async_client: shared pooled OpenAI-compatible clients with timeouts and retries.
 - client_response_groq: calls LLM via the GROQ API with a built-in dialog.
+- async_client_response_groq: async version of client_response_groq.
+- stream_response_groq: calls LLM in streaming mode and yields text deltas.
+- AnswerStream: extracts the "answer" field from a streamed JSON response.
+- extract_answer: returns the "answer" field of the LLM response.
 - print_response_markdown: outputs the LLM response in Markdown format (Streamlit).
 - print_response_console: outputs the LLM response in console mode.
+- print_stream_markdown / print_stream_console: output a streamed answer as tokens arrive.
 """
 
+import asyncio
 import json
+import re
+import weakref
+from collections.abc import Iterable, Iterator
+from functools import lru_cache
+from time import perf_counter as timer
+from typing import TYPE_CHECKING
 
-import streamlit as st
-from openai import OpenAI
+import numpy as np
 
-from .config import BASE_PROMPT, CHUNKS_PATH, DIALOGUE_INSTRUCTION, LLM_GROQ, QUERY
+from .chunk_store import ChunkStore
+from .chunker import count_tokens
+from .config import (
+    BASE_PROMPT,
+    DIALOGUE_INSTRUCTION,
+    LLM_GROQ,
+    LLM_MAX_RETRIES,
+    LLM_TIMEOUT,
+    QUERY,
+)
+from .context_builder import build_context
+from .snapshots import current_snapshot
+from .tracing import add_counter
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+ANSWER_FIELD_PATTERN = re.compile(r'"answer"\s*:\s*"')
+JSON_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
 
 
 def chat_template_groq(
-    indices: list[int], query: str = QUERY, base_prompt: str = BASE_PROMPT
+    indices: list[int],
+    query: str = QUERY,
+    base_prompt: str = BASE_PROMPT,
+    store: ChunkStore = None,
+    query_embedding: np.ndarray = None,
+    log: bool = True,
 ) -> list[dict]:
     """
     Creates a dialog template in OpenAI chat format.
@@ -26,26 +61,92 @@ def chat_template_groq(
     - indices: indices of relevant chunks.
     - query: user query.
     - base_prompt: prompt template with placeholders.
+    - store: chunk store to read the relevant chunk texts from (store of the current snapshot if not given).
+    - query_embedding: if given, the context is deduplicated and packed into CONTEXT_TOKEN_BUDGET
+      (see context_builder.py), otherwise all chunk texts are used.
+    - log: print prompt token counts (they are always added to the tracing counters).
 
     Returns:
     - a list of dictionaries with "system" and "user" roles for LLM.
     """
-    # Save chunks
-    with open(CHUNKS_PATH, "r", encoding="utf-8") as file:
-        chunks_and_statistics = json.load(file)
-    chunks_texts = [chunk["text"] for chunk in chunks_and_statistics]
+    # Read only relevant chunks
+    if store is None:
+        store = ChunkStore(current_snapshot().store_dir)
 
-    # Form context from relevant chunks
-    context = "- " + "\n- ".join(chunks_texts[idx] for idx in indices)
+    if query_embedding is not None:
+        context, stats = build_context(query_embedding, indices, store)
+    else:
+        # Form context from relevant chunks
+        context, stats = "- " + "\n- ".join(store.get_texts(indices)), None
 
     # Insert context and query into a template
     full_prompt = base_prompt.format(context=context, query=query)
 
     # Form a dialogue template
     dialogue_template = [DIALOGUE_INSTRUCTION, {"role": "user", "content": full_prompt}]
+
+    if stats is not None:
+        prompt_tokens = sum(
+            count_tokens([message["content"] for message in dialogue_template], add_special_tokens=False)
+        )
+        add_counter("prompt_tokens", prompt_tokens)
+        add_counter("context_tokens", stats["context_tokens"])
+        add_counter("retrieved_tokens", stats["retrieved_tokens"])
+    if log and stats is not None:
+        print(
+            f"[INFO] Prompt: {prompt_tokens} tokens, context {stats['context_tokens']} of "
+            f"{stats['retrieved_tokens']} retrieved tokens ({stats['chunks']} chunks, "
+            f"{stats['duplicates']} near-duplicates dropped, {stats['trimmed']} trimmed to sentences)."
+        )
     return dialogue_template
 
 
+@lru_cache(maxsize=None)
+def get_client(base_url: str = LLM_GROQ["base_url"], api_key: str = LLM_GROQ["api_key"]) -> "OpenAI":
+    """
+    Returns a shared OpenAI-compatible client (one connection pool per base_url and key).
+    The client retries 408/409/429/5xx responses and connection errors with exponential backoff.
+    """
+    if not api_key:
+        raise ValueError("API key is required for InferenceClient.")
+
+    from openai import OpenAI
+
+    return OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=LLM_TIMEOUT,
+        max_retries=LLM_MAX_RETRIES,
+    )
+
+
+# Async clients are bound to the event loop they are used in
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client(
+    base_url: str = LLM_GROQ["base_url"], api_key: str = LLM_GROQ["api_key"]
+) -> "AsyncOpenAI":
+    """
+    Returns a shared AsyncOpenAI client for the running event loop, with the same
+    timeout and retry settings as get_client().
+    """
+    if not api_key:
+        raise ValueError("API key is required for InferenceClient.")
+
+    from openai import AsyncOpenAI
+
+    loop_clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if (base_url, api_key) not in loop_clients:
+        loop_clients[(base_url, api_key)] = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=LLM_TIMEOUT,
+            max_retries=LLM_MAX_RETRIES,
+        )
+    return loop_clients[(base_url, api_key)]
+
+
 def client_response_groq(
     dialogue_template: list[dict],
     base_url: str = LLM_GROQ["base_url"],
@@ -64,10 +165,7 @@ def client_response_groq(
     Returns:
     - the model response text.
     """
-    if not api_key:
-        raise ValueError("API key is required for InferenceClient.")
-
-    client = OpenAI(api_key=api_key, base_url=base_url)
+    client = get_client(base_url=base_url, api_key=api_key)
 
     response = client.chat.completions.create(model=model, messages=dialogue_template)
     response_text = response.choices[0].message.content
@@ -75,17 +173,156 @@ def client_response_groq(
     return response_text
 
 
-def print_response_markdown(response_text: str):
+async def async_client_response_groq(
+    dialogue_template: list[dict],
+    base_url: str = LLM_GROQ["base_url"],
+    api_key: str = LLM_GROQ["api_key"],
+    model=LLM_GROQ["model"],
+) -> str:
     """
-    Outputs the LLM response in Streamlit as Markdown.
-    If the response is JSON with an "answer" field, output it. Otherwise, output the raw text.
+    Async version of client_response_groq() using the pooled AsyncOpenAI client.
+    """
+    client = get_async_client(base_url=base_url, api_key=api_key)
+
+    response = await client.chat.completions.create(model=model, messages=dialogue_template)
+    return response.choices[0].message.content
+
+
+def stream_response_groq(
+    dialogue_template: list[dict],
+    base_url: str = LLM_GROQ["base_url"],
+    api_key: str = LLM_GROQ["api_key"],
+    model=LLM_GROQ["model"],
+) -> Iterator[str]:
+    """
+    Makes a streaming request to LLM via the GROQ API and yields text deltas as they arrive.
+    """
+    client = get_client(base_url=base_url, api_key=api_key)
+
+    stream = client.chat.completions.create(
+        model=model, messages=dialogue_template, stream=True
+    )
+    for event in stream:
+        if event.choices and event.choices[0].delta.content:
+            yield event.choices[0].delta.content
+
+
+def _decode_json_string(text: str, pos: int) -> tuple[str, int, bool]:
+    """
+    Decodes a JSON string body from text[pos:] until the closing quote or the end of
+    the available text (an incomplete escape is left for the next call).
+    Returns (decoded text, next position, whether the closing quote was reached).
+    """
+    decoded = []
+    while pos < len(text):
+        char = text[pos]
+        if char == '"':
+            return "".join(decoded), pos + 1, True
+        if char != "\\":
+            decoded.append(char)
+            pos += 1
+            continue
+
+        if pos + 1 >= len(text):
+            break
+        escape = text[pos + 1]
+        if escape != "u":
+            decoded.append(JSON_ESCAPES.get(escape, escape))
+            pos += 2
+            continue
+
+        if pos + 6 > len(text):
+            break
+        code = int(text[pos + 2 : pos + 6], 16)
+        if 0xD800 <= code < 0xDC00:
+            # Surrogate pair: \uD83D\uDE00
+            if pos + 12 > len(text):
+                break
+            low = int(text[pos + 8 : pos + 12], 16)
+            code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+            pos += 6
+        decoded.append(chr(code))
+        pos += 6
+
+    return "".join(decoded), pos, False
+
+
+class AnswerStream:
+    """
+    Iterates over the "answer" field of a JSON response while it is streamed,
+    so only the final answer is shown to the user. Non-JSON responses are passed as is.
+    After iteration `text` holds the full response and `first_token_time` the
+    perf_counter time of the first yielded piece.
+    """
+
+    def __init__(self, deltas: Iterable[str]):
+        self.deltas = deltas
+        self.text = ""
+        self.first_token_time = None
+
+    def __iter__(self) -> Iterator[str]:
+        for piece in self._answer_pieces():
+            if piece:
+                if self.first_token_time is None:
+                    self.first_token_time = timer()
+                yield piece
+
+    def _answer_pieces(self) -> Iterator[str]:
+        mode = None
+        pos = None
+        done = False
+
+        for delta in self.deltas:
+            self.text += delta
+
+            if mode is None:
+                stripped = self.text.lstrip()
+                if not stripped:
+                    continue
+                # JSON (possibly in a ``` code block) or plain text
+                mode = "json" if stripped[0] in "{`" else "raw"
+                if mode == "raw":
+                    yield self.text
+                    continue
+
+            if mode == "raw":
+                yield delta
+                continue
+            if done:
+                continue
+
+            if pos is None:
+                match = ANSWER_FIELD_PATTERN.search(self.text)
+                if match is None:
+                    continue
+                pos = match.end()
+
+            piece, pos, done = _decode_json_string(self.text, pos)
+            yield piece
+
+        if mode == "json" and pos is None:
+            yield extract_answer(self.text)
+
+
+def extract_answer(response_text: str) -> str:
+    """
+    Returns the "answer" field if the response is JSON, otherwise the raw text.
     """
     try:
         parsed = json.loads(response_text)
-        answer = parsed.get("answer", "No answer field found in the response.")
-        st.markdown(answer)
+        return parsed.get("answer", "No answer field found in the response.")
     except Exception:
-        st.markdown(response_text)
+        return response_text
+
+
+def print_response_markdown(response_text: str):
+    """
+    Outputs the LLM response in Streamlit as Markdown.
+    If the response is JSON with an "answer" field, output it. Otherwise, output the raw text.
+    """
+    import streamlit as st
+
+    st.markdown(extract_answer(response_text))
 
 
 def print_response_console(response_text: str):
@@ -93,11 +330,24 @@ def print_response_console(response_text: str):
     Prints the LLM response to the console.
     If the response is JSON with the "answer" field, prints it. Otherwise, prints the raw text.
     """
-    try:
-        # Parse json
-        parsed = json.loads(response_text)
-        answer = parsed.get("answer", "No answer field found in the response.")
-        print(answer)
-    except Exception:
-        # If not - print as it is
-        print(response_text)
+    print(extract_answer(response_text))
+
+
+def print_stream_markdown(answer_stream: AnswerStream) -> str:
+    """
+    Renders the answer in Streamlit as tokens arrive. Returns the full response text.
+    """
+    import streamlit as st
+
+    st.write_stream(answer_stream)
+    return answer_stream.text
+
+
+def print_stream_console(answer_stream: AnswerStream) -> str:
+    """
+    Prints the answer to the console as tokens arrive. Returns the full response text.
+    """
+    for piece in answer_stream:
+        print(piece, end="", flush=True)
+    print()
+    return answer_stream.text
@@ -0,0 +1,204 @@
+"""
+Document loaders keyed by file extension.
+
+Every loader yields (unit_number, text) pairs of a document's units, numbered from 0:
+- .pdf: pages (PyMuPDF);
+- .docx: sections streamed from word/document.xml (zip + iterparse, no whole-document DOM),
+  a section ends at a heading, an explicit page break or after TEXT_SECTION_MAX_CHARS characters;
+- .txt: sections read through a buffered reader, a section ends at a form feed or at
+  the first blank line after TEXT_SECTION_MAX_CHARS characters.
+
+Functions:
+- get_loader(file_path): returns the Loader of the file extension.
+- count_units(file_path): number of units if known without reading the document (PDF pages), else None.
+- iter_units(file_path, first, last): yields (unit_number, text) of units [first, last).
+- iter_pdf_pages(file_path, first, last), iter_docx_sections(...), iter_txt_sections(...): the loaders.
+"""
+
+import os
+import zipfile
+from collections.abc import Callable, Iterator
+from itertools import islice
+from typing import NamedTuple
+from xml.etree.ElementTree import iterparse
+
+import fitz  # PyMuPDF
+
+from .config import TEXT_READ_BUFFER, TEXT_SECTION_MAX_CHARS
+
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+DOCX_BODY = WORD_NS + "body"
+DOCX_PARAGRAPH = WORD_NS + "p"
+DOCX_TEXT = WORD_NS + "t"
+DOCX_TAB = WORD_NS + "tab"
+DOCX_BREAK = WORD_NS + "br"
+DOCX_STYLE = WORD_NS + "pStyle"
+DOCX_PAGE_BREAK_BEFORE = WORD_NS + "pageBreakBefore"
+DOCX_TYPE = WORD_NS + "type"
+DOCX_VAL = WORD_NS + "val"
+
+
+class Loader(NamedTuple):
+    file_type: str
+    iter_units: Callable[..., Iterator[tuple[int, str]]]
+    count_units: Callable[[str], int] | None = None
+
+
+def count_pdf_pages(file_path: str) -> int:
+    """
+    Returns the number of pages of a PDF.
+    """
+    with fitz.open(file_path) as doc:
+        return doc.page_count
+
+
+def iter_pdf_pages(file_path: str, first: int = 0, last: int = None) -> Iterator[tuple[int, str]]:
+    """
+    Yields (page_number, text) of PDF pages [first, last).
+    """
+    with fitz.open(file_path) as doc:
+        if last is None:
+            last = doc.page_count
+        for i in range(first, min(last, doc.page_count)):
+            yield i, doc[i].get_text()
+
+
+def _iter_docx_paragraphs(file_path: str) -> Iterator[tuple[str, bool]]:
+    """
+    Yields (text, starts_section) of paragraphs of a .docx in document order.
+    Paragraph elements are removed from the tree once read, so memory does not grow with the document.
+    """
+    with zipfile.ZipFile(file_path) as archive, archive.open("word/document.xml") as xml:
+        body = None
+        depth = 0
+        for event, elem in iterparse(xml, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if elem.tag == DOCX_BODY:
+                    body, body_depth = elem, depth
+                continue
+
+            depth -= 1
+            if elem.tag == DOCX_PARAGRAPH:
+                parts = []
+                starts_section = False
+                for node in elem.iter():
+                    if node.tag == DOCX_TEXT:
+                        parts.append(node.text or "")
+                    elif node.tag == DOCX_TAB:
+                        parts.append("\t")
+                    elif node.tag == DOCX_BREAK:
+                        if node.get(DOCX_TYPE) == "page":
+                            starts_section = True
+                        parts.append("\n")
+                    elif node.tag == DOCX_STYLE:
+                        style = node.get(DOCX_VAL, "")
+                        starts_section |= style.startswith(("Heading", "Title"))
+                    elif node.tag == DOCX_PAGE_BREAK_BEFORE:
+                        starts_section = True
+                yield "".join(parts), starts_section
+                elem.clear()
+
+            # Top-level paragraphs, tables and section properties are dropped from the body
+            if body is not None and depth == body_depth:
+                body.remove(elem)
+
+
+def _iter_sections(paragraphs: Iterator[tuple[str, bool]], max_chars: int) -> Iterator[str]:
+    """
+    Groups paragraphs into sections: a new section starts at a marked paragraph
+    or when the current section reached max_chars characters.
+    """
+    section, size = [], 0
+    for text, starts_section in paragraphs:
+        if section and (starts_section or size >= max_chars):
+            yield "\n".join(section)
+            section, size = [], 0
+        if text.strip():
+            section.append(text)
+            size += len(text)
+    if section:
+        yield "\n".join(section)
+
+
+def iter_docx_sections(
+    file_path: str, first: int = 0, last: int = None, max_chars: int = TEXT_SECTION_MAX_CHARS
+) -> Iterator[tuple[int, str]]:
+    """
+    Yields (section_number, text) of .docx sections [first, last).
+    """
+    sections = _iter_sections(_iter_docx_paragraphs(file_path), max_chars)
+    yield from islice(enumerate(sections), first, last)
+
+
+def _iter_txt_paragraphs(file_path: str, buffer_size: int) -> Iterator[tuple[str, bool]]:
+    """
+    Yields (text, starts_section) of blank-line separated paragraphs of a text file;
+    a form feed starts a new section.
+    """
+    lines = []
+    starts_section = False
+    with open(file_path, "r", encoding="utf-8-sig", errors="replace", buffering=buffer_size) as f:
+        for line in f:
+            # Lines without a form feed (almost all) are one part
+            parts = line.split("\f") if "\f" in line else (line,)
+            for part_idx, part in enumerate(parts):
+                if part_idx > 0:
+                    if lines:
+                        yield "\n".join(lines), starts_section
+                        lines = []
+                    starts_section = True
+                if part and not part.isspace():
+                    lines.append(part.rstrip("\r\n"))
+                elif lines:
+                    yield "\n".join(lines), starts_section
+                    lines, starts_section = [], False
+    if lines:
+        yield "\n".join(lines), starts_section
+
+
+def iter_txt_sections(
+    file_path: str,
+    first: int = 0,
+    last: int = None,
+    max_chars: int = TEXT_SECTION_MAX_CHARS,
+    buffer_size: int = TEXT_READ_BUFFER,
+) -> Iterator[tuple[int, str]]:
+    """
+    Yields (section_number, text) of text file sections [first, last).
+    """
+    sections = _iter_sections(_iter_txt_paragraphs(file_path, buffer_size), max_chars)
+    yield from islice(enumerate(sections), first, last)
+
+
+LOADERS = {
+    ".pdf": Loader("pdf", iter_pdf_pages, count_pdf_pages),
+    ".docx": Loader("docx", iter_docx_sections),
+    ".txt": Loader("txt", iter_txt_sections),
+}
+SUPPORTED_EXTENSIONS = tuple(LOADERS)
+
+
+def get_loader(file_path: str) -> Loader:
+    """
+    Returns the loader of the file extension.
+    """
+    extension = os.path.splitext(str(file_path))[1].lower()
+    if extension not in LOADERS:
+        raise ValueError(f"Unsupported file type '{extension}', expected one of {SUPPORTED_EXTENSIONS}.")
+    return LOADERS[extension]
+
+
+def count_units(file_path: str) -> int | None:
+    """
+    Returns the number of units of a document if it is known without reading the whole document, else None.
+    """
+    loader = get_loader(file_path)
+    return loader.count_units(file_path) if loader.count_units else None
+
+
+def iter_units(file_path: str, first: int = 0, last: int = None) -> Iterator[tuple[int, str]]:
+    """
+    Yields (unit_number, text) of units [first, last) of a document.
+    """
+    return get_loader(file_path).iter_units(file_path, first, last)
@@ -0,0 +1,107 @@
+"""
+A manifest of ingested source files used for incremental ingestion.
+
+For every source file the manifest keeps its content hash, size, modification time
+and the range of chunk ids it produced in the chunk store.
+
+Functions:
+- file_sha256(file_path): computes the content hash of a file.
+- load_manifest(path) / save_manifest(manifest, path): reads and writes the manifest JSON.
+- plan_changes(manifest, files_paths): splits files into new, modified, deleted and unchanged.
+"""
+
+import hashlib
+import json
+import os
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(file_path: str, block_size: int = 1 << 20) -> str:
+    """
+    Returns the SHA-256 of a file, read in blocks.
+    """
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def empty_manifest() -> dict:
+    """
+    Returns a manifest without files.
+    """
+    return {"version": MANIFEST_VERSION, "files": {}}
+
+
+def load_manifest(path: str) -> dict | None:
+    """
+    Loads the manifest or returns None if it is missing or has another version.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(manifest: dict, path: str) -> None:
+    """
+    Atomically saves the manifest.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def file_entry(file_path: str, sha256: str = None) -> dict:
+    """
+    Returns manifest fields describing the current state of a file.
+    """
+    stat = os.stat(file_path)
+    return {
+        "sha256": sha256 or file_sha256(file_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def plan_changes(manifest: dict, files_paths: list[str]) -> dict:
+    """
+    Compares files with the manifest.
+
+    A file is hashed only if its size or modification time differ from the manifest,
+    so unchanged files cost one stat call.
+
+    Returns a dict with lists of paths "new", "modified", "unchanged" and a list
+    of manifest keys "deleted".
+    """
+    files = manifest["files"]
+    changes = {"new": [], "modified": [], "unchanged": [], "deleted": []}
+
+    for file_path in files_paths:
+        entry = files.get(file_path)
+        if entry is None:
+            changes["new"].append(file_path)
+            continue
+
+        stat = os.stat(file_path)
+        if stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]:
+            changes["unchanged"].append(file_path)
+        elif file_sha256(file_path) == entry["sha256"]:
+            # Touched but not changed: remember the new mtime to skip hashing next time
+            entry["mtime_ns"] = stat.st_mtime_ns
+            changes["unchanged"].append(file_path)
+        else:
+            changes["modified"].append(file_path)
+
+    present = set(files_paths)
+    changes["deleted"] = [file_path for file_path in files if file_path not in present]
+
+    return changes
@@ -1,98 +1,391 @@
 """
 The main module for running two RAG system pipelines:
-1. run_data_pipeline() — performs document processing (chunking, embedding, indexing).
+1. run_data_pipeline() — performs incremental document processing (chunking, embedding, indexing).
 2. run_query_answer_pipeline() — processes a user query, finds relevant chunks, and calls LLM.
+3. run_batch_query_pipeline() — answers a list/JSONL file of queries with batched embedding and search.
 
 Modules:
 - chunker: splitting documents into chunks.
+- loaders: reading pages/sections of .pdf, .docx and .txt documents.
 - embedder: creating embeddings for chunks and queries.
+- ingest: streaming ingestion with concurrent parsing, embedding and indexing.
 - retriever: indexing and searching for similar chunks.
 - llm_interface: preparing a query template, calling LLM, formatting the response.
+- chunk_store: binary storage of chunks and embeddings.
+- manifest: content hashes of ingested files for incremental processing.
+- query_engine: keeping the FAISS index and chunk store open between queries.
+- answer_cache: reusing LLM answers of near-duplicate queries.
+- context_builder: deduplicating and packing retrieved chunks into a token budget.
+- reranker: re-ordering retrieved chunks with a cross-encoder.
+- snapshots: versioned snapshots of chunks and indexes published atomically.
 """
 
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from time import perf_counter as timer
 
-from .chunker import save_chunks_and_stats, split_into_chunks
-from .config import CHUNKS_PATH, DATA_PATH, INDEX_PATH
-from .embedder import embed_chunks, embed_query
+import faiss
+import numpy as np
+
+from .answer_cache import AnswerCache, get_answer_cache
+from .bm25 import build_bm25_index, update_bm25_index
+from .chunk_store import ChunkStore
+from .chunker import iter_chunks
+from .config import (
+    ANSWER_CACHE_ENABLED,
+    BATCH_LLM_CONCURRENCY,
+    BM25_MIN_SCORE,
+    BATCH_QUERY_SIZE,
+    CHUNKS_DIR,
+    COMPACT_DEAD_RATIO,
+    DATA_PATH,
+    EMBED_QUERY_BATCH_SIZE,
+    EMBEDDING_CACHE_ENABLED,
+    HYBRID_CANDIDATES,
+    HYBRID_SEARCH,
+    INDEX_METRIC,
+    LLM_STREAMING,
+    NO_RELEVANT_CONTEXT_ANSWER,
+    RELEVANCE_THRESHOLD,
+    RERANK_CANDIDATES,
+    RERANKING,
+    STREAMING_INGESTION,
+    TOP_K,
+)
+from .embedder import embed_chunk_stream, embed_query, encode_texts, get_embedding_model
+from .embedding_cache import get_embedding_cache
+from .ingest import stream_ingest
+from .loaders import SUPPORTED_EXTENSIONS
 from .llm_interface import (
+    AnswerStream,
     chat_template_groq,
     client_response_groq,
+    extract_answer,
     print_response_console,
     print_response_markdown,
+    print_stream_console,
+    print_stream_markdown,
+    stream_response_groq,
+)
+from .manifest import empty_manifest, file_entry, load_manifest, plan_changes, save_manifest
+from .query_engine import QueryEngine, get_query_engine
+from .reranker import Reranker, get_reranker
+from .snapshots import Snapshot, create_snapshot, current_snapshot, discard_snapshot, gc_snapshots, publish_snapshot
+from .tracing import add_counter, record_span, span, trace
+from .retriever import (
+    IVF_INDEX_TYPES,
+    add_chunks_to_index,
+    create_index,
+    get_index_metric,
+    get_index_type,
+    index_chunks,
+    remove_chunks_from_index,
+    resolve_index_type,
 )
-from .retriever import index_chunks, retrieve_top_k_chunks
 
 
-def run_data_pipeline():
+def load_index_for_update(faiss_path: str) -> faiss.Index | None:
+    """
+    Returns the saved index if it can be updated by chunk ids, otherwise None.
+    """
+    if not os.path.exists(faiss_path):
+        return None
+    index = faiss.read_index(faiss_path)
+    return index if isinstance(index, faiss.IndexIDMap) or get_index_type(index) in IVF_INDEX_TYPES else None
+
+
+@trace("ingest")
+def run_data_pipeline(full_rebuild: bool = False, streaming: bool = STREAMING_INGESTION):
     """
-    Full data processing pipeline:
+    Incremental data processing pipeline:
     - creates necessary folders if missing;
     - finds all files in DATA_PATH with supported extensions (.pdf, .docx, .txt);
-    - splits documents into chunks;
-    - creates embeddings for chunks;
-    - indexes embeddings with FAISS.
+    - compares files with the manifest of content hashes from the previous run;
+    - removes vectors of deleted and modified documents from the index;
+    - splits new and modified documents into chunks and streams them to the embedder;
+    - creates embeddings for new chunks in blocks (texts embedded before are taken from the embedding cache);
+    - adds new embeddings to the FAISS index (rebuilt from stored embeddings
+      when the index type chosen for the corpus size changes);
+    - updates the BM25 keyword index: drops removed chunks, adds new ones (if HYBRID_SEARCH).
+
+    Results are written to a new snapshot (see snapshots.py) which is published atomically
+    when complete, so running queries never see a partially written index or chunk store.
+
+    All documents are processed if full_rebuild=True or there is no previous run.
+    With streaming=True parsing, embedding and indexing run concurrently (see ingest.py).
     """
     print("[INFO] Start data pipeline.")
 
     os.makedirs(DATA_PATH, exist_ok=True)
-    os.makedirs(os.path.dirname(CHUNKS_PATH), exist_ok=True)
+    os.makedirs(CHUNKS_DIR, exist_ok=True)
 
     # Files search
     data_dir = DATA_PATH
     print(f"Data directory: {data_dir}")
 
-    allowed_ext = (".pdf", ".docx", ".txt")
-    files_paths = [
+    allowed_ext = SUPPORTED_EXTENSIONS
+    files_paths = sorted(
         os.path.join(data_dir, file_name)
         for file_name in os.listdir(data_dir)
         if file_name.lower().endswith(allowed_ext)
-    ]
+    )
 
     for file in files_paths:
         file_path = Path(file)
         if not file_path.exists():
             print(f"[WARNING] File path {file_path} does not exist.")
 
-    # chunker
-    print("[INFO] Running chunker...")
-    chunks = split_into_chunks(files_paths)
-    save_chunks_and_stats(all_chunks=chunks)
-
-    # embedder.py
-    print("[INFO] Creating embeddings for chunks...")
-    embed_chunks()
+    # manifest.py
+    base = current_snapshot()
+    manifest = load_manifest(base.manifest_path) if base is not None and not full_rebuild else None
+    index = (
+        load_index_for_update(base.index_path)
+        if manifest is not None and ChunkStore(base.store_dir).exists()
+        else None
+    )
+    if index is None:
+        print("[INFO] Full rebuild of chunks and index.")
+        manifest = empty_manifest()
 
-    # retriever.py
-    print("[INFO] Indexing embeddings with FAISS...")
-    index_chunks()
-    print(f"Пробуємо знайти індекс за шляхом: {INDEX_PATH}")
+    changes = plan_changes(manifest, files_paths)
     print(
-        f"Файли в папці chunks/: {os.listdir(os.path.dirname(INDEX_PATH)) if os.path.exists(os.path.dirname(INDEX_PATH)) else 'папка відсутня'}"
+        f"[INFO] Files: {len(changes['new'])} new, {len(changes['modified'])} modified, "
+        f"{len(changes['deleted'])} deleted, {len(changes['unchanged'])} unchanged."
     )
+
+    # Index of an older version: embeddings were not normalized or another metric is used
+    index_outdated = index is not None and (
+        not ChunkStore(base.store_dir).normalized or get_index_metric(index) != INDEX_METRIC
+    )
+
+    to_parse = changes["new"] + changes["modified"]
+    to_remove = changes["deleted"] + changes["modified"]
+    bm25_missing = HYBRID_SEARCH and index is not None and not os.path.exists(base.bm25_path)
+    if index is not None and not to_parse and not to_remove and not index_outdated and not bm25_missing:
+        # The published snapshot is never modified: new modification times of touched files
+        # are not saved, they are hashed again until the next ingestion writes a manifest
+        print("[INFO] Documents are up to date.")
+        return
+
+    # The published snapshot is not modified: new chunks are appended to its linked (or copied) store
+    with span("ingest_snapshot", base=base.version if index is not None else None):
+        snapshot = create_snapshot(base if index is not None else None)
+    try:
+        # A rebuilt store continues the index generation of the published one (see answer_cache.py)
+        generation = ChunkStore(base.store_dir).index_generation if base is not None else 0
+        _update_snapshot(snapshot, manifest, index, changes, index_outdated, streaming, generation)
+    except BaseException:
+        discard_snapshot(snapshot)
+        raise
+
+    publish_snapshot(snapshot)
+    gc_snapshots()
+    print(f"[INFO] Data pipeline finished: {len(manifest['files'])} documents indexed.")
+
+
+def _update_snapshot(
+    snapshot: Snapshot,
+    manifest: dict,
+    index: faiss.Index | None,
+    changes: dict,
+    index_outdated: bool,
+    streaming: bool,
+    generation: int = 0,
+) -> None:
+    """
+    Applies the planned changes to an unpublished snapshot: removes chunks of deleted and
+    modified documents from the index, ingests new chunks, updates or rebuilds the index,
+    updates BM25 and saves the manifest. Without index the snapshot is built from scratch,
+    starting from the given index generation.
+    """
+    store = ChunkStore(snapshot.store_dir)
+    to_parse = changes["new"] + changes["modified"]
+    to_remove = changes["deleted"] + changes["modified"]
+
+    removed_ids = []
+    for file_path in to_remove:
+        entry = manifest["files"].pop(file_path)
+        removed_ids.extend(range(entry["start"], entry["end"]))
+
+    # Without an index to update, the index is built from the stored embeddings when the number
+    # of vectors (and so the index type) is known; it is not filled during ingestion
+    rebuild_index = index_outdated
+    if index_outdated and not store.normalized:
+        store.normalize_embeddings()
+
+    # Chunk ids are renumbered or the index is replaced: answers cached for the old index are dropped
+    index_replaced = index is None
+    if index is None:
+        store.reset()
+        store.write_meta(index_generation=generation)
+        rebuild_index = True
+    elif not rebuild_index and not remove_chunks_from_index(index, np.asarray(removed_ids, dtype="int64")):
+        rebuild_index = True
+    # An index that is rebuilt anyway is not filled, so vectors are not held in memory twice
+    if rebuild_index:
+        index = None
+    first_new_id = len(store)
+
+    # embedding_cache.py
+    cache = get_embedding_cache() if EMBEDDING_CACHE_ENABLED else None
+    hits_before, misses_before = (cache.hits, cache.misses) if cache is not None else (0, 0)
+
+    with span("ingest_chunks", files=len(to_parse), streaming=streaming) as chunks_span:
+        if streaming:
+            # chunker.py -> embedder -> retriever stages run concurrently
+            print("[INFO] Streaming chunker, embeddings and FAISS indexing...")
+            # Without index only chunks and embeddings are stored
+            ids_ranges = stream_ingest(iter_chunks(to_parse), index, store, get_embedding_model(), cache=cache)
+        else:
+            # chunker.py -> embedder.py, chunks are streamed to the embedder as they are produced
+            print("[INFO] Running chunker and creating embeddings for chunks...")
+            ids_ranges = embed_chunk_stream(iter_chunks(to_parse), store_dir=snapshot.store_dir, cache=cache)
+
+            # retriever.py
+            if index is not None:
+                print("[INFO] Indexing embeddings with FAISS...")
+                add_chunks_to_index(index, store, np.arange(first_new_id, len(store)))
+
+        num_new_chunks = len(store) - first_new_id
+        chunks_per_second = num_new_chunks / max(chunks_span.elapsed(), 1e-9)
+        chunks_span.set(chunks=num_new_chunks, chunks_per_second=round(chunks_per_second, 1))
+        if cache is not None:
+            cache_hits, cache_misses = cache.hits - hits_before, cache.misses - misses_before
+            hit_rate = cache_hits / max(cache_hits + cache_misses, 1)
+            chunks_span.set(embedding_cache_hits=cache_hits, embedding_cache_hit_rate=round(hit_rate, 4))
+    add_counter("chunks_ingested", num_new_chunks)
+    print(f"[INFO] Ingested {num_new_chunks} chunks ({chunks_per_second:.1f} chunks/s).")
+    if cache is not None:
+        cache.save()
+        print(
+            f"[INFO] Embedding cache: {cache_hits} of {cache_hits + cache_misses} vectors reused "
+            f"(hit rate {hit_rate:.1%}), {len(cache)} cached."
+        )
+
+    for file_path in to_parse:
+        start, end = ids_ranges.get(file_path, (len(store), len(store)))
+        manifest["files"][file_path] = {**file_entry(file_path), "start": start, "end": end}
+
+    live_ids = live_chunk_ids(manifest)
+    index_type = resolve_index_type(live_ids.size)
+    compacted = False
+    if index is None and live_ids.size == 0:
+        # No embeddings to build from: an empty index
+        index = create_index(get_embedding_model().get_sentence_embedding_dimension(), "flat")
+        index_type, rebuild_index = "flat", False
+    if len(store) - live_ids.size > COMPACT_DEAD_RATIO * len(store):
+        with span("ingest_compact", chunks=len(store)):
+            compact_chunk_store(store, manifest)
+            compacted = True
+            index_chunks(store_dir=snapshot.store_dir, faiss_path=snapshot.index_path, index_type=index_type)
+        index_replaced = True
+    elif rebuild_index or get_index_type(index) != index_type:
+        # Rebuilt from stored embeddings, no re-embedding
+        print(f"[INFO] Rebuilding FAISS index as '{index_type}'...")
+        with span("ingest_rebuild_index", chunks=live_ids.size, index_type=index_type):
+            index_chunks(
+                store_dir=snapshot.store_dir, faiss_path=snapshot.index_path, ids=live_ids, index_type=index_type
+            )
+        index_replaced = True
+    else:
+        with span("ingest_save_index"):
+            faiss.write_index(index, snapshot.index_path)
+        print(f"[INFO] In FAISS index {index.ntotal} vectors")
+
+    if HYBRID_SEARCH:
+        # bm25.py
+        with span("ingest_bm25", chunks=live_ids.size):
+            if compacted:
+                # Chunk ids were renumbered: the BM25 index of the base snapshot is not valid
+                print("[INFO] Building BM25 keyword index...")
+                build_bm25_index(store, live_chunk_ids(manifest), path=snapshot.bm25_path)
+            else:
+                print("[INFO] Updating BM25 keyword index...")
+                update_bm25_index(store, live_chunk_ids(manifest), path=snapshot.bm25_path)
+
+    if index_replaced:
+        generation = store.next_index_generation()
+        print(f"[INFO] Index generation {generation}, cached answers of the previous index are invalid.")
+
+    save_manifest(manifest, snapshot.manifest_path)
+
+
+def live_chunk_ids(manifest: dict) -> np.ndarray:
+    """
+    Returns ids of chunks of all documents in the manifest.
+    """
+    ranges = [np.arange(entry["start"], entry["end"]) for entry in manifest["files"].values()]
+    return np.concatenate(ranges).astype("int64") if ranges else np.empty(0, dtype="int64")
+
+
+def compact_chunk_store(store: ChunkStore, manifest: dict) -> None:
+    """
+    Drops chunks of deleted and modified documents from the store and renumbers
+    the chunk ids in the manifest. The index must be rebuilt afterwards.
+    """
+    start_time = timer()
+    files = list(manifest["files"].values())
+    total_before = len(store)
+
+    new_starts = store.compact([(entry["start"], entry["end"]) for entry in files])
+    for entry, new_start in zip(files, new_starts):
+        entry["end"] = new_start + entry["end"] - entry["start"]
+        entry["start"] = new_start
+
+    end_time = timer()
     print(
-        f"Файли в data/: {os.listdir('data') if os.path.exists('data') else 'папка відсутня'}"
+        f"[INFO] Compacted chunk store from {total_before} to {len(store)} chunks "
+        f"in {end_time - start_time:.2f} seconds."
     )
 
 
+@trace("query")
 def run_query_answer_pipeline(
-    query: str = None, run_mode="console", llm_provider="groq"
-):
+    query: str = None,
+    run_mode="console",
+    llm_provider="groq",
+    engine: QueryEngine = None,
+    relevance_threshold: float = RELEVANCE_THRESHOLD,
+    stream: bool = LLM_STREAMING,
+    cache: AnswerCache | None = None,
+    files: list[str] | None = None,
+    reranker: Reranker | None = None,
+) -> str:
     """
     Pipeline for responding to user request:
     - creates embedding for request;
-    - finds top-K relevant chunks;
-    - forms query template to LLM;
-    - sends query to LLM and returns response.
+    - finds top-K relevant chunks (vector search fused with BM25 keyword search if HYBRID_SEARCH)
+      and drops ones below the relevance threshold (strong keyword matches are kept);
+    - if RERANKING, over-fetches RERANK_CANDIDATES chunks and keeps the top-K by cross-encoder scores;
+    - returns a cached answer of a near-duplicate query with the same chunks (see answer_cache.py);
+    - forms query template to LLM (context deduplicated and packed into CONTEXT_TOKEN_BUDGET);
+    - sends query to LLM and outputs response (without LLM call if no chunk is relevant).
 
     Parameters:
     - query (str): query text. If None — takes QUERY from config.py;
     - run_mode (str): "console" or "streamlit" — response output format;
-    - llm_provider (str): which LLM is used (e.g., "groq").
+    - llm_provider (str): which LLM is used (e.g., "groq");
+    - engine (QueryEngine): in-memory index and chunks. If None — the process-wide engine is used;
+    - relevance_threshold (float): minimal cosine similarity of a chunk to the query;
+    - stream (bool): output the answer token by token as LLM generates it;
+    - cache (AnswerCache): cache of answers. If None — the process-wide cache (if ANSWER_CACHE_ENABLED);
+    - files (list[str]): search only chunks of these documents (paths or file names). If None — all documents;
+    - reranker (Reranker): cross-encoder re-ranking. If None — the process-wide reranker (if RERANKING).
+
+    Returns the full LLM response text.
     """
     start_time = timer()
+    add_counter("queries")
+
+    if engine is None:
+        engine = get_query_engine()
+    if cache is None and ANSWER_CACHE_ENABLED:
+        cache = get_answer_cache()
+    if reranker is None and RERANKING:
+        reranker = get_reranker()
+    num_candidates = RERANK_CANDIDATES if reranker is not None else TOP_K
 
     #  Query
     if query is None:
@@ -102,18 +395,92 @@ def run_query_answer_pipeline(
 
     # embedder.py
     print("[INFO] Embedding query...")
-    query_embedding = embed_query(query=query)
+    with span("embed"):
+        query_embedding = embed_query(query=query)
+
+    # All steps of the query use one snapshot, even if a new one is published meanwhile
+    state = engine.state()
 
     # retriever.py
     print("[INFO] Retrieving top-k relevant chunks...")
-    indices = retrieve_top_k_chunks(query_embedding=query_embedding)
+    with span("search", hybrid=HYBRID_SEARCH, k=num_candidates, filtered=files is not None):
+        if HYBRID_SEARCH:
+            indices, scores, keyword_scores = engine.retrieve_hybrid(
+                query=query,
+                query_embedding=query_embedding,
+                k=num_candidates,
+                candidates=max(HYBRID_CANDIDATES, num_candidates),
+                files=files,
+                state=state,
+            )
+        else:
+            indices, scores = engine.retrieve(
+                query_embedding=query_embedding, k=num_candidates, files=files, state=state
+            )
+            keyword_scores = [0.0] * len(indices)
+    indices = [
+        idx
+        for idx, score, keyword_score in zip(indices, scores, keyword_scores)
+        if score >= relevance_threshold or keyword_score >= BM25_MIN_SCORE
+    ]
+
+    # reranker.py
+    if reranker is not None and len(indices) > 1:
+        print("[INFO] Re-ranking candidates with cross-encoder...")
+        with span("rerank", candidates=len(indices)):
+            indices = reranker.rerank(query=query, indices=indices, texts=engine.get_texts(indices, state))
+    indices = indices[:TOP_K]
+
+    cached = None
+    if indices and cache is not None:
+        with span("answer_cache_lookup"):
+            cached = cache.lookup(query_embedding, indices, state.index_generation)
+
+    if not indices:
+        # Nothing relevant in the documents, LLM call is skipped
+        print(f"[INFO] No chunks with similarity >= {relevance_threshold}, LLM is not called.")
+        add_counter("no_context_answers")
+        response_text = json.dumps({"thoughts": "", "answer": NO_RELEVANT_CONTEXT_ANSWER})
+    elif cached is not None:
+        add_counter("answer_cache_hits")
+        print(
+            f"[INFO] Answer cache hit (similarity {cached['similarity']:.4f} "
+            f"to \"{cached['query']}\"), LLM is not called."
+        )
+        response_text = cached["response_text"]
+    else:
+        # llm_interface.py
+        print("[INFO] Generating prompt and calling LLM...")
+        print(f"[INFO] LLM provider: {llm_provider} | Run mode: {run_mode}")
+
+        with span("prompt", chunks=len(indices)):
+            dialogue_template = chat_template_groq(
+                indices=indices, query=query, store=state.store, query_embedding=query_embedding
+            )
+        add_counter("llm_calls")
 
-    # llm_interface.py
-    print("[INFO] Generating prompt and calling LLM...")
-    print(f"[INFO] LLM provider: {llm_provider} | Run mode: {run_mode}")
+        if stream:
+            # Time to first token is the latency the user sees
+            with span("llm", stream=True):
+                answer_stream = AnswerStream(stream_response_groq(dialogue_template=dialogue_template))
+                if run_mode == "streamlit":
+                    response_text = print_stream_markdown(answer_stream)
+                else:
+                    response_text = print_stream_console(answer_stream)
+            if cache is not None:
+                cache.put(query, query_embedding, indices, response_text, state.index_generation)
 
-    dialogue_template = chat_template_groq(indices=indices, query=query)
-    response_text = client_response_groq(dialogue_template=dialogue_template)
+            end_time = timer()
+            if answer_stream.first_token_time is not None:
+                record_span("time_to_first_token", answer_stream.first_token_time - start_time)
+                print(f"[INFO] Time to first token: {answer_stream.first_token_time-start_time:.5f} seconds.")
+            print(f"[INFO] Time: {end_time-start_time:.5f} seconds.")
+            return response_text
+
+        with span("llm", stream=False):
+            response_text = client_response_groq(dialogue_template=dialogue_template)
+        if cache is not None:
+            cache.put(query, query_embedding, indices, response_text, state.index_generation)
 
     end_time = timer()
     print(f"[INFO] Time: {end_time-start_time:.5f} seconds.")
@@ -123,3 +490,202 @@ def run_query_answer_pipeline(
         print_response_markdown(response_text)
     else:
         print_response_console(response_text)
+
+    return response_text
+
+
+def load_batch_queries(queries: list[str] | str) -> list[dict]:
+    """
+    Returns queries as dicts with "id" and "query".
+    Accepts a list of strings or a path to a JSONL file with {"query": ...} objects
+    (an optional "id" is kept) or plain JSON strings per line.
+    """
+    if isinstance(queries, str):
+        with open(queries, "r", encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+    else:
+        lines = list(queries)
+
+    records = []
+    for i, line in enumerate(lines):
+        if isinstance(line, str):
+            records.append({"id": i, "query": line})
+        else:
+            records.append({"id": line.get("id", i), "query": line["query"]})
+    return records
+
+
+def _timed_llm_call(dialogue_template: list[dict]) -> tuple[str | None, str | None, float]:
+    """
+    Calls LLM and returns (response, error, seconds); errors do not stop the batch.
+    """
+    start_time = timer()
+    try:
+        response_text, error = client_response_groq(dialogue_template=dialogue_template), None
+    except Exception as e:
+        response_text, error = None, f"{type(e).__name__}: {e}"
+    return response_text, error, timer() - start_time
+
+
+@trace("batch")
+def run_batch_query_pipeline(
+    queries: list[str] | str,
+    output_path: str,
+    engine: QueryEngine = None,
+    batch_size: int = BATCH_QUERY_SIZE,
+    concurrency: int = BATCH_LLM_CONCURRENCY,
+    relevance_threshold: float = RELEVANCE_THRESHOLD,
+    hybrid: bool = HYBRID_SEARCH,
+    use_cache: bool = ANSWER_CACHE_ENABLED,
+    cache: AnswerCache | None = None,
+) -> dict:
+    """
+    Pipeline for answering many queries (e.g. nightly FAQ jobs). For every batch of queries:
+    - embeds all queries in one encode call;
+    - finds top-K chunks for all queries in one index.search call (fused with BM25 keyword
+      search if hybrid, as in run_query_answer_pipeline);
+    - takes answers of near-duplicate queries with the same chunks from the answer cache;
+    - builds prompts (queries without relevant chunks are answered without LLM);
+    - calls LLM with at most `concurrency` requests in flight and caches the answers.
+
+    Results are written to output_path as JSONL in the order of queries, with per-query
+    LLM time. Returns total per-stage timing.
+
+    Parameters:
+    - queries: list of query strings or path to a JSONL file;
+    - output_path: JSONL file for the answers;
+    - engine (QueryEngine): in-memory index and chunks. If None — the process-wide engine is used;
+    - batch_size: number of queries embedded and searched at once;
+    - concurrency: maximum number of parallel LLM calls;
+    - hybrid: fuse vector search with BM25 keyword search;
+    - use_cache: answer near-duplicate queries from the answer cache and cache new answers;
+    - cache (AnswerCache): cache of answers. If None — the process-wide cache.
+    """
+    start_time = timer()
+    if engine is None:
+        engine = get_query_engine()
+    if not use_cache:
+        cache = None
+    elif cache is None:
+        cache = get_answer_cache()
+
+    records = load_batch_queries(queries)
+    print(f"[INFO] Batch of {len(records)} queries, LLM concurrency {concurrency}.")
+
+    timing = {"embed": 0.0, "search": 0.0, "prompt": 0.0, "llm": 0.0}
+    num_llm_calls = 0
+    num_errors = 0
+    num_cache_hits = 0
+
+    with open(output_path, "w", encoding="utf-8") as out, ThreadPoolExecutor(
+        max_workers=concurrency
+    ) as executor:
+        for batch_start in range(0, len(records), batch_size):
+            batch = records[batch_start : batch_start + batch_size]
+
+            add_counter("queries", len(batch))
+
+            # embedder.py
+            with span("batch_embed", queries=len(batch)) as stage_span:
+                query_embeddings = encode_texts(
+                    [record["query"] for record in batch], batch_size=EMBED_QUERY_BATCH_SIZE
+                )
+            timing["embed"] += stage_span.seconds
+
+            # retriever.py
+            state = engine.state()
+            with span("batch_search", queries=len(batch), hybrid=hybrid) as stage_span:
+                if hybrid:
+                    found = engine.retrieve_hybrid_batch(
+                        [record["query"] for record in batch],
+                        query_embeddings,
+                        k=TOP_K,
+                        candidates=max(HYBRID_CANDIDATES, TOP_K),
+                        state=state,
+                    )
+                else:
+                    batch_indices, batch_scores = engine.search_batch(query_embeddings, state=state)
+                    found = [
+                        (indices, scores, [0.0] * len(indices)) for indices, scores in zip(batch_indices, batch_scores)
+                    ]
+            timing["search"] += stage_span.seconds
+
+            cached = [None] * len(batch)
+            for i, (record, (indices, scores, keyword_scores)) in enumerate(zip(batch, found)):
+                relevant = [
+                    (int(idx), float(score))
+                    for idx, score, keyword_score in zip(indices, scores, keyword_scores)
+                    if idx >= 0 and (score >= relevance_threshold or keyword_score >= BM25_MIN_SCORE)
+                ]
+                record["chunk_ids"] = [idx for idx, _ in relevant]
+                record["scores"] = [round(score, 4) for _, score in relevant]
+                if relevant and cache is not None:
+                    with span("answer_cache_lookup"):
+                        cached[i] = cache.lookup(query_embeddings[i], record["chunk_ids"], state.index_generation)
+
+            # llm_interface.py
+            with span("batch_prompt", queries=len(batch)) as stage_span:
+                dialogues = [
+                    chat_template_groq(
+                        indices=record["chunk_ids"],
+                        query=record["query"],
+                        store=state.store,
+                        query_embedding=query_embedding,
+                        log=False,
+                    )
+                    if record["chunk_ids"] and hit is None
+                    else None
+                    for record, query_embedding, hit in zip(batch, query_embeddings, cached)
+                ]
+            timing["prompt"] += stage_span.seconds
+
+            with span("batch_llm", queries=len(batch)) as stage_span:
+                futures = [
+                    executor.submit(_timed_llm_call, dialogue) if dialogue else None
+                    for dialogue in dialogues
+                ]
+                for record, future, hit, query_embedding in zip(batch, futures, cached, query_embeddings):
+                    if hit is not None:
+                        response_text, error, llm_time = hit["response_text"], None, 0.0
+                        num_cache_hits += 1
+                    elif future is None:
+                        response_text, error, llm_time = (
+                            json.dumps({"thoughts": "", "answer": NO_RELEVANT_CONTEXT_ANSWER}),
+                            None,
+                            0.0,
+                        )
+                        add_counter("no_context_answers")
+                    else:
+                        response_text, error, llm_time = future.result()
+                        record_span("llm", llm_time, stream=False, error=error)
+                        num_llm_calls += 1
+                        num_errors += error is not None
+                        if error is None and cache is not None:
+                            cache.put(
+                                record["query"], query_embedding, record["chunk_ids"], response_text,
+                                state.index_generation,
+                            )
+
+                    record["answer"] = extract_answer(response_text) if response_text else None
+                    record["cached"] = hit is not None
+                    record["error"] = error
+                    record["llm_seconds"] = round(llm_time, 4)
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            timing["llm"] += stage_span.seconds
+
+            print(f"[INFO] Answered {batch_start + len(batch)}/{len(records)} queries.")
+
+    timing = {stage: round(seconds, 4) for stage, seconds in timing.items()}
+    timing["total"] = round(timer() - start_time, 4)
+    timing["queries"] = len(records)
+    timing["llm_calls"] = num_llm_calls
+    timing["llm_errors"] = num_errors
+    timing["answer_cache_hits"] = num_cache_hits
+    timing["queries_per_second"] = round(len(records) / timing["total"], 2) if records else 0.0
+    add_counter("llm_calls", num_llm_calls)
+    add_counter("llm_errors", num_errors)
+    add_counter("answer_cache_hits", num_cache_hits)
+
+    print(f"[INFO] Batch finished: {json.dumps(timing)}")
+    print(f"[INFO] Answers saved to '{output_path}'.")
+    return timing
@@ -0,0 +1,327 @@
+"""
+A long-lived query engine that keeps the FAISS index and the chunk store open in memory.
+
+Classes:
+- EngineState: index, chunk offsets, embeddings, BM25 index and documents of one published snapshot.
+- QueryEngine: loads the current snapshot once and switches to a new one when it is published
+  (see snapshots.py) without blocking running queries. Queries can be restricted to selected documents.
+
+Functions:
+- get_query_engine(): returns a process-wide QueryEngine instance (used by the CLI and Streamlit).
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter as timer
+from typing import NamedTuple
+
+import faiss
+import numpy as np
+
+from .bm25 import BM25Index
+from .chunk_store import ChunkStore
+from .config import (
+    BM25_WORKERS,
+    CHUNKS_DIR,
+    HNSW_EF_SEARCH,
+    HYBRID_CANDIDATES,
+    IVF_NPROBE,
+    TOP_K,
+)
+from .manifest import load_manifest
+from .retriever import reciprocal_rank_fusion, retrieve_top_k_chunks, search_index
+from .snapshots import current_snapshot
+from .tracing import log_debug
+
+
+class EngineState(NamedTuple):
+    """
+    Artifacts of one snapshot; they are loaded together and replaced together, so chunk ids
+    found in the index always match the chunk store of the same state.
+    """
+
+    version: str
+    index: faiss.Index
+    store: ChunkStore
+    offsets: np.ndarray
+    embeddings: np.ndarray
+    bm25: BM25Index | None
+    documents: dict
+    index_generation: int
+
+
+class QueryEngine:
+    """
+    Holds the FAISS index and the memory-mapped chunk offsets of the published snapshot.
+    Chunk texts are read from disk by id, only for retrieved chunks.
+
+    Before every search the engine reads the CURRENT pointer of the snapshots and loads a
+    newly published snapshot. Queries running meanwhile finish on the previous state: pass
+    the state returned by state() to all calls of one query to keep its chunk ids consistent.
+    """
+
+    def __init__(self, chunks_dir: str = CHUNKS_DIR):
+        self.chunks_dir = chunks_dir
+        self._state = None
+        self._lock = threading.Lock()
+        # Keyword searches of all queries (of concurrent requests too) run here
+        # while the calling threads search the FAISS index
+        self._keyword_executor = ThreadPoolExecutor(max_workers=BM25_WORKERS, thread_name_prefix="bm25")
+
+    def refresh(self) -> bool:
+        """
+        Loads the current snapshot if it was never loaded or a new one was published.
+        While one thread loads a new snapshot, other threads continue with the previous one.
+        Returns True if the artifacts were (re)loaded.
+        """
+        snapshot = current_snapshot(self.chunks_dir)
+        if snapshot is None:
+            raise FileNotFoundError(f"No published snapshot in '{self.chunks_dir}', documents are not processed.")
+        if self._state is not None and self._state.version == snapshot.version:
+            return False
+
+        # Only the first load waits for the lock
+        if not self._lock.acquire(blocking=self._state is None):
+            return False
+        try:
+            if self._state is not None and self._state.version == snapshot.version:
+                return False
+
+            start_time = timer()
+            store = ChunkStore(snapshot.store_dir)
+            index = faiss.read_index(snapshot.index_path)
+            offsets = store.load_offsets()
+            bm25 = BM25Index(snapshot.bm25_path) if os.path.exists(snapshot.bm25_path) else None
+            manifest = load_manifest(snapshot.manifest_path)
+            self._state = EngineState(
+                version=snapshot.version,
+                index=index,
+                store=store,
+                offsets=offsets,
+                embeddings=store.load_embeddings(),
+                bm25=bm25,
+                documents={
+                    file_path: (entry["start"], entry["end"])
+                    for file_path, entry in (manifest or {}).get("files", {}).items()
+                },
+                index_generation=store.index_generation,
+            )
+            end_time = timer()
+        finally:
+            self._lock.release()
+
+        print(
+            f"[INFO] Query engine loaded snapshot {snapshot.version}: {index.ntotal} vectors "
+            f"and {len(offsets)} chunks in {end_time - start_time:.3f} seconds."
+        )
+        return True
+
+    def state(self) -> EngineState:
+        """
+        Returns the loaded state of the current snapshot.
+        """
+        self.refresh()
+        return self._state
+
+    # Artifacts of the latest loaded state
+
+    @property
+    def index(self) -> faiss.Index:
+        return self.state().index
+
+    @property
+    def store(self) -> ChunkStore:
+        return self.state().store
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self.state().embeddings
+
+    @property
+    def index_generation(self) -> int:
+        return self.state().index_generation
+
+    def retrieve(
+        self,
+        query_embedding: np.ndarray,
+        k: int = TOP_K,
+        nprobe: int = IVF_NPROBE,
+        ef_search: int = HNSW_EF_SEARCH,
+        files: list[str] | None = None,
+        state: EngineState | None = None,
+    ) -> tuple[list[int], list[float]]:
+        """
+        Returns the top-k indices of the closest chunks for the given query embedding
+        and their cosine similarity scores. nprobe (IVF) and ef_search (HNSW) can be tuned per query.
+        With files only chunks of these documents are searched.
+        """
+        state = state or self.state()
+        return retrieve_top_k_chunks(
+            query_embedding=query_embedding,
+            k=k,
+            index=state.index,
+            store=state.store,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            id_ranges=self.id_ranges(files, state),
+        )
+
+    def retrieve_hybrid(
+        self,
+        query: str,
+        query_embedding: np.ndarray,
+        k: int = TOP_K,
+        candidates: int = HYBRID_CANDIDATES,
+        nprobe: int = IVF_NPROBE,
+        ef_search: int = HNSW_EF_SEARCH,
+        files: list[str] | None = None,
+        state: EngineState | None = None,
+    ) -> tuple[list[int], list[float], list[float]]:
+        """
+        Searches the FAISS index and the BM25 index concurrently (top `candidates` of each)
+        and merges the results with reciprocal rank fusion. With files only chunks of these
+        documents are searched.
+
+        Returns the top-k chunk ids with their exact cosine similarity to the query
+        (from the stored embeddings) and BM25 scores (0 if not matched by keywords).
+        Without a BM25 index this is vector search only.
+        """
+        [(indices, scores, keyword_scores)] = self.retrieve_hybrid_batch(
+            [query],
+            query_embedding,
+            k=k,
+            candidates=candidates,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            files=files,
+            state=state,
+        )
+        for idx, score, keyword_score in zip(indices, scores, keyword_scores):
+            log_debug(f"Index: {idx}, Cosine: {score:.4f}, BM25: {keyword_score:.4f}")
+        return indices, scores, keyword_scores
+
+    def retrieve_hybrid_batch(
+        self,
+        queries: list[str],
+        query_embeddings: np.ndarray,
+        k: int = TOP_K,
+        candidates: int = HYBRID_CANDIDATES,
+        nprobe: int = IVF_NPROBE,
+        ef_search: int = HNSW_EF_SEARCH,
+        files: list[str] | None = None,
+        state: EngineState | None = None,
+    ) -> list[tuple[list[int], list[float], list[float]]]:
+        """
+        retrieve_hybrid() for a batch of queries: all query embeddings are searched in one
+        index.search call while the BM25 searches run in the keyword threads.
+        Returns (chunk ids, cosine similarities, BM25 scores) per query.
+        """
+        state = state or self.state()
+        bm25 = state.bm25
+        id_ranges = self.id_ranges(files, state)
+        query_embeddings = np.atleast_2d(query_embeddings)
+        keyword_futures = (
+            [self._keyword_executor.submit(bm25.search, query, candidates, id_ranges) for query in queries]
+            if bm25
+            else None
+        )
+
+        batch_vector_ids, _ = search_index(
+            state.index,
+            query_embeddings,
+            candidates,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            id_ranges=id_ranges,
+            embeddings=state.embeddings,
+        )
+        batch_keyword = (
+            [future.result() for future in keyword_futures] if keyword_futures else [([], [])] * len(queries)
+        )
+
+        results = []
+        num_vector, num_keyword = 0, 0
+        for vector_ids, (keyword_ids, keyword_scores), query_embedding in zip(
+            batch_vector_ids, batch_keyword, query_embeddings
+        ):
+            vector_ids = [int(idx) for idx in vector_ids if idx >= 0]
+            indices = reciprocal_rank_fusion([vector_ids, keyword_ids], k=k)
+            scores = (state.embeddings[indices] @ query_embedding).tolist() if indices else []
+            keyword = dict(zip(keyword_ids, keyword_scores))
+            results.append((indices, scores, [keyword.get(idx, 0.0) for idx in indices]))
+            num_vector += len(vector_ids)
+            num_keyword += len(keyword_ids)
+
+        print(
+            f"[INFO] Hybrid search of {len(queries)} queries: {num_vector} vector "
+            f"and {num_keyword} keyword candidates."
+        )
+        return results
+
+    def search_batch(
+        self,
+        query_embeddings: np.ndarray,
+        k: int = TOP_K,
+        nprobe: int = IVF_NPROBE,
+        ef_search: int = HNSW_EF_SEARCH,
+        files: list[str] | None = None,
+        state: EngineState | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Searches a batch of query embeddings in one call.
+        Returns (indices, scores) arrays of shape (n_queries, k), -1 for missing results.
+        """
+        state = state or self.state()
+        return search_index(
+            state.index,
+            query_embeddings,
+            k,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            id_ranges=self.id_ranges(files, state),
+            embeddings=state.embeddings,
+        )
+
+    def list_documents(self) -> list[str]:
+        """
+        Returns paths of the indexed documents.
+        """
+        return sorted(self.state().documents)
+
+    def id_ranges(self, files: list[str] | None, state: EngineState | None = None) -> list[tuple[int, int]] | None:
+        """
+        Returns chunk id ranges of the given documents (full paths as in the manifest),
+        None if files is None (no filter).
+        """
+        if files is None:
+            return None
+        state = state or self.state()
+        selected = set(files)
+        return [
+            (start, end)
+            for file_path, (start, end) in sorted(state.documents.items(), key=lambda item: item[1])
+            if file_path in selected and end > start
+        ]
+
+    def get_texts(self, indices: list[int], state: EngineState | None = None) -> list[str]:
+        """
+        Returns chunk texts by their indices.
+        """
+        state = state or self.state()
+        return state.store.get_texts(indices, offsets=state.offsets)
+
+
+_query_engine = None
+_query_engine_lock = threading.Lock()
+
+
+def get_query_engine() -> QueryEngine:
+    """
+    Returns the process-wide QueryEngine, creating it on first use.
+    """
+    global _query_engine
+    with _query_engine_lock:
+        if _query_engine is None:
+            _query_engine = QueryEngine()
+    return _query_engine
@@ -0,0 +1,277 @@
+"""
+Concurrent query serving on top of the shared QueryEngine (used by server.py).
+
+Queries arriving at the same time are collected for QUERY_BATCH_WINDOW seconds (at most
+QUERY_BATCH_MAX_SIZE queries) and embedded in one encode call and searched in one index.search
+call. The rest of every query (re-ranking, answer cache, prompt) runs independently and the
+LLM calls of all queries are in flight concurrently (at most SERVICE_LLM_CONCURRENCY).
+
+Classes:
+- MicroBatcher: collects items submitted by coroutines into batches processed in a worker thread.
+- QueryService: answers queries with micro-batched embedding and retrieval and async LLM calls.
+"""
+
+import asyncio
+import json
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import perf_counter as timer
+
+from .answer_cache import AnswerCache, get_answer_cache
+from .config import (
+    ANSWER_CACHE_ENABLED,
+    BM25_MIN_SCORE,
+    EMBED_QUERY_BATCH_SIZE,
+    HYBRID_CANDIDATES,
+    HYBRID_SEARCH,
+    NO_RELEVANT_CONTEXT_ANSWER,
+    QUERY_BATCH_MAX_SIZE,
+    QUERY_BATCH_WINDOW,
+    RELEVANCE_THRESHOLD,
+    RERANK_CANDIDATES,
+    RERANKING,
+    SERVICE_LLM_CONCURRENCY,
+    TOP_K,
+)
+from .embedder import encode_texts
+from .llm_interface import async_client_response_groq, chat_template_groq, extract_answer
+from .query_engine import QueryEngine, get_query_engine
+from .reranker import Reranker, get_reranker
+from .tracing import add_counter, span, trace
+
+
+class MicroBatcher:
+    """
+    Collects items submitted concurrently and passes them to process_batch(items) -> results
+    in one call. A batch is closed after max_wait seconds from its first item or at max_batch_size
+    items; while a batch is processed in the worker thread, the next one is being collected.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[list], list],
+        max_batch_size: int = QUERY_BATCH_MAX_SIZE,
+        max_wait: float = QUERY_BATCH_WINDOW,
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="micro-batch")
+        self._queue = None
+        self._task = None
+
+    async def submit(self, item):
+        """
+        Adds an item to the next batch and returns its result.
+        """
+        # The queue and the collecting task belong to the event loop of the first call
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def _collect(self) -> list:
+        """
+        Waits for the first item, then collects more for at most max_wait seconds.
+        """
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Requests cancelled while waiting (e.g. closed connections) are not processed
+        return [(item, future) for item, future in batch if not future.done()]
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self.process_batch, [item for item, _ in batch]
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        self._executor.shutdown(wait=False)
+
+
+class QueryService:
+    """
+    Answers queries of many concurrent clients with one QueryEngine:
+    - queries are embedded and searched in micro-batches (grouped by document filter);
+    - chunks below the relevance threshold are dropped, optionally the rest is re-ranked;
+    - answers of near-duplicate queries come from the answer cache;
+    - LLM calls are made with the async client, at most llm_concurrency at a time.
+    """
+
+    def __init__(
+        self,
+        engine: QueryEngine = None,
+        cache: AnswerCache | None = None,
+        reranker: Reranker | None = None,
+        batch_window: float = QUERY_BATCH_WINDOW,
+        max_batch_size: int = QUERY_BATCH_MAX_SIZE,
+        llm_concurrency: int = SERVICE_LLM_CONCURRENCY,
+    ):
+        self.engine = engine if engine is not None else get_query_engine()
+        if cache is None and ANSWER_CACHE_ENABLED:
+            cache = get_answer_cache()
+        if reranker is None and RERANKING:
+            reranker = get_reranker()
+        self.cache = cache
+        self.reranker = reranker
+        self.num_candidates = RERANK_CANDIDATES if reranker is not None else TOP_K
+        self._batcher = MicroBatcher(self._retrieve_batch, max_batch_size=max_batch_size, max_wait=batch_window)
+        self._llm_slots = asyncio.Semaphore(llm_concurrency)
+
+    def _retrieve_batch(self, requests: list[tuple[str, tuple | None]]) -> list[tuple]:
+        """
+        Embeds (query, files) requests in one encode call and searches them in one call
+        per document filter. Returns (state, query_embedding, indices, scores, keyword_scores)
+        per request; the whole batch is searched in one snapshot (state) of the engine.
+        """
+        queries = [query for query, _ in requests]
+        with span("service_embed", queries=len(queries)):
+            query_embeddings = encode_texts(queries, batch_size=EMBED_QUERY_BATCH_SIZE)
+
+        # Queries restricted to the same documents are searched together
+        groups = {}
+        for position, (_, files) in enumerate(requests):
+            groups.setdefault(files, []).append(position)
+
+        state = self.engine.state()
+        results = [None] * len(requests)
+        with span("service_search", queries=len(queries), groups=len(groups), hybrid=HYBRID_SEARCH):
+            for files, positions in groups.items():
+                files = list(files) if files else None
+                if HYBRID_SEARCH:
+                    found = self.engine.retrieve_hybrid_batch(
+                        [queries[position] for position in positions],
+                        query_embeddings[positions],
+                        k=self.num_candidates,
+                        candidates=max(HYBRID_CANDIDATES, self.num_candidates),
+                        files=files,
+                        state=state,
+                    )
+                else:
+                    batch_indices, batch_scores = self.engine.search_batch(
+                        query_embeddings[positions], k=self.num_candidates, files=files, state=state
+                    )
+                    found = []
+                    for indices, scores in zip(batch_indices, batch_scores):
+                        indices = [int(idx) for idx in indices if idx >= 0]
+                        found.append((indices, scores[: len(indices)].tolist(), [0.0] * len(indices)))
+                for position, (indices, scores, keyword_scores) in zip(positions, found):
+                    results[position] = (state, query_embeddings[position], indices, scores, keyword_scores)
+        return results
+
+    async def answer(
+        self,
+        query: str,
+        files: list[str] | None = None,
+        relevance_threshold: float = RELEVANCE_THRESHOLD,
+    ) -> dict:
+        """
+        Answers one query. Returns a dict with "answer", "response" (full LLM response text),
+        "chunk_ids", "cached" and "seconds".
+        """
+        start_time = timer()
+        add_counter("queries")
+        loop = asyncio.get_running_loop()
+
+        with trace("service_query", filtered=files is not None) as root:
+            state, query_embedding, indices, scores, keyword_scores = await self._batcher.submit(
+                (query, tuple(files) if files else None)
+            )
+            indices = [
+                idx
+                for idx, score, keyword_score in zip(indices, scores, keyword_scores)
+                if score >= relevance_threshold or keyword_score >= BM25_MIN_SCORE
+            ]
+
+            if self.reranker is not None and len(indices) > 1:
+                with span("rerank", candidates=len(indices)):
+                    texts = self.engine.get_texts(indices, state)
+                    indices = await loop.run_in_executor(
+                        None, partial(self.reranker.rerank, query=query, indices=indices, texts=texts)
+                    )
+            indices = indices[:TOP_K]
+            generation = state.index_generation
+
+            cached = None
+            if indices and self.cache is not None:
+                with span("answer_cache_lookup"):
+                    cached = await loop.run_in_executor(
+                        None, self.cache.lookup, query_embedding, indices, generation
+                    )
+
+            if not indices:
+                add_counter("no_context_answers")
+                response_text = json.dumps({"thoughts": "", "answer": NO_RELEVANT_CONTEXT_ANSWER})
+            elif cached is not None:
+                add_counter("answer_cache_hits")
+                response_text = cached["response_text"]
+            else:
+                with span("prompt", chunks=len(indices)):
+                    dialogue_template = await loop.run_in_executor(
+                        None,
+                        partial(
+                            chat_template_groq,
+                            indices=indices,
+                            query=query,
+                            store=state.store,
+                            query_embedding=query_embedding,
+                            log=False,
+                        ),
+                    )
+                add_counter("llm_calls")
+                async with self._llm_slots:
+                    try:
+                        with span("llm", stream=False):
+                            response_text = await async_client_response_groq(dialogue_template=dialogue_template)
+                    except Exception:
+                        add_counter("llm_errors")
+                        raise
+                if self.cache is not None:
+                    await loop.run_in_executor(
+                        None, self.cache.put, query, query_embedding, indices, response_text, generation
+                    )
+            root.set(chunks=len(indices), cached=cached is not None)
+
+        return {
+            "answer": extract_answer(response_text),
+            "response": response_text,
+            "chunk_ids": indices,
+            "cached": cached is not None,
+            "seconds": round(timer() - start_time, 4),
+        }
+
+    def list_documents(self) -> list[str]:
+        return self.engine.list_documents()
+
+    def close(self) -> None:
+        self._batcher.close()
@@ -0,0 +1,185 @@
+"""
+Cross-encoder re-ranking of retrieved chunks.
+
+The bi-encoder search over-fetches RERANK_CANDIDATES chunks, a small cross-encoder scores
+every (query, chunk) pair in one batched pass and the best TOP_K chunks are kept.
+
+Latency is bounded: scoring runs in a worker thread and if it does not finish within
+the per-query budget, the bi-encoder order is used. The scoring still completes in the
+background and its scores are cached, so a repeated query is re-ranked from the cache.
+
+Classes:
+- Reranker: cross-encoder with a latency budget and an LRU cache of (query, chunk text) scores.
+
+Functions:
+- get_reranker(): returns a process-wide Reranker instance.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from time import perf_counter as timer
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from .config import (
+    RERANK_BATCH_SIZE,
+    RERANK_CACHE_SIZE,
+    RERANK_LATENCY_BUDGET,
+    RERANK_MAX_LENGTH,
+    RERANK_MODEL,
+    TOP_K,
+)
+from .tracing import log_debug
+
+if TYPE_CHECKING:
+    from sentence_transformers import CrossEncoder
+
+
+class Reranker:
+    """
+    Re-orders retrieved chunks by cross-encoder scores of (query, chunk text) pairs.
+    The model (and torch) is loaded on first use in the worker thread.
+    """
+
+    def __init__(
+        self,
+        model_name: str = RERANK_MODEL,
+        latency_budget: float | None = RERANK_LATENCY_BUDGET,
+        cache_size: int = RERANK_CACHE_SIZE,
+        batch_size: int = RERANK_BATCH_SIZE,
+        max_length: int = RERANK_MAX_LENGTH,
+    ):
+        self.model_name = model_name
+        self.latency_budget = latency_budget
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+        self._model = None
+        # (query, hash of chunk text) -> score, least recently used are evicted
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # One scoring pass at a time; a pass that exceeded the budget finishes here
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+
+    def _get_model(self) -> "CrossEncoder":
+        """
+        Returns the cross-encoder, loading it on first use (called only from the worker thread).
+        """
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+
+            start_time = timer()
+            self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu")
+            print(f"[INFO] Cross-encoder '{self.model_name}' loaded in {timer() - start_time:.2f} seconds.")
+        return self._model
+
+    def warm_up(self) -> None:
+        """
+        Starts loading the model in the worker thread, so the first queries do not exceed the budget.
+        """
+        self._executor.submit(self._get_model)
+
+    @staticmethod
+    def _key(query: str, text: str) -> tuple[str, bytes]:
+        """
+        Cache key of a (query, chunk text) pair; chunk ids change when the store is compacted, texts do not.
+        """
+        return query, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def _score_pairs(self, query: str, keys: list[tuple], texts: list[str]) -> np.ndarray:
+        """
+        Scores (query, text) pairs in one batched pass and caches the scores.
+        """
+        scores = self._get_model().predict(
+            [(query, text) for text in texts], batch_size=self.batch_size, show_progress_bar=False
+        )
+        scores = np.asarray(scores, dtype=np.float32)
+
+        if self.cache_size > 0:
+            with self._cache_lock:
+                for key, score in zip(keys, scores.tolist()):
+                    self._cache[key] = score
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return scores
+
+    def score(self, query: str, texts: list[str], latency_budget: float | None = None) -> np.ndarray | None:
+        """
+        Returns cross-encoder scores of texts for the query (cached pairs are not scored again).
+        Returns None if scoring does not finish within latency_budget seconds (None - no limit).
+        """
+        start_time = timer()
+        keys = [self._key(query, text) for text in texts]
+        scores = np.empty(len(texts), dtype=np.float32)
+
+        missing = []
+        with self._cache_lock:
+            for i, key in enumerate(keys):
+                cached = self._cache.get(key)
+                if cached is None:
+                    missing.append(i)
+                else:
+                    self._cache.move_to_end(key)
+                    scores[i] = cached
+
+        if missing:
+            future = self._executor.submit(
+                self._score_pairs, query, [keys[i] for i in missing], [texts[i] for i in missing]
+            )
+            timeout = None if latency_budget is None else max(latency_budget - (timer() - start_time), 0.0)
+            try:
+                scores[missing] = future.result(timeout=timeout)
+            except FutureTimeoutError:
+                # A pass still waiting behind another one is dropped, a running one finishes and is cached
+                future.cancel()
+                return None
+        return scores
+
+    def rerank(
+        self,
+        query: str,
+        indices: list[int],
+        texts: list[str],
+        k: int = TOP_K,
+    ) -> list[int]:
+        """
+        Returns the k chunk ids (of candidate indices with texts) with the highest cross-encoder scores.
+        If scoring exceeds the latency budget, the first k indices in the bi-encoder order are returned.
+        """
+        start_time = timer()
+        scores = self.score(query, texts, self.latency_budget)
+        elapsed = timer() - start_time
+        if scores is None:
+            print(
+                f"[INFO] Re-ranking exceeded the latency budget of {self.latency_budget:.3f} seconds, "
+                "bi-encoder order is used."
+            )
+            return list(indices[:k])
+
+        order = np.argsort(-scores, kind="stable")[:k]
+        print(f"[INFO] Re-ranked {len(indices)} candidates in {elapsed:.4f} seconds.")
+        for position in order:
+            log_debug(f"Index: {indices[position]}, Cross-encoder: {scores[position]:.4f}")
+        return [indices[position] for position in order]
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> Reranker:
+    """
+    Returns the process-wide Reranker, creating it (and starting the model loading) on first use.
+    """
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = Reranker()
+            _reranker.warm_up()
+    return _reranker
@@ -1,72 +1,490 @@
 """
 Functions for indexing and finding the nearest chunks by embeddings.
 
-- index_chunks(path_to_save, faiss_path): creates a FAISS index from the chunk embeddings and saves it.
-- retrieve_top_k_chunks(query_embedding, k, faiss_path) -> list[int]: finds the indices of the k nearest chunks to the query.
+- choose_index_type(ntotal): chooses flat, HNSW, IVF-Flat or IVF-PQ index by the number of vectors.
+- create_index(dim, index_type): creates an empty FAISS index with chunk ids (full or compressed vectors).
+- build_index(embeddings, ids, index_type): creates, trains (on a sample) and fills an index.
+- index_chunks(store_dir, faiss_path): creates a FAISS index from the chunk embeddings and saves it.
+- add_chunks_to_index(index, store, ids): adds embeddings of the given chunks to an index.
+- supports_removal(index): whether vectors can be removed by chunk id without a rebuild.
+- remove_chunks_from_index(index, ids): removes vectors of the given chunks from an index.
+- id_selector(id_ranges): FAISS selector of chunk ids in [start, end) ranges (metadata filters).
+- search_subset(embeddings, query_embeddings, id_ranges, k): exact search over a few memory-mapped id ranges.
+- search_index(index, query_embeddings, k, id_ranges): searches a batch of queries in one call,
+  optionally restricted to id ranges of selected documents.
+- rescore(embeddings, query_embeddings, indices, k): exact re-ranking of candidates of a compressed index.
+- retrieve_top_k_chunks(query_embedding, k, faiss_path) -> (list[int], list[float]): finds the indices and
+  cosine similarity scores of the k nearest chunks to the query.
+- recall_at_k(approx_indices, exact_indices): recall of an approximate search against the flat index.
+- reciprocal_rank_fusion(rankings, k): merges ranked lists of chunk ids (e.g. vector and BM25 results).
 
-The indices are used to retrieve the corresponding chunks in chunks_and_statistics.
+Embeddings are L2-normalized and searched by inner product (cosine similarity).
+The indices are stable chunk ids in the chunk store: IVF indexes store the ids in their lists,
+other types are wrapped in an IndexIDMap. Vectors of one document can be removed without
+rebuilding the index, except from HNSW (and IVF indexes wrapped in an IndexIDMap by older versions).
+
+Compressed indexes (COMPRESSED_INDEX_TYPES) keep int8/fp16 or PQ codes instead of float32 vectors
+(4x, 2x and 32x smaller with the default settings); their top candidates are re-scored
+with the full-precision embeddings memory-mapped from the chunk store.
 """
 
-import json
+from time import perf_counter as timer
 
 import faiss
 import numpy as np
 
-from .config import CHUNKS_PATH, INDEX_PATH, TOP_K
+from .chunk_store import ChunkStore
+from .config import (
+    AUTO_INDEX_LARGEST,
+    AUTO_INDEX_THRESHOLDS,
+    FILTER_BRUTE_FORCE_MAX,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+    HNSW_M,
+    INDEX_METRIC,
+    INDEX_TRAIN_SAMPLE,
+    INDEX_TYPE,
+    IVF_NLIST,
+    IVF_NPROBE,
+    PQ_M,
+    PQ_NBITS,
+    RESCORE_FACTOR,
+    RRF_K,
+    TOP_K,
+)
+from .snapshots import current_snapshot
+from .tracing import debug_enabled, log_debug
+
+FAISS_METRICS = {"l2": faiss.METRIC_L2, "ip": faiss.METRIC_INNER_PRODUCT}
+SCALAR_QUANTIZERS = {"sq8": faiss.ScalarQuantizer.QT_8bit, "fp16": faiss.ScalarQuantizer.QT_fp16}
+IVF_INDEX_TYPES = ("ivf_flat", "ivf_pq", "ivf_sq8")
+# Index types storing vectors (or codes) in one array, compacted when vectors are removed from the IndexIDMap
+FLAT_CODES_INDEX_TYPES = ("flat", "sq8", "fp16", "pq")
+# Index types whose scores are approximate because vectors are stored as codes
+COMPRESSED_INDEX_TYPES = ("sq8", "fp16", "pq", "ivf_pq", "ivf_sq8")
+
+
+def choose_index_type(ntotal: int) -> str:
+    """
+    Chooses an index type by the number of vectors (see AUTO_INDEX_THRESHOLDS).
+    """
+    for max_vectors, index_type in AUTO_INDEX_THRESHOLDS:
+        if ntotal < max_vectors:
+            return index_type
+    return AUTO_INDEX_LARGEST
+
+
+def resolve_index_type(ntotal: int, index_type: str = INDEX_TYPE) -> str:
+    """
+    Returns the configured index type, or the automatic choice for "auto".
+    """
+    return choose_index_type(ntotal) if index_type == "auto" else index_type
+
+
+def get_index_type(index: faiss.Index) -> str:
+    """
+    Returns the type name ("flat", "hnsw", "ivf_flat", "ivf_pq", "sq8", ...) of an index with chunk ids.
+    """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVFScalarQuantizer):
+        return "ivf_sq8"
+    if isinstance(inner, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    if isinstance(inner, faiss.IndexPQ):
+        return "pq"
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        return "fp16" if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "flat"
+
+
+def ivf_nlist(ntotal: int) -> int:
+    """
+    Number of IVF lists: IVF_NLIST or ~4*sqrt(n), with at least 39 training vectors per list.
+    """
+    nlist = IVF_NLIST or int(4 * np.sqrt(ntotal))
+    return int(max(1, min(nlist, ntotal // 39)))
 
 
-def index_chunks(path_to_save: str = CHUNKS_PATH, faiss_path: str = INDEX_PATH) -> None:
+def create_index(dim: int, index_type: str = "flat", ntotal: int = 0) -> faiss.Index:
     """
-    Indexes embeddings from the chunks_and_statistics.json file in FAISS and stores the index.
+    Creates an empty FAISS index with chunk ids (IVF indexes keep them in their lists, others in an IndexIDMap).
+    IVF, PQ and int8 indexes are sized for ntotal vectors and must be trained before adding vectors.
     """
-    # # Open file with chunks
-    with open(path_to_save, "r", encoding="utf-8") as file:
-        chunks_and_statistics = json.load(file)
-    print(f"[INFO] Chunks are loaded.")
+    metric = FAISS_METRICS[INDEX_METRIC]
+    if index_type == "flat":
+        inner = faiss.IndexFlat(dim, metric)
+    elif index_type in SCALAR_QUANTIZERS:
+        inner = faiss.IndexScalarQuantizer(dim, SCALAR_QUANTIZERS[index_type], metric)
+    elif index_type == "pq":
+        inner = faiss.IndexPQ(dim, PQ_M, PQ_NBITS, metric)
+    elif index_type == "hnsw":
+        inner = faiss.IndexHNSWFlat(dim, HNSW_M, metric)
+        inner.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        inner.hnsw.efSearch = HNSW_EF_SEARCH
+    elif index_type in IVF_INDEX_TYPES:
+        quantizer = faiss.IndexFlat(dim, metric)
+        nlist = ivf_nlist(ntotal)
+        if index_type == "ivf_flat":
+            inner = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+        elif index_type == "ivf_sq8":
+            inner = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, SCALAR_QUANTIZERS["sq8"], metric)
+        else:
+            inner = faiss.IndexIVFPQ(quantizer, dim, nlist, PQ_M, PQ_NBITS, metric)
+        inner.nprobe = IVF_NPROBE
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    # IVF lists keep the ids given to add_with_ids(), so vectors can be removed by id
+    if index_type in IVF_INDEX_TYPES:
+        return inner
+    return faiss.IndexIDMap(inner)
+
+
+def train_index(
+    index: faiss.Index, embeddings: np.ndarray, sample_size: int = INDEX_TRAIN_SAMPLE
+) -> None:
+    """
+    Trains an index (IVF, PQ, int8) on a random sample of embeddings; does nothing for flat, HNSW and fp16.
+    """
+    if index.is_trained:
+        return
+
+    start_time = timer()
+    rng = np.random.default_rng(0)
+    if embeddings.shape[0] > sample_size:
+        rows = np.sort(rng.choice(embeddings.shape[0], size=sample_size, replace=False))
+        sample = np.ascontiguousarray(embeddings[rows])
+    else:
+        sample = np.ascontiguousarray(embeddings)
+    index.train(sample)
+    end_time = timer()
 
-    # Get embeddings in numpy array
-    embedding_array = np.array(
-        [chunk["embedding"] for chunk in chunks_and_statistics], dtype="float32"
+    print(
+        f"[INFO] Index trained on {sample.shape[0]} vectors in {end_time - start_time:.2f} seconds."
     )
-    print(f"INFO Embedding shape: {embedding_array.shape}")
+
+
+def build_index(
+    embeddings: np.ndarray, ids: np.ndarray, index_type: str = INDEX_TYPE
+) -> faiss.Index:
+    """
+    Builds an index of the given type ("auto" - chosen by the number of vectors)
+    from embeddings rows with chunk ids, training it on a sample if needed.
+    """
+    index_type = resolve_index_type(embeddings.shape[0], index_type)
+    index = create_index(embeddings.shape[1], index_type, ntotal=embeddings.shape[0])
+    train_index(index, embeddings)
+
+    # Vectors are added in blocks to avoid copying the whole memory-mapped matrix
+    block_size = 65536
+    for start in range(0, embeddings.shape[0], block_size):
+        index.add_with_ids(
+            np.ascontiguousarray(embeddings[start : start + block_size]),
+            np.ascontiguousarray(ids[start : start + block_size], dtype="int64"),
+        )
+
+    print(f"[INFO] Built '{index_type}' index with {index.ntotal} vectors")
+    return index
+
+
+def index_chunks(
+    store_dir: str,
+    faiss_path: str,
+    ids: np.ndarray = None,
+    index_type: str = INDEX_TYPE,
+) -> faiss.Index:
+    """
+    Indexes embeddings from the chunk store in FAISS and stores the index.
+    Only chunks with the given ids are indexed (all chunks if ids is None).
+    Paths are those of an unpublished snapshot: published snapshots are never modified.
+    """
+    # Memory-mapped embeddings matrix
+    embedding_array = ChunkStore(store_dir).load_embeddings()
+    print(f"[INFO] Embedding shape: {embedding_array.shape}")
+
+    # Chunk ids are row numbers in the store
+    if ids is None:
+        ids = np.arange(embedding_array.shape[0], dtype="int64")
+    else:
+        ids = np.asarray(ids, dtype="int64")
+        embedding_array = embedding_array[ids]
 
     # Create indices for embeddings
-    index = faiss.IndexFlatL2(embedding_array.shape[1])
-    index.add(embedding_array)
+    index = build_index(embedding_array, ids, index_type=index_type)
 
     print(f"[INFO] In FAISS index {index.ntotal} vectors")
 
     # Save indices to a file
     faiss.write_index(index, faiss_path)
     print(f"[INFO] Indices were saved.")
+    return index
+
+
+def add_chunks_to_index(
+    index: faiss.Index, store: ChunkStore, ids: np.ndarray
+) -> None:
+    """
+    Adds embeddings of the chunks with the given ids from the store to the index.
+    """
+    ids = np.asarray(ids, dtype="int64")
+    if ids.size == 0:
+        return
+    embeddings = store.load_embeddings()
+    index.add_with_ids(np.ascontiguousarray(embeddings[ids]), ids)
+    print(f"[INFO] Added {ids.size} vectors, in FAISS index {index.ntotal} vectors")
+
+
+def get_index_metric(index: faiss.Index) -> str:
+    """
+    Returns the metric name ("l2" or "ip") of an index.
+    """
+    return "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+
+def to_similarity(index: faiss.Index, distances: np.ndarray) -> np.ndarray:
+    """
+    Converts search results into cosine similarity (embeddings are L2-normalized):
+    inner product is the similarity itself, squared L2 distance d gives 1 - d / 2.
+    """
+    if get_index_metric(index) == "ip":
+        return distances
+    return 1.0 - distances / 2.0
+
+
+def supports_removal(index: faiss.Index) -> bool:
+    """
+    Returns True if vectors can be removed by chunk id: flat and compressed flat indexes
+    in an IndexIDMap and IVF indexes with ids in their lists, not HNSW.
+    """
+    index_type = get_index_type(index)
+    if isinstance(index, faiss.IndexIDMap):
+        # IndexIDMap maps positions of the inner index to chunk ids and shifts them on removal;
+        # IVF lists keep their positions, so removed vectors would shift the ids of later ones
+        return index_type in FLAT_CODES_INDEX_TYPES
+    return index_type in IVF_INDEX_TYPES
+
+
+def remove_chunks_from_index(index: faiss.Index, ids: np.ndarray) -> bool:
+    """
+    Removes vectors of the chunks with the given ids from the index.
+    Returns False if the index does not support removal (see supports_removal) and must be rebuilt.
+    """
+    ids = np.asarray(ids, dtype="int64")
+    if ids.size == 0:
+        return True
+    if not supports_removal(index):
+        return False
+    removed = index.remove_ids(ids)
+    print(f"[INFO] Removed {removed} vectors, in FAISS index {index.ntotal} vectors")
+    return True
+
+
+def search_parameters(
+    index: faiss.Index,
+    nprobe: int = IVF_NPROBE,
+    ef_search: int = HNSW_EF_SEARCH,
+    selector: faiss.IDSelector = None,
+) -> faiss.SearchParameters | None:
+    """
+    Returns per-query search parameters (nprobe for IVF, efSearch for HNSW, an optional
+    id selector) or None for flat indexes without a selector.
+    """
+    index_type = get_index_type(index)
+    if index_type == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=ef_search, sel=selector)
+    if index_type in IVF_INDEX_TYPES:
+        return faiss.SearchParametersIVF(nprobe=nprobe, sel=selector)
+    return faiss.SearchParameters(sel=selector) if selector is not None else None
+
+
+def id_selector(id_ranges: list[tuple[int, int]]) -> faiss.IDSelector:
+    """
+    Returns a selector of chunk ids in the given [start, end) ranges.
+    """
+    if len(id_ranges) == 1:
+        return faiss.IDSelectorRange(*id_ranges[0])
+    ids = np.concatenate([np.arange(start, end) for start, end in id_ranges]).astype("int64")
+    return faiss.IDSelectorBatch(ids)
+
+
+def search_subset(
+    embeddings: np.ndarray,
+    query_embeddings: np.ndarray,
+    id_ranges: list[tuple[int, int]],
+    k: int = TOP_K,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Exact inner product search over the rows of the given id ranges of the (memory-mapped)
+    embedding matrix; only these rows are read. Returns arrays like search_index().
+    """
+    query_embeddings = np.asarray(query_embeddings, dtype="float32").reshape(-1, embeddings.shape[1])
+    num_queries = query_embeddings.shape[0]
+    indices = np.full((num_queries, k), -1, dtype="int64")
+    scores = np.full((num_queries, k), -np.inf, dtype="float32")
+
+    for start, end in id_ranges:
+        block_scores = query_embeddings @ np.asarray(embeddings[start:end]).T
+        block_ids = np.broadcast_to(np.arange(start, end, dtype="int64"), block_scores.shape)
+
+        # Merge the block with the current top-k
+        all_scores = np.hstack([scores, block_scores])
+        all_ids = np.hstack([indices, block_ids])
+        top = np.argsort(-all_scores, axis=1, kind="stable")[:, :k]
+        scores = np.take_along_axis(all_scores, top, axis=1)
+        indices = np.take_along_axis(all_ids, top, axis=1)
+
+    return indices, scores
+
+
+def recall_at_k(approx_indices: np.ndarray, exact_indices: np.ndarray) -> float:
+    """
+    Share of the exact top-k neighbours found by an approximate search (averaged over queries).
+    """
+    k = exact_indices.shape[1]
+    hits = sum(
+        len(set(approx_row[:k]) & set(exact_row))
+        for approx_row, exact_row in zip(approx_indices, exact_indices)
+    )
+    return hits / exact_indices.size
+
+
+def rescore(
+    embeddings: np.ndarray, query_embeddings: np.ndarray, indices: np.ndarray, k: int = TOP_K
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Re-ranks candidate chunk ids (n_queries, n_candidates; -1 for missing) by the exact inner
+    product with the stored embeddings. Only the candidate rows of the (memory-mapped) matrix are read.
+    Returns the top-k arrays like search_index().
+    """
+    scores = np.full(indices.shape, -np.inf, dtype="float32")
+    found = indices >= 0
+    if found.any():
+        # Every candidate row is read once, in file order
+        candidate_ids, rows = np.unique(indices[found], return_inverse=True)
+        vectors = np.asarray(embeddings[candidate_ids], dtype="float32")
+        query_rows = np.nonzero(found)[0]
+        scores[found] = np.einsum("cd,cd->c", vectors[rows], query_embeddings[query_rows])
+
+    top = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(indices, top, axis=1), np.take_along_axis(scores, top, axis=1)
+
+
+def search_index(
+    index: faiss.Index,
+    query_embeddings: np.ndarray,
+    k: int = TOP_K,
+    nprobe: int = IVF_NPROBE,
+    ef_search: int = HNSW_EF_SEARCH,
+    id_ranges: list[tuple[int, int]] | None = None,
+    embeddings: np.ndarray = None,
+    rescore_factor: int = RESCORE_FACTOR,
+    brute_force_max: int = FILTER_BRUTE_FORCE_MAX,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Searches all query embeddings in one index.search call.
+    Returns (indices, cosine similarity scores) arrays of shape (n_queries, k);
+    index -1 means there are fewer than k vectors.
+
+    With id_ranges only chunks of these [start, end) ranges are searched: subsets of at most
+    brute_force_max chunks exactly over the stored embeddings (cost grows with the
+    subset, not the corpus), larger ones in the index with an id selector. "pq" indexes
+    do not support selectors and always search subsets over the stored embeddings.
+
+    With embeddings, a compressed index returns rescore_factor * k candidates that are
+    re-ranked by their exact scores (see rescore()).
+    """
+    query_embeddings = np.ascontiguousarray(query_embeddings, dtype="float32")
+    if query_embeddings.ndim == 1:
+        query_embeddings = query_embeddings[np.newaxis, :]
+
+    selector = None
+    if id_ranges is not None:
+        subset_size = sum(end - start for start, end in id_ranges)
+        if subset_size == 0:
+            num_queries = query_embeddings.shape[0]
+            return np.full((num_queries, k), -1, dtype="int64"), np.full((num_queries, k), -np.inf, dtype="float32")
+        if get_index_type(index) == "pq":
+            if embeddings is None:
+                raise ValueError("Filtered search in a 'pq' index needs the stored embeddings.")
+            return search_subset(embeddings, query_embeddings, id_ranges, k)
+        if embeddings is not None and subset_size <= brute_force_max:
+            return search_subset(embeddings, query_embeddings, id_ranges, k)
+        selector = id_selector(id_ranges)
+
+    params = search_parameters(index, nprobe=nprobe, ef_search=ef_search, selector=selector)
+    if embeddings is not None and rescore_factor > 0 and get_index_type(index) in COMPRESSED_INDEX_TYPES:
+        _, candidates = index.search(query_embeddings, k * rescore_factor, params=params)
+        return rescore(embeddings, query_embeddings, candidates, k)
+    distances, indices = index.search(query_embeddings, k, params=params)
+    return indices, to_similarity(index, distances)
 
 
 def retrieve_top_k_chunks(
-    query_embedding: np.ndarray, k: int = TOP_K, faiss_path: str = INDEX_PATH
-) -> list[int]:
+    query_embedding: np.ndarray,
+    k: int = TOP_K,
+    faiss_path: str = None,
+    index: faiss.Index = None,
+    store: ChunkStore = None,
+    nprobe: int = IVF_NPROBE,
+    ef_search: int = HNSW_EF_SEARCH,
+    id_ranges: list[tuple[int, int]] | None = None,
+) -> tuple[list[int], list[float]]:
     """
-    Returns the top-k indices of the closest chunks for the given query embedding.
+    Returns the top-k indices of the closest chunks for the given query embedding
+    and their cosine similarity scores (highest first).
+
+    An already loaded index and chunk store (e.g. from QueryEngine) can be passed
+    to skip reading the index from disk; by default both are read from the current snapshot.
+    nprobe (IVF) and ef_search (HNSW) trade search speed for recall.
+    id_ranges restricts the search to chunks of selected documents.
+    Candidates of a compressed index are re-scored with the stored embeddings.
     """
-    # Load indices
-    index = faiss.read_index(faiss_path)
-    print(f"[INFO] FAISS indices are read.")
+    # Index and chunk store of the same snapshot
+    snapshot = None
+    if (index is None and faiss_path is None) or store is None:
+        snapshot = current_snapshot()
+        if snapshot is None:
+            raise FileNotFoundError("No published snapshot, documents are not processed.")
+    if index is None:
+        index = faiss.read_index(faiss_path or snapshot.index_path)
+        print(f"[INFO] FAISS indices are read.")
 
     if query_embedding.ndim == 1:
         query_embedding = query_embedding[np.newaxis, :]
 
     # Search top k indices of the nearest embeddings
-    distances, indices = index.search(query_embedding, k)
+    if store is None:
+        store = ChunkStore(snapshot.store_dir)
+    embeddings = store.load_embeddings()
+    indices, scores = search_index(
+        index, query_embedding[:1], k, nprobe=nprobe, ef_search=ef_search,
+        id_ranges=id_ranges, embeddings=embeddings,
+    )
+    found = indices[0] >= 0
+    scores, indices = scores[:, found], indices[:, found]
     print(f"[INFO] Retrieving top {k} neares chunks are finished.")
 
-    print(f"[DEBUG]")
-    # print top k chunks
-    with open(CHUNKS_PATH, "r", encoding="utf-8") as file:
-        chunks_and_statistics = json.load(file)
-    chunks_texts = [chunk["text"] for chunk in chunks_and_statistics]
-    print("[INFO] Nearest chunks:")
-    for dist, idx in zip(distances[0], indices[0]):
-        print(f"[INFO] Index: {idx}, Distance: {dist}")
-        print(chunks_texts[idx])
-        print("---")
-
-    return indices[0].tolist()
+    # print top k chunks (texts are read only for debug output)
+    if debug_enabled():
+        chunks_texts = store.get_texts(indices[0])
+        log_debug("Nearest chunks:")
+        for score, idx, text in zip(scores[0], indices[0], chunks_texts):
+            log_debug(f"Index: {idx}, Score: {score:.4f}\n{text}\n---")
+
+    return indices[0].tolist(), scores[0].tolist()
+
+
+def reciprocal_rank_fusion(rankings: list[list[int]], k: int = TOP_K, rrf_k: int = RRF_K) -> list[int]:
+    """
+    Merges ranked lists of chunk ids: every list adds 1 / (rrf_k + rank) to the score of its ids.
+    Returns the k ids with the highest fused score.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking, start=1):
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(fused, key=fused.get, reverse=True)[:k]
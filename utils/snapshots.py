@@ -0,0 +1,257 @@
+"""
+Versioned, immutable snapshots of the ingested data.
+
+Layout of CHUNKS_DIR:
+- snapshots/<version>/: one complete set of artifacts — chunk store files (see chunk_store.py),
+  faiss.index, bm25.npz and manifest.json;
+- CURRENT: name of the published snapshot.
+
+Ingestion writes a new snapshot directory and publishes it by atomically replacing CURRENT.
+Readers see the old or the new snapshot, never a half-written one; chunks and indexes of a
+published snapshot are never modified. Snapshots older than the SNAPSHOTS_KEEP newest ones
+are removed after publishing.
+
+The chunk store of a published snapshot is sealed (sizes of its files recorded, see chunk_store.py).
+One new snapshot per base hard-links the append-only store files and the BM25 index of the base
+and appends only the new rows, which readers of the base do not see; any other snapshot of the
+same base (e.g. after a failed ingestion) copies the sealed part of the files.
+
+Classes:
+- Snapshot: paths of the artifacts of one snapshot.
+
+Functions:
+- current_snapshot(chunks_dir): the published snapshot (files of older versions are migrated into one).
+- create_snapshot(base, chunks_dir): a new unpublished snapshot, optionally starting with the chunk store of base.
+- publish_snapshot(snapshot, chunks_dir): makes a snapshot current.
+- discard_snapshot(snapshot): removes an unpublished snapshot.
+- gc_snapshots(chunks_dir, keep): removes old snapshots.
+"""
+
+import os
+import shutil
+from time import perf_counter as timer
+from typing import NamedTuple
+
+from .chunk_store import CHUNKS_FILE, EMBEDDINGS_FILE, META_FILE, OFFSETS_FILE, ChunkStore, migrate_json_store
+from .config import CHUNKS_DIR, SNAPSHOTS_KEEP
+
+SNAPSHOTS_SUBDIR = "snapshots"
+CURRENT_FILE = "CURRENT"
+
+INDEX_FILE = "faiss.index"
+BM25_FILE = "bm25.npz"
+MANIFEST_FILE = "manifest.json"
+LEGACY_JSON_FILE = "chunks_and_statistics.json"
+# Created in a base snapshot by the one new snapshot that appends to its store files
+APPENDER_FILE = "APPENDED_BY"
+
+STORE_FILES = (CHUNKS_FILE, OFFSETS_FILE, EMBEDDINGS_FILE, META_FILE)
+SNAPSHOT_FILES = (*STORE_FILES, INDEX_FILE, BM25_FILE, MANIFEST_FILE)
+
+
+class Snapshot(NamedTuple):
+    version: str
+    path: str
+
+    @property
+    def store_dir(self) -> str:
+        return self.path
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.path, INDEX_FILE)
+
+    @property
+    def bm25_path(self) -> str:
+        return os.path.join(self.path, BM25_FILE)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.path, MANIFEST_FILE)
+
+
+def _snapshots_dir(chunks_dir: str) -> str:
+    return os.path.join(chunks_dir, SNAPSHOTS_SUBDIR)
+
+
+def _versions(chunks_dir: str) -> list[str]:
+    """
+    Returns versions of all snapshot directories (published or not), oldest first.
+    """
+    try:
+        names = os.listdir(_snapshots_dir(chunks_dir))
+    except FileNotFoundError:
+        return []
+    return sorted((name for name in names if name.isdigit()), key=int)
+
+
+def _fsync_dir(path: str) -> None:
+    """
+    Flushes directory entries (renames) to disk where the OS supports it.
+    """
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def current_snapshot(chunks_dir: str = CHUNKS_DIR) -> Snapshot | None:
+    """
+    Returns the published snapshot or None if documents were never processed.
+    Artifacts of the layout before snapshots (files directly in chunks_dir) are moved into the first snapshot.
+    """
+    try:
+        with open(os.path.join(chunks_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return _migrate_flat_layout(chunks_dir)
+    return Snapshot(version, os.path.join(_snapshots_dir(chunks_dir), version))
+
+
+def _claim_store(base: Snapshot, snapshot: Snapshot) -> bool:
+    """
+    Makes snapshot the only one allowed to append to the store files of base.
+    Returns False if another snapshot claimed them before.
+    """
+    try:
+        fd = os.open(os.path.join(base.path, APPENDER_FILE), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(snapshot.version)
+    return True
+
+
+def _link_or_copy(source: str, target: str) -> bool:
+    """
+    Hard-links source to target, or copies it where links are not supported. Returns True if linked.
+    """
+    try:
+        os.link(source, target)
+        return True
+    except OSError:
+        shutil.copyfile(source, target)
+        return False
+
+
+def create_snapshot(base: Snapshot | None = None, chunks_dir: str = CHUNKS_DIR) -> Snapshot:
+    """
+    Creates a new unpublished snapshot directory. With base it starts with the chunk store
+    and the BM25 index of base: linked if this snapshot may append to the store files,
+    otherwise copied; the published snapshot is not changed. Indexes and the manifest
+    are written by the ingestion.
+    """
+    start_time = timer()
+    os.makedirs(_snapshots_dir(chunks_dir), exist_ok=True)
+    versions = _versions(chunks_dir)
+    number = int(versions[-1]) + 1 if versions else 1
+    while True:
+        snapshot = Snapshot(f"{number:06d}", os.path.join(_snapshots_dir(chunks_dir), f"{number:06d}"))
+        try:
+            # mkdir fails if another process took this version
+            os.mkdir(snapshot.path)
+            break
+        except FileExistsError:
+            number += 1
+
+    if base is not None:
+        base_store = ChunkStore(base.store_dir)
+        sizes = base_store.read_meta().get("sizes") if base_store.exists() else None
+        share = bool(sizes) and _claim_store(base, snapshot)
+        linked = 0
+        for file_name in STORE_FILES:
+            source, target = os.path.join(base.path, file_name), os.path.join(snapshot.path, file_name)
+            if not os.path.exists(source):
+                continue
+            if file_name == META_FILE:
+                shutil.copyfile(source, target)
+            elif share and os.path.getsize(source) == sizes[file_name]:
+                linked += _link_or_copy(source, target)
+            else:
+                shutil.copyfile(source, target)
+                if sizes:
+                    # Rows appended by a failed ingestion are dropped
+                    os.truncate(target, sizes[file_name])
+        if base_store.exists():
+            ChunkStore(snapshot.store_dir).write_meta(sizes=None)
+        # BM25 index files are replaced, never modified: updated in the new snapshot (see bm25.py)
+        if os.path.exists(base.bm25_path):
+            linked += _link_or_copy(base.bm25_path, snapshot.bm25_path)
+        print(
+            f"[INFO] Snapshot {snapshot.version} created from {base.version} ({linked} files linked) "
+            f"in {timer() - start_time:.2f} seconds."
+        )
+    return snapshot
+
+
+def publish_snapshot(snapshot: Snapshot, chunks_dir: str = CHUNKS_DIR) -> None:
+    """
+    Seals the chunk store, flushes the snapshot files to disk and atomically points CURRENT to the snapshot.
+    """
+    ChunkStore(snapshot.store_dir).seal()
+    for file_name in SNAPSHOT_FILES:
+        path = os.path.join(snapshot.path, file_name)
+        if os.path.exists(path):
+            with open(path, "rb+") as f:
+                os.fsync(f.fileno())
+    _fsync_dir(snapshot.path)
+
+    current_path = os.path.join(chunks_dir, CURRENT_FILE)
+    tmp_path = current_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(snapshot.version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, current_path)
+    _fsync_dir(chunks_dir)
+    print(f"[INFO] Snapshot {snapshot.version} published.")
+
+
+def discard_snapshot(snapshot: Snapshot) -> None:
+    """
+    Removes an unpublished snapshot (e.g. of a failed ingestion).
+    """
+    shutil.rmtree(snapshot.path, ignore_errors=True)
+
+
+def gc_snapshots(chunks_dir: str = CHUNKS_DIR, keep: int = SNAPSHOTS_KEEP) -> list[str]:
+    """
+    Removes snapshots older than the `keep` newest published ones (the current snapshot is always kept).
+    Queries that started before a publish still read the replaced snapshot, so keep >= 2 leaves
+    in-flight queries time to finish. Snapshots newer than the current one may be in progress
+    and are not touched. Returns the removed versions.
+    """
+    current = current_snapshot(chunks_dir)
+    if current is None:
+        return []
+    published = [version for version in _versions(chunks_dir) if int(version) <= int(current.version)]
+    removed = published[: max(len(published) - max(keep, 1), 0)]
+    for version in removed:
+        shutil.rmtree(os.path.join(_snapshots_dir(chunks_dir), version), ignore_errors=True)
+    if removed:
+        print(f"[INFO] Removed {len(removed)} old snapshots.")
+    return removed
+
+
+def _migrate_flat_layout(chunks_dir: str) -> Snapshot | None:
+    """
+    Moves the index, BM25 index, manifest and chunk store files of older versions
+    (written directly to chunks_dir) into a published snapshot. Returns None if there are none.
+    """
+    legacy_json = os.path.join(chunks_dir, LEGACY_JSON_FILE)
+    flat_files = [name for name in SNAPSHOT_FILES if os.path.exists(os.path.join(chunks_dir, name))]
+    if INDEX_FILE not in flat_files:
+        return None
+
+    snapshot = create_snapshot(chunks_dir=chunks_dir)
+    for file_name in flat_files:
+        os.replace(os.path.join(chunks_dir, file_name), os.path.join(snapshot.path, file_name))
+    # One-time conversion of chunks_and_statistics.json of even older versions
+    migrate_json_store(json_path=legacy_json, store_dir=snapshot.store_dir)
+
+    publish_snapshot(snapshot, chunks_dir)
+    print(f"[INFO] Moved {len(flat_files)} files of '{chunks_dir}' into snapshot {snapshot.version}.")
+    return snapshot
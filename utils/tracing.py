@@ -0,0 +1,213 @@
+"""
+Lightweight tracing and metrics of pipeline stages.
+
+Spans time stages (embed, search, prompt, LLM call, ingestion phases); spans of one query
+or one data pipeline run share a trace id. Every finished span:
+- is added to a per-stage latency histogram;
+- is written as one JSON line to METRICS_JSONL_PATH (if set).
+Counters (queries, ingested chunks, prompt tokens, ...) are kept in memory.
+Histograms and counters are exported in the Prometheus text format, optionally
+served over HTTP on METRICS_PORT.
+
+Debug output (e.g. texts of retrieved chunks) is printed only with LOG_LEVEL=DEBUG.
+
+Functions:
+- debug_enabled(), log_debug(message): debug output gated by the log level.
+- configure(jsonl_path, log_level): changes the JSON lines output and the log level at runtime.
+- trace(name, **attributes): context manager (or decorator) starting a trace with a root span.
+- span(name, **attributes): context manager timing a stage, attributes can be added with span.set().
+- record_span(name, seconds, **attributes): records an already measured stage.
+- add_counter(name, value): increments a counter.
+- render_prometheus(): histograms and counters in the Prometheus text format.
+- start_metrics_server(port): serves render_prometheus() on http://host:port/metrics.
+"""
+
+import json
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter as timer
+
+from .config import LOG_LEVEL, METRICS_BUCKETS, METRICS_JSONL_PATH
+
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20}
+METRICS_PREFIX = "rag"
+
+_log_level = LOG_LEVELS.get(LOG_LEVEL.upper(), LOG_LEVELS["INFO"])
+_jsonl_path = METRICS_JSONL_PATH
+_jsonl_file = None
+
+_trace_id = ContextVar("trace_id", default=None)
+
+# Stage -> [count per bucket..., count above the last bucket], total seconds
+_histograms = {}
+_counters = {}
+_lock = threading.Lock()
+
+
+def debug_enabled() -> bool:
+    """
+    Returns True if debug output is enabled (LOG_LEVEL=DEBUG).
+    """
+    return _log_level <= LOG_LEVELS["DEBUG"]
+
+
+def log_debug(message: str) -> None:
+    """
+    Prints a debug message if debug output is enabled.
+    """
+    if debug_enabled():
+        print(f"[DEBUG] {message}")
+
+
+def configure(jsonl_path: str | None = None, log_level: str | None = None) -> None:
+    """
+    Sets the JSON lines output file of spans and/or the log level ("DEBUG" or "INFO").
+    """
+    global _jsonl_path, _jsonl_file, _log_level
+    with _lock:
+        if jsonl_path is not None and jsonl_path != _jsonl_path:
+            if _jsonl_file is not None:
+                _jsonl_file.close()
+            _jsonl_path, _jsonl_file = jsonl_path, None
+        if log_level is not None:
+            _log_level = LOG_LEVELS[log_level.upper()]
+
+
+class Span:
+    """
+    A timed stage; attributes are exported with the span to JSON lines.
+    """
+
+    __slots__ = ("name", "attributes", "start_time", "seconds")
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.start_time = timer()
+        self.seconds = 0.0
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def elapsed(self) -> float:
+        return timer() - self.start_time
+
+
+def record_span(name: str, seconds: float, **attributes) -> None:
+    """
+    Adds a stage time to its histogram and writes the span to the JSON lines output.
+    """
+    global _jsonl_file
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = [[0] * (len(METRICS_BUCKETS) + 1), 0.0]
+        histogram[0][bisect_left(METRICS_BUCKETS, seconds)] += 1
+        histogram[1] += seconds
+
+        if _jsonl_path:
+            if _jsonl_file is None:
+                _jsonl_file = open(_jsonl_path, "a", encoding="utf-8", buffering=1)
+            record = {
+                "time": round(time.time(), 6),
+                "trace": _trace_id.get(),
+                "span": name,
+                "seconds": round(seconds, 6),
+                **attributes,
+            }
+            _jsonl_file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times the enclosed stage and records it on exit (an exception is recorded as the "error" attribute).
+    """
+    current = Span(name, attributes)
+    try:
+        yield current
+    except BaseException as e:
+        current.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        current.seconds = current.elapsed()
+        record_span(name, current.seconds, **current.attributes)
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """
+    Starts a trace: spans inside it (in the same thread) share its trace id.
+    A trace inside another trace continues the outer one. Can be used as a decorator.
+    """
+    token = _trace_id.set(_trace_id.get() or uuid.uuid4().hex[:16])
+    try:
+        with span(name, **attributes) as root:
+            yield root
+    finally:
+        _trace_id.reset(token)
+
+
+def add_counter(name: str, value: float = 1) -> None:
+    """
+    Increments a counter (exported as rag_<name>_total).
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def render_prometheus() -> str:
+    """
+    Returns stage latency histograms and counters in the Prometheus text exposition format.
+    """
+    with _lock:
+        histograms = {name: ([*counts], total) for name, (counts, total) in _histograms.items()}
+        counters = dict(_counters)
+
+    metric = f"{METRICS_PREFIX}_stage_seconds"
+    lines = [f"# HELP {metric} Duration of pipeline stages.", f"# TYPE {metric} histogram"]
+    for name, (counts, total) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(METRICS_BUCKETS, counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{metric}_bucket{{stage="{name}",le="+Inf"}} {cumulative}')
+        lines.append(f'{metric}_sum{{stage="{name}"}} {total:.6f}')
+        lines.append(f'{metric}_count{{stage="{name}"}} {cumulative}')
+
+    for name, value in sorted(counters.items()):
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name}_total counter")
+        lines.append(f"{METRICS_PREFIX}_{name}_total {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serves the metrics on http://host:port/metrics from a daemon thread.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"[INFO] Metrics are served on http://{host}:{server.server_port}/metrics")
+    return server